@@ -0,0 +1,75 @@
+"""
+Run independent jobs over a process pool and summarise how they went.
+
+Used by the batch modes of the scripts in this repo, eg generating a pcb for
+every layout in a directory. Each job is timed and any exception is caught
+and reported in the summary instead of killing the whole run.
+"""
+
+from __future__ import print_function
+
+import sys
+import traceback
+import multiprocessing
+from collections import namedtuple
+from timeit import default_timer
+
+JobResult = namedtuple("JobResult", ("name", "ok", "elapsed", "result", "error"))
+
+
+def _run_job(task):
+    func, name, args = task
+    start = default_timer()
+    try:
+        result = func(*args)
+    except Exception:
+        return JobResult(name, False, default_timer() - start, None, traceback.format_exc())
+    return JobResult(name, True, default_timer() - start, result, None)
+
+
+def run(func, jobs, processes=None):
+    """
+    Call func(*args) for every (name, args) in jobs.
+
+    func must be a module level function so it can be sent to the worker
+    processes. processes=None uses one worker per cpu, processes=1 runs the
+    jobs in this process which is handy for debugging, as does calling it
+    from inside a worker. Returns a JobResult
+    per job in the same order as jobs.
+    """
+    tasks = [(func, name, tuple(args)) for name, args in jobs]
+    # A pool worker can't start a pool of its own, eg a layout that writes
+    # its schematic sheets in parallel while batch mode runs it in a worker
+    if processes == 1 or len(tasks) <= 1 or multiprocessing.current_process().daemon:
+        return [_run_job(task) for task in tasks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_run_job, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def summary(results, stream=None):
+    """Print a per job table plus any tracebacks, returns the failure count."""
+    stream = sys.stdout if stream is None else stream
+    if not results:
+        print("No jobs were run", file=stream)
+        return 0
+    width = max(len(result.name) for result in results)
+    failed = [result for result in results if not result.ok]
+    for result in results:
+        if result.ok:
+            status = "ok" if result.result is None else str(result.result)
+        else:
+            status = "FAILED: " + result.error.strip().splitlines()[-1]
+        print("{name:<{width}}  {elapsed:8.3f}s  {status}".format(
+            name=result.name, width=width, elapsed=result.elapsed, status=status), file=stream)
+    for result in failed:
+        print("", file=stream)
+        print("{}:".format(result.name), file=stream)
+        print(result.error.rstrip(), file=stream)
+    print("", file=stream)
+    print("{} jobs, {} failed, {:.3f}s total job time".format(
+        len(results), len(failed), sum(result.elapsed for result in results)), file=stream)
+    return len(failed)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark the precompiled pcb emitter against the old str.format path.
+
+    python3 bench_emitter.py [keys] [rounds]
+
+Both paths write the same modules for a square grid of keys into a scratch
+file; the outputs are compared byte for byte before any timing is reported.
+"""
+
+import os
+import sys
+import codecs
+import tempfile
+import importlib.util
+from timeit import default_timer
+
+from pcb_emitter import PcbEmitter
+
+here = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location("layout", os.path.join(here, "layout-python3.py"))
+layout = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(layout)
+
+
+def key_values(keys):
+    columns = 40
+    for i in range(1, keys + 1):
+        x = layout.x_origin + (i - 1) % columns
+        y = layout.y_origin + (i - 1) // columns
+        timestamp = 1000000 + i
+        yield (
+            dict(
+                reference="SW_%d" % i,
+                x_pos=x * layout.pcb_spacing,
+                y_pos=y * layout.pcb_spacing,
+                rotate=layout.switch_rotate,
+                tstamp=str(timestamp),
+                tedit=str(timestamp),
+            ),
+            dict(
+                reference="D%d" % i,
+                x_pos=x * layout.pcb_spacing + layout.diode_x_offset,
+                y_pos=y * layout.pcb_spacing + layout.diode_y_offset,
+                rotate=layout.diode_rotate,
+                label_x_pos=layout.diode_label_x_offset,
+                label_y_pos=layout.diode_label_y_offset,
+                label_rotate=layout.diode_label_rotate,
+                tstamp=str(timestamp),
+                tedit=str(timestamp),
+            ),
+        )
+
+
+def format_path(file_name, values):
+    # What place_text_footprint used to do: format the whole template and
+    # issue a codecs write for every switch and every diode.
+    with codecs.open(file_name, mode="w", encoding="utf-8") as pcb_txt:
+        for switch, diode in values:
+            pcb_txt.write(layout.footprints[layout.footprint_name].format(**switch))
+            pcb_txt.write(layout.footprints[layout.diode_template].format(**diode))
+
+
+def emitter_path(file_name, values):
+    emitter = PcbEmitter(layout.footprints)
+    for switch, diode in values:
+        emitter.add(layout.footprint_name, switch)
+        emitter.add(layout.diode_template, diode)
+    with open(file_name, mode="wb") as pcb_txt:
+        emitter.write(pcb_txt)
+
+
+def best_of(rounds, func, *args):
+    best = None
+    for _ in range(rounds):
+        start = default_timer()
+        func(*args)
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    values = list(key_values(keys))
+    scratch = tempfile.mkdtemp()
+    old_name = os.path.join(scratch, "format.kicad_pcb")
+    new_name = os.path.join(scratch, "emitter.kicad_pcb")
+    try:
+        format_path(old_name, values)
+        emitter_path(new_name, values)
+        with open(old_name, "rb") as old, open(new_name, "rb") as new:
+            if old.read() != new.read():
+                sys.exit("Outputs differ, not benchmarking")
+        old_time = best_of(rounds, format_path, old_name, values)
+        new_time = best_of(rounds, emitter_path, new_name, values)
+    finally:
+        for name in (old_name, new_name):
+            if os.path.exists(name):
+                os.remove(name)
+        os.rmdir(scratch)
+    print("{} keys, {} + {} templates, best of {}".format(
+        keys, layout.footprint_name, layout.diode_template, rounds))
+    print("  str.format + codecs: {:8.2f} ms".format(old_time * 1000))
+    print("  compiled emitter:    {:8.2f} ms".format(new_time * 1000))
+    print("  speedup:             {:8.2f}x".format(old_time / new_time))
+
+
+if __name__ == "__main__":
+    main()
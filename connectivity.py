@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""
+Connectivity checks for keyboard netlists (.net) and boards (.kicad_pcb).
+
+Every pin is joined to the nets it is on in a union-find, so two nets that
+share a pin (a pin listed on two nets, or two pads of a footprint with the
+same number but different nets) end up in one group. From there:
+
+  - groups with more than one row/column net are shorts
+  - a diode whose pins reach more than one row is shared between rows
+  - every switch gets a matrix position, its column and the row behind its
+    diode, and two switches on the same position are reported unless they
+    are wired in parallel (alternative footprints for one key)
+  - LED pins (K, A) of switches that lead nowhere are floating, only checked
+    when the board wires LEDs at all
+
+Switches are the parts with SW1/SW2 pins, diodes the parts whose reference
+starts with D, rows and columns the nets called R<n> and C<n>, like
+layout.py and smk65.py name them. All of it is close to linear in the number
+of pins, checking every board in the repo takes well under a second:
+
+    connectivity.py .
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import argparse
+from collections import defaultdict, namedtuple
+
+import batch
+from kicad_sexpr import Index, child_spans, parse
+
+ERROR = "error"
+WARNING = "warning"
+
+Finding = namedtuple("Finding", ("level", "ref", "message"))
+
+SWITCH_PINS = ("SW1", "SW2")
+LED_PINS = ("K", "A")
+DIODE_PREFIX = "D"
+
+row_net = re.compile(r"^R(\d+)$")
+column_net = re.compile(r"^C(\d+)$")
+_pad_number = re.compile(br'\(pad\s+("(?:[^"\\]|\\.)*"|[^\s()]+)')
+_pad_net = re.compile(br'\(net\s+(\d+)')
+
+file_types = (".net", ".kicad_pcb")
+
+
+class UnionFind(object):
+    """Disjoint sets of hashable items, with path halving and union by size."""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, item):
+        parent = self.parent
+        if item not in parent:
+            parent[item] = item
+            self.size[item] = 1
+            return item
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def groups(self):
+        """root -> [items]"""
+        groups = defaultdict(list)
+        for item in self.parent:
+            groups[self.find(item)].append(item)
+        return groups
+
+
+def netlist_pins(data):
+    """(ref, pin, net) for every node of a KiCad netlist (.net)."""
+    tree = parse(data)
+    for section in tree[1:]:
+        if not isinstance(section, list) or section[0] != "nets":
+            continue
+        for net in section[1:]:
+            fields = dict((item[0], item) for item in net[1:] if isinstance(item, list))
+            name = fields["name"][1] if "name" in fields else ""
+            for node in net[1:]:
+                if isinstance(node, list) and node[0] == "node":
+                    values = dict((item[0], item[1]) for item in node[1:] if isinstance(item, list))
+                    yield values["ref"], values["pin"], name
+
+
+def board_pins(data):
+    """(ref, pad, net) for every pad of every module of a .kicad_pcb, net is None when unconnected."""
+    index = Index(data)
+    names = index.nets()
+    for node in index.nodes(b"module"):
+        ref = node.reference()
+        for kind, start, end in child_spans(data, node.start, node.end):
+            if kind != b"pad":
+                continue
+            number = _pad_number.match(data, start).group(1).strip(b'"').decode("utf-8")
+            if not number:
+                continue
+            net = None
+            for child, child_start, child_end in child_spans(data, start, end):
+                if child == b"net":
+                    net = names.get(int(_pad_net.match(data, child_start).group(1))) or None
+            yield ref, number, net
+
+
+def read_pins(file_name):
+    with open(file_name, mode="rb") as data_file:
+        data = data_file.read()
+    if file_name.endswith(".net"):
+        return list(netlist_pins(data))
+    return list(board_pins(data))
+
+
+def _matrix_net(name):
+    return bool(row_net.match(name) or column_net.match(name))
+
+
+def check(pins, check_leds=None):
+    """
+    Check the connectivity of pins, an iterable of (ref, pin, net), returns
+    a list of Findings. check_leds None checks LED pins only if any are
+    connected.
+    """
+    sets = UnionFind()
+    pin_nets = defaultdict(set)
+    part_pins = defaultdict(set)
+    for ref, pin, net in pins:
+        key = (ref, pin)
+        part_pins[ref].add(pin)
+        sets.find(key)
+        if net:
+            pin_nets[key].add(net)
+            # Nets are plain strings and pins tuples, so they can't collide
+            sets.union(key, net)
+    findings = []
+    groups = sets.groups()
+    group_nets = dict((root, sorted(item for item in items if not isinstance(item, tuple)))
+                      for root, items in groups.items())
+
+    # Shorts, a group can only hold several nets through pins that are on both
+    joins = defaultdict(list)
+    shorted = set()
+    for key, nets in pin_nets.items():
+        if len(nets) > 1:
+            joins[sets.find(key)].append(key)
+    for root, keys in sorted(joins.items(), key=lambda item: group_nets[item[0]]):
+        nets = group_nets[root]
+        matrix_nets = [net for net in nets if _matrix_net(net)]
+        if len(matrix_nets) > 1:
+            shorted.add(root)
+        findings.append(Finding(
+            ERROR if len(matrix_nets) > 1 else WARNING, keys[0][0],
+            "Nets {} are shorted through {}".format(", ".join(nets), ", ".join(
+                "{} pin {}".format(ref, pin) for ref, pin in sorted(keys)))))
+
+    # Rows behind every diode, groups already reported as shorts are not
+    # reported again for every part on them
+    group_diodes = defaultdict(set)
+    diode_rows = {}
+    shorted_diodes = set()
+    for ref in sorted(part_pins):
+        if not ref.startswith(DIODE_PREFIX):
+            continue
+        rows = set()
+        roots = set(sets.find((ref, pin)) for pin in part_pins[ref])
+        for root in roots:
+            group_diodes[root].add(ref)
+            rows.update(net for net in group_nets[root] if row_net.match(net))
+        diode_rows[ref] = rows
+        if roots & shorted:
+            shorted_diodes.add(ref)
+        elif len(rows) > 1:
+            findings.append(Finding(ERROR, ref, "Diode is on rows {}".format(", ".join(sorted(rows)))))
+
+    # Matrix positions of the switches
+    switches = sorted(ref for ref, refs_pins in part_pins.items() if refs_pins & set(SWITCH_PINS))
+    positions = defaultdict(list)
+    for ref in switches:
+        columns, rows = set(), set()
+        roots = []
+        skip = False
+        for pin in SWITCH_PINS:
+            root = sets.find((ref, pin))
+            roots.append(root)
+            columns.update(net for net in group_nets[root] if column_net.match(net))
+            skip = skip or root in shorted
+            for diode in group_diodes.get(root, ()):
+                rows.update(diode_rows[diode])
+                skip = skip or diode in shorted_diodes
+        if len(columns) == 1 and len(rows) == 1:
+            positions[rows.pop(), columns.pop()].append((ref, frozenset(roots)))
+        elif (len(columns) > 1 or len(rows) > 1) and not skip:
+            findings.append(Finding(ERROR, ref, "Switch is on more than one matrix position, columns: {} rows: {}".format(
+                ", ".join(sorted(columns)) or "-", ", ".join(sorted(rows)) or "-")))
+    for (row, column), refs in sorted(positions.items()):
+        # Footprints wired in parallel are alternatives for the same key
+        if len(set(roots for _, roots in refs)) > 1:
+            findings.append(Finding(ERROR, refs[0][0], "Multiple switches on {} {}: {}".format(
+                row, column, ", ".join(ref for ref, _ in refs))))
+
+    # Floating LED pins
+    if check_leds is None:
+        check_leds = any(len(groups[sets.find((ref, pin))]) > 2
+                         for ref in switches for pin in LED_PINS if pin in part_pins[ref])
+    if check_leds:
+        for ref in switches:
+            for pin in LED_PINS:
+                if pin not in part_pins[ref] or len(groups[sets.find((ref, pin))]) <= 2:
+                    findings.append(Finding(WARNING, ref, "LED pin {} is floating".format(pin)))
+    return findings
+
+
+def check_file(file_name, check_leds=None):
+    return check(read_pins(file_name), check_leds)
+
+
+def find_files(paths):
+    """The .net and .kicad_pcb files in paths, directories are searched."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for directory, subdirectories, file_names in os.walk(path):
+            subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+            files.extend(os.path.join(directory, name) for name in sorted(file_names) if name.endswith(file_types))
+    return files
+
+
+def main(paths, check_leds=None, processes=None):
+    """Check every file, prints the findings and returns the number of files with errors or failures."""
+    files = find_files(paths)
+    results = batch.run(check_file, [(name, (name, check_leds)) for name in files], processes)
+    failed = 0
+    summaries = []
+    for result in results:
+        if result.ok:
+            findings = result.result
+            for finding in findings:
+                print("{}: {}: {} {}".format(result.name, finding.level.upper(), finding.ref, finding.message))
+            errors = sum(1 for finding in findings if finding.level == ERROR)
+            failed += 1 if errors else 0
+            result = result._replace(result="{} errors, {} warnings".format(errors, len(findings) - errors))
+        summaries.append(result)
+    if files:
+        print("")
+    return failed + batch.summary(summaries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", metavar="PATH", help=".net or .kicad_pcb files, or directories to search")
+    leds = parser.add_mutually_exclusive_group()
+    leds.add_argument("--leds", action="store_true", dest="check_leds", default=None,
+                      help="always check the LED pins")
+    leds.add_argument("--no-leds", action="store_false", dest="check_leds", help="never check the LED pins")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    sys.exit(1 if main(args.paths, args.check_leds, args.jobs) else 0)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""
+Check that the layout, the board, the drill file and the plates of a
+project agree on where the switches are.
+
+In 103key-project they come from different steps (layout.py, KiCad's
+exporters, a plate generator), nothing but this ties them together. The
+switch centres are taken from each of them:
+
+  - the board: modules whose reference matches --switches (SW_X4Y1_3, S1, K1...),
+    this is what the others are compared with
+  - the KLE json: every switch at pitch mm per key unit
+  - Excellon files: the hits of the tool with the diameter of the hole in
+    the middle of the switch footprint (3.988 for MX), holes of the same
+    size of other parts (stabilizers) are left out
+  - plate DXFs: the centres of the switch cutouts, closed loops of lines
+    with two sides --cutout mm apart each way
+
+The files use different origins (and y points up in the drill file and the
+DXF), so every set is first moved onto the board: a vote over the offsets
+from some of its points to all switches, then the median of the matched
+offsets. The centres are then matched to the switches through a KD-tree
+(see excellon.py), nearest pairs first, and a switch is
+
+  - shifted when its centre is more than --tolerance mm off
+  - missing when there is nothing within --radius mm
+  - extra when a centre has no switch
+
+which keeps a project at O(n log n).
+
+    consistency.py .
+
+finds the projects (directories with a .kicad_pcb) in the repo, checks them
+in parallel and exits non-zero on errors, for a release check.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import argparse
+from collections import namedtuple, Counter
+
+import batch
+import drc
+import dxf
+import kle
+import excellon
+
+ERROR = "error"
+WARNING = "warning"
+
+Finding = namedtuple("Finding", ("level", "artifact", "ref", "message"))
+# One artifact's switch centres on the board's frame, with the offset that got them there
+Centres = namedtuple("Centres", ("name", "points", "offset"))
+
+switch_refs = r"(SW_?\w*|S|K)\d+$"
+board_types = (".kicad_pcb",)
+drill_types = (".drl", ".drd")
+plate_types = (".dxf",)
+
+
+def board_switches(modules, pattern=switch_refs):
+    """[(ref, x, y), ...] of the switch modules."""
+    pattern = re.compile(pattern)
+    return [(module.ref, module.x, module.y) for module in modules if pattern.match(module.ref)]
+
+
+def _holes(modules):
+    """(module, x, y, diameter) of every round drill hole."""
+    for number, module in enumerate(modules):
+        for shape in drc.module_shapes(number, module):
+            if shape.kind == drc.HOLE and shape.segment[:2] == shape.segment[2:]:
+                yield module, shape.segment[0], shape.segment[1], 2 * shape.radius
+
+
+def centre_hole(modules, pattern=switch_refs):
+    """Diameter of the hole in the middle of the first switch, None if it has none."""
+    pattern = re.compile(pattern)
+    for module, x, y, diameter in _holes(modules):
+        if pattern.match(module.ref) and abs(x - module.x) < 1e-3 and abs(y - module.y) < 1e-3:
+            return diameter
+    return None
+
+
+def other_holes(modules, diameter, pattern=switch_refs, tolerance=0.01):
+    """(x, y) of the holes of diameter in modules that aren't switches."""
+    pattern = re.compile(pattern)
+    return [(x, y) for module, x, y, size in _holes(modules)
+            if not pattern.match(module.ref) and abs(size - diameter) <= tolerance]
+
+
+def layout_centres(file_name, pitch=19.05):
+    """Switch centres of a KLE json file, in mm with y down."""
+    with open(file_name) as layout_file:
+        table = kle.parse(json.load(layout_file))
+    _, ((xs, ys),) = table.placements([(0.0, 0.0)], pitch)
+    return list(zip(xs, ys))
+
+
+def drill_centres(file_name, diameter, tolerance=0.01):
+    """The hits of the tools of diameter mm in an Excellon file, with y down."""
+    drill = excellon.read(file_name)
+    points = []
+    for tool, size in drill.tools.items():
+        if abs(size - diameter) <= tolerance:
+            points.extend((x, -y) for x, y in drill.hits[tool].tolist())
+    return points
+
+
+def _pairs(values, size, tolerance):
+    """Pairs (low, high) of values size apart."""
+    values = sorted(set(round(value, 3) for value in values))
+    pairs = []
+    for n, low in enumerate(values):
+        for high in values[n + 1:]:
+            if high - low > size + tolerance:
+                break
+            if abs(high - low - size) <= tolerance:
+                pairs.append((low, high))
+    return pairs
+
+
+def _bounded(lines, across, low, high, tolerance):
+    """Whether lines has a line at across on each side that stays within low and high."""
+    return all(any(abs(at - side) < 1e-3 and low - tolerance <= start and end <= high + tolerance
+                   for at, start, end in lines) for side in across)
+
+
+def cutout_centres(loops, size=14.0, tolerance=0.2):
+    """
+    Centres of the switch cutouts in loops (see dxf.Drawing.loops), with y
+    down: loops with a square of sides size apart, where the sides of each
+    pair lie between the other pair. Stabilizer cutouts joined to a switch cutout have sides
+    size apart too, but they stick out of the square.
+    """
+    centres = []
+    for loop in loops:
+        points = loop.tolist()
+        loop = [(x0, y0, x1, y1) for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1])]
+        vertical = [(x0, min(y0, y1), max(y0, y1)) for x0, y0, x1, y1 in loop if abs(x0 - x1) < 1e-3]
+        horizontal = [(y0, min(x0, x1), max(x0, x1)) for x0, y0, x1, y1 in loop if abs(y0 - y1) < 1e-3]
+        found = []
+        for left, right in _pairs([x for x, _, _ in vertical], size, tolerance):
+            for top, bottom in _pairs([y for y, _, _ in horizontal], size, tolerance):
+                if (_bounded(vertical, (left, right), top, bottom, tolerance) and
+                        _bounded(horizontal, (top, bottom), left, right, tolerance)):
+                    found.append(((left + right) / 2, -(top + bottom) / 2))
+        # A notched cutout is one square, whichever notch sides matched
+        if found:
+            centres.append(min(found))
+    return sorted(centres)
+
+
+def plate_centres(file_name, size=14.0, tolerance=0.2):
+    return cutout_centres(dxf.read(file_name).loops(), size, tolerance)
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def align(reference, points, grid=0.5, samples=64):
+    """
+    (dx, dy) that moves points onto reference: the offset from up to samples
+    of points to every reference point that comes up most often (on a grid
+    mm grid), refined by the median offset of the pairs it matches.
+    """
+    if not reference or not points:
+        return 0.0, 0.0
+    votes = Counter()
+    for px, py in points[::max(1, len(points) // samples)]:
+        for rx, ry in reference:
+            votes[int(round((rx - px) / grid)), int(round((ry - py) / grid))] += 1
+    (gx, gy), _ = min(votes.items(), key=lambda item: (-item[1], abs(item[0][0]) + abs(item[0][1]), item[0]))
+    dx, dy = gx * grid, gy * grid
+    tree = excellon.KDTree([x for x, _ in reference], [y for _, y in reference])
+    offsets = []
+    for px, py in points:
+        nearest = tree.nearest(px + dx, py + dy)[0]
+        rx, ry = reference[nearest]
+        if abs(rx - px - dx) <= grid and abs(ry - py - dy) <= grid:
+            offsets.append((rx - px, ry - py))
+    if offsets:
+        dx, dy = _median([x for x, _ in offsets]), _median([y for _, y in offsets])
+    return dx, dy
+
+
+def match(reference, points, radius=9.5, candidates=3):
+    """
+    One to one pairs of reference and points, nearest first, no further
+    apart than radius: ([(i, j, distance), ...], unmatched i, unmatched j).
+    """
+    pairs = []
+    if points:
+        tree = excellon.KDTree([x for x, _ in points], [y for _, y in points])
+        for i, (x, y) in enumerate(reference):
+            for j in tree.nearest(x, y, candidates):
+                distance = ((points[j][0] - x) ** 2 + (points[j][1] - y) ** 2) ** 0.5
+                if distance <= radius:
+                    pairs.append((distance, i, j))
+    pairs.sort()
+    used_i, used_j = set(), set()
+    matched = []
+    for distance, i, j in pairs:
+        if i not in used_i and j not in used_j:
+            used_i.add(i)
+            used_j.add(j)
+            matched.append((i, j, distance))
+    return (sorted(matched), [i for i in range(len(reference)) if i not in used_i],
+            [j for j in range(len(points)) if j not in used_j])
+
+
+def compare(switches, centres, tolerance=0.25, radius=9.5, expected=()):
+    """
+    Findings for one artifact's Centres against the board's switches, [(ref,
+    x, y), ...]. Unmatched centres within tolerance of an expected point
+    (another part's hole) are fine, as are missing switches sitting on a
+    matched one (clones).
+    """
+    reference = [(x, y) for _, x, y in switches]
+    findings = []
+    matched, missing, extra = match(reference, centres.points, radius)
+    for i, j, distance in matched:
+        if distance > tolerance:
+            ref, x, y = switches[i]
+            findings.append(Finding(ERROR, centres.name, ref, "is {:.3f}mm off ({:+.3f}, {:+.3f})".format(
+                distance, centres.points[j][0] - x, centres.points[j][1] - y)))
+    placed = [reference[i] for i, _, _ in matched]
+    for i in missing:
+        ref, x, y = switches[i]
+        if not any(abs(x - px) <= tolerance and abs(y - py) <= tolerance for px, py in placed):
+            findings.append(Finding(ERROR, centres.name, ref, "is missing (board at {:.3f}, {:.3f})".format(x, y)))
+    for j in extra:
+        x, y = centres.points[j]
+        if not any(abs(x - ex) <= tolerance and abs(y - ey) <= tolerance for ex, ey in expected):
+            findings.append(Finding(ERROR, centres.name, None, "has a switch at {:.3f}, {:.3f} that the board hasn't".format(
+                x, y)))
+    return findings
+
+
+def _moved(name, points, reference):
+    dx, dy = align(reference, points)
+    return Centres(name, [(x + dx, y + dy) for x, y in points], (dx, dy))
+
+
+def check_project(board_name, layout_names=(), drill_names=(), plate_names=(), pattern=switch_refs,
+                  tolerance=0.25, radius=9.5, pitch=19.05, cutout=14.0, hole=None):
+    """Findings and a one line summary for a board and the other artifacts of its project."""
+    modules = drc.read_board(board_name)
+    switches = board_switches(modules, pattern)
+    if not switches:
+        return [], "no switches"
+    reference = [(x, y) for _, x, y in switches]
+    findings = []
+    checked = []
+    for name in layout_names:
+        checked.append((_moved(os.path.basename(name), layout_centres(name, pitch), reference), ()))
+    hole = centre_hole(modules, pattern) if hole is None else hole
+    for name in drill_names:
+        if hole is None:
+            findings.append(Finding(WARNING, os.path.basename(name), None,
+                                    "not checked, the switches have no centre hole"))
+            continue
+        checked.append((_moved(os.path.basename(name), drill_centres(name, hole), reference),
+                        other_holes(modules, hole, pattern)))
+    for name in plate_names:
+        points = plate_centres(name, cutout)
+        # Plates without switch cutouts (bottom, case layers) have nothing to check
+        if points:
+            checked.append((_moved(os.path.basename(name), points, reference), ()))
+    parts = []
+    for centres, expected in checked:
+        found = compare(switches, centres, tolerance, radius, expected)
+        findings.extend(found)
+        moved = " (moved {:+.3f}, {:+.3f})".format(*centres.offset) if any(
+            abs(value) > 1e-3 for value in centres.offset) else ""
+        parts.append("{}{} {}".format(centres.name, moved, "ok" if not found else "{} errors".format(
+            sum(1 for finding in found if finding.level == ERROR))))
+    return findings, "{} switches: {}".format(len(switches), ", ".join(parts) if parts else "nothing to compare")
+
+
+def _is_layout(file_name):
+    """KLE files are a json list, the repo's other json files are objects."""
+    try:
+        with open(file_name) as json_file:
+            return isinstance(json.load(json_file), list)
+    except ValueError:
+        return False
+
+
+def find_projects(paths):
+    """[(board, layouts, drills, plates), ...] for every directory with a .kicad_pcb under paths."""
+    projects = []
+    for path in paths:
+        if os.path.isfile(path):
+            path = os.path.dirname(os.path.abspath(path))
+        for directory, subdirectories, file_names in os.walk(path):
+            subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+            boards = sorted(name for name in file_names if name.endswith(board_types))
+            if not boards:
+                continue
+            found = {"layouts": [], "drills": [], "plates": []}
+            for inner, inner_subdirectories, inner_names in os.walk(directory):
+                inner_subdirectories[:] = sorted(name for name in inner_subdirectories if not name.startswith("."))
+                for name in sorted(inner_names):
+                    full = os.path.join(inner, name)
+                    lower = name.lower()
+                    if lower.endswith(".json") and _is_layout(full):
+                        found["layouts"].append(full)
+                    elif lower.endswith(drill_types):
+                        found["drills"].append(full)
+                    elif lower.endswith(plate_types):
+                        found["plates"].append(full)
+            for board in boards:
+                projects.append((os.path.join(directory, board), found["layouts"], found["drills"], found["plates"]))
+    return projects
+
+
+def main(paths, pattern=switch_refs, tolerance=0.25, radius=9.5, pitch=19.05, cutout=14.0, hole=None,
+         processes=None):
+    """Check every project, prints the findings and returns the number of projects with errors or failures."""
+    projects = find_projects(paths)
+    jobs = [(board, (board, layouts, drills, plates, pattern, tolerance, radius, pitch, cutout, hole))
+            for board, layouts, drills, plates in projects]
+    results = batch.run(check_project, jobs, processes)
+    failed = 0
+    summaries = []
+    for result in results:
+        if result.ok:
+            findings, summary = result.result
+            for finding in findings:
+                print("{}: {}: {}: {}{}".format(result.name, finding.level.upper(), finding.artifact,
+                                                finding.ref + " " if finding.ref else "", finding.message))
+            failed += 1 if any(finding.level == ERROR for finding in findings) else 0
+            result = result._replace(result=summary)
+        summaries.append(result)
+    if projects:
+        print("")
+    return failed + batch.summary(summaries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="project directories or directories to search")
+    parser.add_argument("--switches", default=switch_refs, help="regex for switch references (default: SW, S, K)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="how far a centre may be off, mm")
+    parser.add_argument("--radius", type=float, default=9.5, help="how far a centre is still the same switch, mm")
+    parser.add_argument("--pitch", type=float, default=19.05, help="mm per key unit in the layout")
+    parser.add_argument("--cutout", type=float, default=14.0, help="size of the plate's switch cutouts, mm")
+    parser.add_argument("--hole", type=float, help="switch centre hole (default: from the switch footprint)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    sys.exit(1 if main(args.paths, args.switches, args.tolerance, args.radius, args.pitch, args.cutout, args.hole,
+                       args.jobs) else 0)
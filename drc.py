@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+"""
+Collision check for the parts placed on a board.
+
+layout.py puts every diode at the same offset from its switch, which lands
+it on the pads or LED holes of the next switch for some key sizes. This
+finds those: every pad, drill hole and courtyard is turned into a shape on
+the board (a rotated rectangle, or a capsule for round and oval pads and
+holes) and reported when it overlaps a shape of another part:
+
+  - copper pads of different nets on a common copper layer
+  - a drill hole through a pad or a hole of another part
+  - courtyards on the same side, and pads or holes inside the courtyard of
+    another part (warnings)
+
+Alternatives for one key (clones, see overlap.py) may overlap: layout.py
+passes the clone pairs it made, on a board file only parts on exactly the
+same nets with the same footprint at the same origin are taken for clones.
+Footprints without a courtyard only take part with their pads and holes.
+Pad angles are taken as written in the board file, ie absolute like KiCad
+stores them.
+
+The shapes are bucketed in a uniform grid, so only shapes sharing a cell
+are compared. A big board is cut into tiles that are checked over a process
+pool, a shape crossing a tile border goes into both and a collision is only
+reported by the tile holding the corner of the overlap. Every module of a
+footprint shares one parse, what is left is linear in the number of pads:
+
+    drc.py --markers Eco2.User board.kicad_pcb
+
+prints the collisions and draws a circle and a note for each on Eco2.User.
+"""
+
+from __future__ import print_function
+
+import re
+import sys
+import math
+import argparse
+from collections import namedtuple
+
+import batch
+import output_cache
+from footprint_lib import parse_module
+from kicad_sexpr import Index, module_reference, parse, quote
+
+ERROR = "error"
+WARNING = "warning"
+
+Module = namedtuple("Module", ("ref", "x", "y", "angle", "footprint", "nets"))
+Shape = namedtuple("Shape", ("module", "kind", "name", "layers", "net", "segment", "radius", "polygon", "box"))
+Collision = namedtuple("Collision", ("level", "a", "b", "x", "y", "message"))
+
+# Copper layers as bits
+FRONT = 1
+BACK = 2
+_copper_layers = {"F.Cu": FRONT, "B.Cu": BACK, "*.Cu": FRONT | BACK}
+_courtyard_sides = {"F.CrtYd": FRONT, "B.CrtYd": BACK}
+
+PAD = "pad"
+HOLE = "hole"
+COURTYARD = "courtyard"
+
+_epsilon = 1e-6
+
+# The parts of a module that differ between copies of the same footprint
+_volatile = re.compile(
+    br'\((?:tedit|tstamp)\s+[^()]*\)|\(net\s+\d+(?:\s+(?:"(?:[^"\\]|\\.)*"|[^\s()]+))?\)'
+    br'|(\(fp_text\s+(?:reference|value)\s+)(?:"(?:[^"\\]|\\.)*"|[^\s()]+)')
+_module_at = re.compile(br'\(at\s+(-?[\d.]+)\s+(-?[\d.]+)(?:\s+(-?[\d.]+))?\)')
+_pad_node = re.compile(
+    br'\(pad\s(?:[^()"]|"(?:[^"\\]|\\.)*"|\((?:[^()"]|"(?:[^"\\]|\\.)*"|\([^()]*\))*\))*\)')
+_pad_net = re.compile(br'\(net\s+\d+\s+("(?:[^"\\]|\\.)*"|[^\s()]+)\)')
+
+
+def _turn(x, y, cos, sin):
+    # KiCad turns counter clockwise with y pointing down
+    return x * cos + y * sin, -x * sin + y * cos
+
+
+def _trig(angle):
+    radians = math.radians(angle)
+    return math.cos(radians), math.sin(radians)
+
+
+def read_modules(texts):
+    """
+    Modules from the texts of (module ...) nodes, eg Index.nodes(b"module")
+    of a board or PcbEmitter.modules(). Copies of a footprint are parsed once.
+    """
+    parsed = {}
+    modules = []
+    for text in texts:
+        at = _module_at.search(text)
+        # The module's own (at) is the first one, ahead of its pads and texts
+        key = _volatile.sub(lambda match: match.group(1) or b"", text[:at.start()] + text[at.end():])
+        footprint = parsed.get(key)
+        if footprint is None:
+            footprint = parsed[key] = parse_module(parse(key))
+        nets = []
+        for pad in _pad_node.finditer(text):
+            net = _pad_net.search(pad.group(0))
+            nets.append(parse(net.group(0))[2] if net else None)
+        modules.append(Module(module_reference(text), float(at.group(1)), float(at.group(2)), float(at.group(3) or 0),
+                              footprint, nets))
+    return modules
+
+
+def read_board(file_name):
+    with open(file_name, mode="rb") as board_file:
+        data = board_file.read()
+    return read_modules(node.text() for node in Index(data).nodes(b"module"))
+
+
+def _box(points, radius=0.0):
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return min(xs) - radius, min(ys) - radius, max(xs) + radius, max(ys) + radius
+
+
+def _capsule(module, kind, name, layers, net, x, y, width, height, cos, sin):
+    """A round or oval pad or hole of width x height at (x, y), turned by cos, sin."""
+    if width >= height:
+        half, radius, dx, dy = (width - height) / 2, height / 2, 1.0, 0.0
+    else:
+        half, radius, dx, dy = (height - width) / 2, width / 2, 0.0, 1.0
+    dx, dy = _turn(dx * half, dy * half, cos, sin)
+    segment = (x - dx, y - dy, x + dx, y + dy)
+    box = _box([segment[:2], segment[2:]], radius)
+    return Shape(module, kind, name, layers, net, segment, radius, None, box)
+
+
+def _rectangle(module, kind, name, layers, net, corners, offset_x, offset_y, cos, sin):
+    polygon = []
+    for x, y in corners:
+        x, y = _turn(x, y, cos, sin)
+        polygon.append((offset_x + x, offset_y + y))
+    return Shape(module, kind, name, layers, net, None, 0.0, tuple(polygon), _box(polygon))
+
+
+def module_shapes(number, module):
+    """The pads, holes and courtyard of module on the board, as Shapes of module number."""
+    footprint = module.footprint
+    cos, sin = _trig(module.angle)
+    shapes = []
+    for pad, net in zip(footprint["pads"], module.nets + [None] * (len(footprint["pads"]) - len(module.nets))):
+        px, py, pad_angle = pad["at"]
+        dx, dy = _turn(px, py, cos, sin)
+        x, y = module.x + dx, module.y + dy
+        pad_cos, pad_sin = _trig(pad_angle)
+        name = "pad {}".format(pad["number"]) if pad["number"] else "hole"
+        layers = 0
+        for layer in pad["layers"]:
+            layers |= _copper_layers.get(layer, 0)
+        if pad["drill"] and pad["drill"][0] > 0:
+            shapes.append(_capsule(number, HOLE, name, FRONT | BACK, net, x, y,
+                                   pad["drill"][0], pad["drill"][1], pad_cos, pad_sin))
+        if pad["type"] == "np_thru_hole" or not layers:
+            continue
+        width, height = pad["size"]
+        if pad["shape"] in ("circle", "oval"):
+            shapes.append(_capsule(number, PAD, name, layers, net, x, y, width, height, pad_cos, pad_sin))
+        else:
+            corners = [(-width / 2, -height / 2), (width / 2, -height / 2),
+                       (width / 2, height / 2), (-width / 2, height / 2)]
+            shapes.append(_rectangle(number, PAD, name, layers, net, corners, x, y, pad_cos, pad_sin))
+    sides = 0
+    for item in footprint["lines"] + footprint["circles"] + footprint["arcs"]:
+        sides |= _courtyard_sides.get(item["layer"], 0)
+    if sides:
+        x0, y0, x1, y1 = footprint["courtyard"]
+        shapes.append(_rectangle(number, COURTYARD, "courtyard", sides, None,
+                                 [(x0, y0), (x1, y0), (x1, y1), (x0, y1)], module.x, module.y, cos, sin))
+    return shapes
+
+
+def _point_segment(px, py, segment):
+    x0, y0, x1, y1 = segment
+    dx, dy = x1 - x0, y1 - y0
+    length = dx * dx + dy * dy
+    t = 0.0 if not length else max(0.0, min(1.0, ((px - x0) * dx + (py - y0) * dy) / length))
+    return math.hypot(px - x0 - t * dx, py - y0 - t * dy)
+
+
+def _cross(ax, ay, bx, by, cx, cy):
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def _segment_segment(a, b):
+    (ax0, ay0, ax1, ay1), (bx0, by0, bx1, by1) = a, b
+    d1 = _cross(bx0, by0, bx1, by1, ax0, ay0)
+    d2 = _cross(bx0, by0, bx1, by1, ax1, ay1)
+    d3 = _cross(ax0, ay0, ax1, ay1, bx0, by0)
+    d4 = _cross(ax0, ay0, ax1, ay1, bx1, by1)
+    if ((d1 > 0) != (d2 > 0)) and ((d3 > 0) != (d4 > 0)) and d1 and d2 and d3 and d4:
+        return 0.0
+    return min(_point_segment(ax0, ay0, b), _point_segment(ax1, ay1, b),
+               _point_segment(bx0, by0, a), _point_segment(bx1, by1, a))
+
+
+def _edges(polygon):
+    return [polygon[n] + polygon[(n + 1) % len(polygon)] for n in range(len(polygon))]
+
+
+def _inside(px, py, polygon):
+    """Point strictly inside a convex polygon, either winding."""
+    signs = set()
+    for x0, y0, x1, y1 in _edges(polygon):
+        cross = _cross(x0, y0, x1, y1, px, py)
+        if abs(cross) <= _epsilon:
+            return False
+        signs.add(cross > 0)
+    return len(signs) == 1
+
+
+def _distance(a, b):
+    """Distance between the outlines of two shapes, 0 or less when they overlap."""
+    if a.polygon is None and b.polygon is None:
+        return _segment_segment(a.segment, b.segment) - a.radius - b.radius
+    if a.polygon is None:
+        a, b = b, a
+    if b.polygon is None:
+        x0, y0, x1, y1 = b.segment
+        if _inside(x0, y0, a.polygon) or _inside(x1, y1, a.polygon):
+            return -b.radius
+        return min(_segment_segment(edge, b.segment) for edge in _edges(a.polygon)) - b.radius
+    if any(_inside(x, y, a.polygon) for x, y in b.polygon) or any(_inside(x, y, b.polygon) for x, y in a.polygon):
+        return -1.0
+    gap = min(_segment_segment(edge, other) for edge in _edges(a.polygon) for other in _edges(b.polygon))
+    if gap > 0:
+        return gap
+    # Edges that cross overlap, edges that only touch don't
+    crossing = any(_segment_segment(edge, other) == 0.0 and not _touching(edge, other)
+                   for edge in _edges(a.polygon) for other in _edges(b.polygon))
+    return -1.0 if crossing else 0.0
+
+
+def _touching(a, b):
+    (ax0, ay0, ax1, ay1), (bx0, by0, bx1, by1) = a, b
+    return any(abs(value) <= _epsilon for value in (
+        _cross(bx0, by0, bx1, by1, ax0, ay0), _cross(bx0, by0, bx1, by1, ax1, ay1),
+        _cross(ax0, ay0, ax1, ay1, bx0, by0), _cross(ax0, ay0, ax1, ay1, bx1, by1)))
+
+
+def _rule(a, b):
+    """
+    (level, wording, swap) for shapes a and b of different parts, None if
+    they may overlap. swap puts b first in the wording.
+    """
+    kinds = (a.kind, b.kind)
+    if kinds == (PAD, PAD):
+        if a.layers & b.layers and (a.net is None or a.net != b.net):
+            return ERROR, "overlaps", False
+        return None
+    if HOLE in kinds and COURTYARD not in kinds:
+        return ERROR, "overlaps", False
+    if kinds == (COURTYARD, COURTYARD):
+        return (WARNING, "overlaps", False) if a.layers & b.layers else None
+    if a.layers & b.layers:
+        return WARNING, "is inside", a.kind == COURTYARD
+    return None
+
+
+def check_shapes(shapes, parallel, clearance=0.0, cell=5.0, tile=None):
+    """
+    Collisions between shapes, as [(level, a, b, x, y, message), ...] with
+    a and b indices into shapes, "a message b". parallel holds pairs of module numbers that
+    may overlap. Only collisions whose overlap starts inside tile, a box
+    (x0, y0, x1, y1), are reported.
+    """
+    grid = {}
+    for n, shape in enumerate(shapes):
+        x0, y0, x1, y1 = shape.box
+        for column in range(int(math.floor((x0 - clearance) / cell)), int(math.floor((x1 + clearance) / cell)) + 1):
+            for row in range(int(math.floor((y0 - clearance) / cell)), int(math.floor((y1 + clearance) / cell)) + 1):
+                grid.setdefault((column, row), []).append(n)
+    seen = set()
+    found = []
+    for cell in sorted(grid):
+        members = grid[cell]
+        for i, n in enumerate(members):
+            a = shapes[n]
+            for m in members[i + 1:]:
+                b = shapes[m]
+                if a.module == b.module or (n, m) in seen:
+                    continue
+                seen.add((n, m))
+                corner_x = max(a.box[0], b.box[0]) - clearance
+                corner_y = max(a.box[1], b.box[1]) - clearance
+                if corner_x > min(a.box[2], b.box[2]) + clearance or corner_y > min(a.box[3], b.box[3]) + clearance:
+                    continue
+                if tile is not None and not (tile[0] <= corner_x < tile[2] and tile[1] <= corner_y < tile[3]):
+                    continue
+                if (min(a.module, b.module), max(a.module, b.module)) in parallel:
+                    continue
+                rule = _rule(a, b)
+                if rule is None:
+                    continue
+                # Courtyards already include the space a part needs
+                limit = 0.0 if COURTYARD in (a.kind, b.kind) else clearance
+                gap = _distance(a, b)
+                if gap < limit - _epsilon or (not limit and gap < 0):
+                    level, message, swap = rule
+                    x = (max(a.box[0], b.box[0]) + min(a.box[2], b.box[2])) / 2
+                    y = (max(a.box[1], b.box[1]) + min(a.box[3], b.box[3])) / 2
+                    found.append((level, m, n, x, y, message) if swap else (level, n, m, x, y, message))
+    return found
+
+
+def _check_tile(shapes, parallel, clearance, cell, tile):
+    return [(level, shapes[a], shapes[b], x, y, message)
+            for level, a, b, x, y, message in check_shapes(shapes, parallel, clearance, cell, tile)]
+
+
+def stacked(modules, tolerance=1e-3):
+    """
+    [(ref, ref), ...] of the modules that are clones of each other on a
+    board: the same footprint at the same origin, on exactly the same nets.
+    """
+    by_place = {}
+    for module in modules:
+        nets = frozenset(net for net in module.nets if net)
+        if nets:
+            # Copies of a footprint share one parse, see read_modules
+            key = (id(module.footprint), nets, int(round(module.x / tolerance)), int(round(module.y / tolerance)))
+            by_place.setdefault(key, []).append(module.ref)
+    return [(a, b) for refs in by_place.values() for i, a in enumerate(refs) for b in refs[i + 1:]]
+
+
+def check(modules, clearance=0.0, cell=5.0, tile=150.0, processes=None, clones=()):
+    """
+    Collisions between modules, a list of Modules (see read_modules), as
+    Collisions sorted by position. clones holds pairs of references of
+    parts that may overlap. Boards larger than one tile (mm) are checked a
+    tile at a time over a process pool.
+    """
+    shapes = []
+    for number, module in enumerate(modules):
+        shapes.extend(module_shapes(number, module))
+    if not shapes:
+        return []
+    numbers = {}
+    for number, module in enumerate(modules):
+        numbers.setdefault(module.ref, []).append(number)
+    parallel = set()
+    for a_ref, b_ref in clones:
+        for a in numbers.get(a_ref, ()):
+            parallel.update((min(a, b), max(a, b)) for b in numbers.get(b_ref, ()) if a != b)
+    left = min(shape.box[0] for shape in shapes) - clearance
+    top = min(shape.box[1] for shape in shapes) - clearance
+    right = max(shape.box[2] for shape in shapes)
+    bottom = max(shape.box[3] for shape in shapes)
+    columns = max(1, int(math.ceil((right - left) / tile)))
+    rows = max(1, int(math.ceil((bottom - top) / tile)))
+    jobs = []
+    for row in range(rows):
+        for column in range(columns):
+            x0, y0 = left + column * tile, top + row * tile
+            box = (x0 if column else -float("inf"), y0 if row else -float("inf"),
+                   x0 + tile if column < columns - 1 else float("inf"),
+                   y0 + tile if row < rows - 1 else float("inf"))
+            margin = clearance + _epsilon
+            members = [shape for shape in shapes if shape.box[0] - margin < box[2] and shape.box[2] + margin >= box[0]
+                       and shape.box[1] - margin < box[3] and shape.box[3] + margin >= box[1]]
+            if members:
+                jobs.append(("tile {},{}".format(column, row), (members, parallel, clearance, cell, box)))
+    collisions = {}
+    for result in batch.run(_check_tile, jobs, processes):
+        if not result.ok:
+            raise RuntimeError("Checking {} failed:\n{}".format(result.name, result.error))
+        for level, a, b, x, y, message in result.result:
+            a_ref, b_ref = modules[a.module].ref, modules[b.module].ref
+            message = "{} {} {} {} {}".format(a_ref, a.name, message, b_ref, b.name)
+            # Footprints like MXALPS have several pads with the same number
+            collision = Collision(level, a_ref, b_ref, x, y, message)
+            if message not in collisions or (y, x) < (collisions[message].y, collisions[message].x):
+                collisions[message] = collision
+    return sorted(collisions.values(), key=lambda collision: (collision.y, collision.x, collision.message))
+
+
+def markers(collisions, layer="Eco2.User"):
+    """gr_circle/gr_text nodes that mark collisions on layer, one per line."""
+    lines = []
+    for collision in collisions:
+        lines.append("  (gr_circle (center {0:.4f} {1:.4f}) (end {2:.4f} {1:.4f}) (layer {3}) (width 0.15))".format(
+            collision.x, collision.y, collision.x + 1.5, layer))
+        lines.append("  (gr_text {} (at {:.4f} {:.4f}) (layer {})\n    (effects (font (size 0.8 0.8) (thickness 0.12)) "
+                     "(justify left)))".format(quote("DRC " + collision.message), collision.x + 2, collision.y, layer))
+    return "\n".join(lines)
+
+
+def write_markers(file_name, collisions, layer="Eco2.User"):
+    """
+    Replace the markers on layer of a .kicad_pcb with markers for
+    collisions, anything else drawn on layer goes too. Returns True if the
+    file changed.
+    """
+    with open(file_name, mode="rb") as board_file:
+        data = board_file.read()
+    index = Index(data)
+    layer_node = "(layer {})".format(layer).encode("utf-8")
+    drop = [node for kind in (b"gr_circle", b"gr_text") for node in index.nodes(kind) if layer_node in node.text()]
+    out = []
+    position = 0
+    for node in sorted(drop, key=lambda node: node.start):
+        start = node.start
+        while start > 0 and data[start - 1:start] in (b" ", b"\t"):
+            start -= 1
+        end = node.end + 1 if data[node.end:node.end + 1] == b"\n" else node.end
+        out.append(data[position:start])
+        position = end
+    out.append(data[position:])
+    data = b"".join(out)
+    text = markers(collisions, layer).encode("utf-8")
+    if text:
+        # After the last node, so that taking the markers out again restores the file
+        end = Index(data).all[-1].end
+        data = data[:end] + b"\n" + text + data[end:]
+    return output_cache.write_if_changed(file_name, data)
+
+
+def main(file_name, clearance=0.0, marker_layer=None, processes=None):
+    """Check a board, prints the collisions and returns how many are errors."""
+    modules = read_board(file_name)
+    collisions = check(modules, clearance, processes=processes, clones=stacked(modules))
+    for collision in collisions:
+        print("{}: {}: {} at ({:.2f}, {:.2f})".format(
+            file_name, collision.level.upper(), collision.message, collision.x, collision.y))
+    errors = sum(1 for collision in collisions if collision.level == ERROR)
+    print("{}: {} errors, {} warnings".format(file_name, errors, len(collisions) - errors))
+    if marker_layer and write_markers(file_name, collisions, marker_layer):
+        print("Marked them on {}".format(marker_layer))
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", metavar="FILE", help=".kicad_pcb files")
+    parser.add_argument("--clearance", type=float, default=0.0, help="also report shapes closer than this, mm")
+    parser.add_argument("--markers", metavar="LAYER", help="mark the collisions on this layer, eg Eco2.User")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    sys.exit(1 if sum(main(name, args.clearance, args.markers, args.jobs) for name in args.files) else 0)
@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+"""
+Streaming reader for the DXF drawings of the plates, like
+103key-project/plates/switch.dxf.
+
+A DXF file is a list of group code / value line pairs. The file is mapped
+into memory and handed to numpy as bytes, the lines are found from the
+positions of the newlines and the codes and coordinates are parsed for all
+pairs at once, so no Python string is made per line. The entities of the
+ENTITIES section end up in a table of arrays, one row per entity:
+
+    kind            LINE, ARC, CIRCLE or LWPOLYLINE (the KINDS index)
+    layer           index into layers
+    x0, y0, x1, y1  start and end of a LINE, centre of an ARC or CIRCLE
+    radius, angle0, angle1
+                    ARC and CIRCLE, angles in degrees counter clockwise
+    closed, first, count
+                    LWPOLYLINE: its points are vertices[first:first + count]
+                    with bulges[first:first + count]
+    box             (n, 4) bounding box xmin, ymin, xmax, ymax
+
+Other entities are counted in skipped. Queries on a Drawing: bounds()
+of everything or a selection, query(box) finds the entities whose box
+touches box through a uniform grid (see overlap.GridHash), loops() chains
+the entities into closed outlines, and outline(), cutouts() and area() are
+the plate's outer edge, the holes in it and the area left.
+
+    dxf.py 103key-project/plates/*.dxf
+
+prints what each plate holds.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import math
+import mmap
+import argparse
+from collections import Counter
+
+import numpy
+
+import batch
+from overlap import Box, GridHash
+
+KINDS = ("LINE", "ARC", "CIRCLE", "LWPOLYLINE")
+LINE, ARC, CIRCLE, LWPOLYLINE = range(len(KINDS))
+
+# Arcs and bulges become straight pieces at most this many degrees long
+arc_step = 5.0
+# End points closer than this join when chaining loops
+join_tolerance = 1e-3
+
+_fields = {10: "x0", 20: "y0", 11: "x1", 21: "y1", 40: "radius", 50: "angle0", 51: "angle1", 70: "flags"}
+_name_width = 12
+
+
+def _trim(data, starts, ends):
+    """Move ends back over trailing spaces and carriage returns."""
+    ends = ends.copy()
+    while True:
+        back = (ends > starts) & ((data[numpy.maximum(ends - 1, 0)] == 32) | (data[numpy.maximum(ends - 1, 0)] == 13))
+        if not back.any():
+            return ends
+        ends[back] -= 1
+
+
+def _integers(data, starts, ends, width=4):
+    """The group codes, right aligned numbers of up to width digits."""
+    positions = ends[:, None] - numpy.arange(width, 0, -1)[None, :]
+    characters = data[numpy.maximum(positions, 0)].astype(numpy.int64)
+    digits = (positions >= starts[:, None]) & (characters >= 48) & (characters <= 57)
+    return (numpy.where(digits, characters - 48, 0) * 10 ** numpy.arange(width - 1, -1, -1)[None, :]).sum(axis=1)
+
+
+def _names(data, starts, ends, names):
+    """Index into names of every value, -1 for the others."""
+    positions = starts[:, None] + numpy.arange(_name_width)[None, :]
+    characters = numpy.where(positions < ends[:, None], data[numpy.minimum(positions, len(data) - 1)], 0)
+    found = numpy.full(len(starts), -1, dtype=numpy.int64)
+    for n, name in enumerate(names):
+        padded = numpy.frombuffer(name.encode("ascii").ljust(_name_width, b"\0")[:_name_width], dtype=numpy.uint8)
+        found[(characters == padded[None, :]).all(axis=1) & (ends - starts == len(name))] = n
+    return found
+
+
+def _floats(data, starts, ends):
+    """The values as numbers, parsed in one go."""
+    if not len(starts):
+        return numpy.zeros(0)
+    lengths = ends - starts + 1
+    firsts = numpy.cumsum(lengths) - lengths
+    positions = numpy.arange(lengths.sum()) - numpy.repeat(firsts - starts, lengths)
+    text = data[numpy.minimum(positions, len(data) - 1)]
+    # A space after every value
+    text[firsts + lengths - 1] = 32
+    values = numpy.fromstring(text.tobytes().decode("ascii", "replace"), sep=" ")
+    if len(values) != len(starts):
+        raise ValueError("unreadable numbers")
+    return values
+
+
+def _first(entities, values, count):
+    """Per entity the first of values, nan where there is none."""
+    field = numpy.full(count, numpy.nan)
+    if len(entities):
+        unique, first = numpy.unique(entities, return_index=True)
+        field[unique] = values[first]
+    return field
+
+
+def _arc_angles(start, end):
+    """Sweep from start to end degrees counter clockwise, a full turn for the same angle."""
+    sweep = (end - start) % 360.0
+    return numpy.where(sweep < 1e-9, 360.0, sweep)
+
+
+def _arc_boxes(x, y, radius, start, end):
+    sweep = _arc_angles(start, end)
+    points_x = [x + radius * numpy.cos(numpy.radians(start)), x + radius * numpy.cos(numpy.radians(start + sweep))]
+    points_y = [y + radius * numpy.sin(numpy.radians(start)), y + radius * numpy.sin(numpy.radians(start + sweep))]
+    # The axis directions the arc passes
+    for angle in (0.0, 90.0, 180.0, 270.0):
+        inside = (angle - start) % 360.0 <= sweep
+        points_x.append(numpy.where(inside, x + radius * math.cos(math.radians(angle)), points_x[0]))
+        points_y.append(numpy.where(inside, y + radius * math.sin(math.radians(angle)), points_y[0]))
+    points_x, points_y = numpy.array(points_x), numpy.array(points_y)
+    return numpy.stack((points_x.min(axis=0), points_y.min(axis=0), points_x.max(axis=0), points_y.max(axis=0)), axis=1)
+
+
+def arc_points(x, y, radius, start, end, step=arc_step):
+    """Points along a counter clockwise arc from start to end degrees, both ends included."""
+    sweep = float(_arc_angles(numpy.array(start), numpy.array(end)))
+    count = max(1, int(math.ceil(sweep / step)))
+    angles = numpy.radians(start + sweep * numpy.arange(count + 1) / count)
+    return numpy.stack((x + radius * numpy.cos(angles), y + radius * numpy.sin(angles)), axis=1)
+
+
+def _bulge_points(a, b, bulge, step=arc_step):
+    """The points after a up to b of a polyline piece with bulge (tan of a quarter of its angle)."""
+    if abs(bulge) < 1e-12:
+        return [tuple(b)]
+    sweep = 4 * math.atan(bulge)
+    chord = math.hypot(b[0] - a[0], b[1] - a[1])
+    radius = chord / (2 * math.sin(abs(sweep) / 2))
+    # The centre is left of a -> b for a counter clockwise (positive) bulge
+    middle = ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+    distance = radius * math.cos(abs(sweep) / 2) * (1 if bulge > 0 else -1)
+    if abs(sweep) > math.pi:
+        distance = -distance
+    normal = (-(b[1] - a[1]) / chord, (b[0] - a[0]) / chord)
+    centre = (middle[0] + normal[0] * distance, middle[1] + normal[1] * distance)
+    start = math.atan2(a[1] - centre[1], a[0] - centre[0])
+    count = max(1, int(math.ceil(math.degrees(abs(sweep)) / step)))
+    points = [(centre[0] + radius * math.cos(start + sweep * n / count),
+               centre[1] + radius * math.sin(start + sweep * n / count)) for n in range(1, count)]
+    return points + [tuple(b)]
+
+
+def _area(points):
+    """Area inside a closed contour (shoelace), the first point isn't repeated at the end."""
+    x, y = points[:, 0], points[:, 1]
+    return abs(float(numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1)))) / 2
+
+
+def _inside(point, contour):
+    """Even-odd test of point against a closed contour."""
+    x, y = point
+    x0, y0 = contour[:, 0], contour[:, 1]
+    x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+    crossing = (y0 > y) != (y1 > y)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        at = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool((crossing & (x < at)).sum() % 2)
+
+
+class Drawing(object):
+    """The entities of a DXF file as a table of arrays, see the module docstring."""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.layers = []
+        self.skipped = Counter()
+        self.kind = numpy.zeros(0, dtype=numpy.int8)
+        self.layer = numpy.zeros(0, dtype=numpy.int32)
+        for field in ("x0", "y0", "x1", "y1", "radius", "angle0", "angle1"):
+            setattr(self, field, numpy.zeros(0))
+        self.closed = numpy.zeros(0, dtype=bool)
+        self.first = numpy.zeros(0, dtype=numpy.int64)
+        self.count = numpy.zeros(0, dtype=numpy.int64)
+        self.vertices = numpy.zeros((0, 2))
+        self.bulges = numpy.zeros(0)
+        self.box = numpy.zeros((0, 4))
+        self._grid = None
+        self._loops = None
+
+    def __len__(self):
+        return len(self.kind)
+
+    def select(self, kind=None, layer=None):
+        """Indices of the entities of kind (eg LINE) on layer (a name)."""
+        mask = numpy.ones(len(self), dtype=bool)
+        if kind is not None:
+            mask &= self.kind == kind
+        if layer is not None:
+            mask &= self.layer == (self.layers.index(layer) if layer in self.layers else -1)
+        return numpy.flatnonzero(mask)
+
+    def bounds(self, items=None):
+        """(xmin, ymin, xmax, ymax) of the entities items (default all), None if there are none."""
+        box = self.box if items is None else self.box[items]
+        if not len(box):
+            return None
+        return (float(box[:, 0].min()), float(box[:, 1].min()), float(box[:, 2].max()), float(box[:, 3].max()))
+
+    def query(self, box, cell=None):
+        """Indices of the entities whose box touches box (xmin, ymin, xmax, ymax), in file order."""
+        if self._grid is None:
+            sizes = numpy.maximum(self.box[:, 2] - self.box[:, 0], self.box[:, 3] - self.box[:, 1])
+            # Cells a few times the typical entity, the plate outline goes in many
+            cell = cell or max(float(numpy.median(sizes)) * 4 if len(sizes) else 1.0, 1e-3)
+            self._grid = GridHash(cell)
+            for n, (x0, y0, x1, y1) in enumerate(self.box.tolist()):
+                self._grid.add(n, Box(x0, y0, x1, y1))
+        x0, y0, x1, y1 = box
+        found = []
+        for n in self._grid.near(Box(x0, y0, x1, y1)):
+            left, bottom, right, top = self.box[n]
+            if left <= x1 and right >= x0 and bottom <= y1 and top >= y0:
+                found.append(n)
+        return sorted(found)
+
+    def lines(self):
+        """(n, 4) x0, y0, x1, y1 of the LINE entities."""
+        items = self.select(LINE)
+        return numpy.stack((self.x0[items], self.y0[items], self.x1[items], self.y1[items]), axis=1)
+
+    def points(self, n):
+        """The entity n as a list of points, arcs and bulges flattened, closed ones without the end repeated."""
+        kind = self.kind[n]
+        if kind == LINE:
+            return [(self.x0[n], self.y0[n]), (self.x1[n], self.y1[n])]
+        if kind == CIRCLE:
+            return [tuple(point) for point in arc_points(self.x0[n], self.y0[n], self.radius[n], 0.0, 360.0)[:-1]]
+        if kind == ARC:
+            return [tuple(point) for point in arc_points(self.x0[n], self.y0[n], self.radius[n],
+                                                          self.angle0[n], self.angle1[n])]
+        first, count = self.first[n], self.count[n]
+        vertices = self.vertices[first:first + count]
+        bulges = self.bulges[first:first + count]
+        if not count:
+            return []
+        points = [tuple(vertices[0])]
+        pieces = count if self.closed[n] else count - 1
+        for k in range(pieces):
+            points.extend(_bulge_points(vertices[k], vertices[(k + 1) % count], bulges[k]))
+        return points[:-1] if self.closed[n] else points
+
+    def loops(self):
+        """
+        Closed contours, (m, 2) point arrays, from circles, closed polylines
+        and chains of lines, arcs and open polylines meeting end to end.
+        Pieces that don't close are left out.
+        """
+        if self._loops is not None:
+            return self._loops
+        loops = []
+        pieces = []
+        for n in range(len(self)):
+            points = self.points(n)
+            if not points:
+                continue
+            if self.kind[n] == CIRCLE or (self.kind[n] == LWPOLYLINE and self.closed[n]):
+                loops.append(numpy.array(points))
+            else:
+                pieces.append(points)
+
+        def key(point):
+            return (int(round(point[0] / join_tolerance)), int(round(point[1] / join_tolerance)))
+
+        ends = {}
+        for number, points in enumerate(pieces):
+            ends.setdefault(key(points[0]), []).append(number)
+            ends.setdefault(key(points[-1]), []).append(number)
+        used = [False] * len(pieces)
+        for number, points in enumerate(pieces):
+            if used[number]:
+                continue
+            used[number] = True
+            contour = list(points)
+            start = key(contour[0])
+            while key(contour[-1]) != start:
+                following = next((other for other in ends.get(key(contour[-1]), ()) if not used[other]), None)
+                if following is None:
+                    break
+                used[following] = True
+                other = pieces[following]
+                if key(other[0]) != key(contour[-1]):
+                    other = other[::-1]
+                contour.extend(other[1:])
+            if len(contour) > 2 and key(contour[-1]) == start:
+                loops.append(numpy.array(contour[:-1]))
+        self._loops = loops
+        return loops
+
+    def outline(self):
+        """The loop with the biggest box, the outer edge of a plate, or None."""
+        loops = self.loops()
+        if not loops:
+            return None
+        return max(loops, key=lambda loop: float(numpy.ptp(loop[:, 0]) * numpy.ptp(loop[:, 1])))
+
+    def cutouts(self):
+        """The loops inside the outline: switch, stabilizer and screw holes."""
+        outline = self.outline()
+        return [loop for loop in self.loops() if loop is not outline and _inside(tuple(loop[0]), outline)]
+
+    def area(self):
+        """Area of the plate: inside the outline less the cutouts (islands in cutouts aren't counted)."""
+        outline = self.outline()
+        if outline is None:
+            return 0.0
+        return _area(outline) - sum(_area(loop) for loop in self.cutouts())
+
+
+def parse(data, name=""):
+    """Read DXF data (bytes or an mmap) into a Drawing."""
+    drawing = Drawing(name)
+    raw = numpy.frombuffer(data, dtype=numpy.uint8)
+    try:
+        if not len(raw):
+            return drawing
+        newlines = numpy.flatnonzero(raw == 10)
+        if not len(newlines) or newlines[-1] != len(raw) - 1:
+            newlines = numpy.append(newlines, len(raw))
+        starts = numpy.append(0, newlines[:-1] + 1)
+        ends = _trim(raw, starts, newlines)
+        pairs = len(starts) // 2
+        code_starts, code_ends = starts[0:2 * pairs:2], ends[0:2 * pairs:2]
+        value_starts, value_ends = starts[1:2 * pairs:2], ends[1:2 * pairs:2]
+        # Values start after their leading spaces
+        while True:
+            ahead = (value_starts < value_ends) & (raw[numpy.minimum(value_starts, len(raw) - 1)] == 32)
+            if not ahead.any():
+                break
+            value_starts[ahead] += 1
+        codes = _integers(raw, code_starts, code_ends)
+        zeros = numpy.flatnonzero(codes == 0)
+        names = _names(raw, value_starts[zeros], value_ends[zeros], ("SECTION", "ENDSEC") + KINDS)
+        # The ENTITIES section: a SECTION whose next pair (code 2) names it
+        entities = None
+        for at in zeros[names == 0]:
+            if at + 1 < pairs and codes[at + 1] == 2 and _names(raw, value_starts[at + 1:at + 2],
+                                                               value_ends[at + 1:at + 2], ("ENTITIES",))[0] == 0:
+                entities = at
+                break
+        if entities is None:
+            return drawing
+        inside = (zeros > entities)
+        section_end = zeros[inside & (names == 1)]
+        end = section_end[0] if len(section_end) else pairs
+        heads = zeros[inside & (zeros < end)]
+        kinds = names[inside & (zeros < end)] - 2
+        for head, kind in zip(heads[kinds < 0], kinds[kinds < 0]):
+            drawing.skipped[bytes(raw[value_starts[head]:value_ends[head]]).decode("ascii", "replace")] += 1
+        # Pair -> its entity, -1 before the first one and for skipped kinds
+        owner = numpy.full(pairs, -1, dtype=numpy.int64)
+        marks = numpy.zeros(pairs, dtype=numpy.int64)
+        marks[heads] = 1
+        running = numpy.cumsum(marks) - 1
+        span = slice(heads[0], end) if len(heads) else slice(0, 0)
+        owner[span] = running[span]
+        owner[(owner >= 0) & (kinds[numpy.maximum(owner, 0)] < 0)] = -1
+        # Entities renumbered to the kept ones
+        kept = numpy.flatnonzero(kinds >= 0)
+        number = numpy.full(len(kinds), -1, dtype=numpy.int64)
+        number[kept] = numpy.arange(len(kept))
+        owner[owner >= 0] = number[owner[owner >= 0]]
+        count = len(kept)
+        drawing.kind = kinds[kept].astype(numpy.int8)
+
+        # Layers, one string per entity
+        layer_pairs = numpy.flatnonzero((owner >= 0) & (codes == 8))
+        layer_of = numpy.zeros(count, dtype=numpy.int32)
+        layer_index = {}
+        for pair in layer_pairs[numpy.unique(owner[layer_pairs], return_index=True)[1]]:
+            layer = bytes(raw[value_starts[pair]:value_ends[pair]]).decode("utf-8", "replace")
+            layer_of[owner[pair]] = layer_index.setdefault(layer, len(layer_index))
+        drawing.layers = sorted(layer_index, key=layer_index.get)
+        drawing.layer = layer_of
+
+        numeric = numpy.flatnonzero((owner >= 0) & numpy.isin(codes, list(_fields) + [42]))
+        values = _floats(raw, value_starts[numeric], value_ends[numeric])
+        numeric_codes, numeric_owner = codes[numeric], owner[numeric]
+        polyline = drawing.kind[numeric_owner] == LWPOLYLINE
+        for code, field in _fields.items():
+            chosen = (numeric_codes == code) & ~(polyline & numpy.isin(numeric_codes, (10, 20)))
+            setattr(drawing, field, _first(numeric_owner[chosen], values[chosen], count))
+        flags = drawing.__dict__.pop("flags")
+        drawing.closed = (drawing.kind == LWPOLYLINE) & (numpy.nan_to_num(flags).astype(numpy.int64) & 1 == 1)
+
+        # Polyline vertices: every 10 starts one, its 20 and 42 follow
+        is_x = polyline & (numeric_codes == 10)
+        vertex = numpy.cumsum(is_x) - 1
+        drawing.vertices = numpy.stack((values[is_x], values[polyline & (numeric_codes == 20)]), axis=1)
+        drawing.bulges = numpy.zeros(len(drawing.vertices))
+        is_bulge = polyline & (numeric_codes == 42)
+        drawing.bulges[vertex[is_bulge]] = values[is_bulge]
+        drawing.count = numpy.bincount(numeric_owner[is_x], minlength=count).astype(numpy.int64)
+        drawing.first = numpy.cumsum(drawing.count) - drawing.count
+    finally:
+        del raw
+
+    box = numpy.zeros((count, 4))
+    lines = drawing.kind == LINE
+    box[lines] = numpy.stack((numpy.minimum(drawing.x0, drawing.x1), numpy.minimum(drawing.y0, drawing.y1),
+                              numpy.maximum(drawing.x0, drawing.x1), numpy.maximum(drawing.y0, drawing.y1)),
+                             axis=1)[lines]
+    circles = drawing.kind == CIRCLE
+    box[circles] = numpy.stack((drawing.x0 - drawing.radius, drawing.y0 - drawing.radius,
+                                drawing.x0 + drawing.radius, drawing.y0 + drawing.radius), axis=1)[circles]
+    arcs = drawing.kind == ARC
+    if arcs.any():
+        box[arcs] = _arc_boxes(drawing.x0[arcs], drawing.y0[arcs], drawing.radius[arcs],
+                               drawing.angle0[arcs], drawing.angle1[arcs])
+    for n in numpy.flatnonzero(drawing.kind == LWPOLYLINE):
+        points = numpy.array(drawing.points(n)) if drawing.count[n] else numpy.zeros((1, 2))
+        box[n] = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+    drawing.box = box
+    return drawing
+
+
+def read(file_name):
+    """Read a DXF file into a Drawing named after the file."""
+    with open(file_name, mode="rb") as dxf_file:
+        if not os.fstat(dxf_file.fileno()).st_size:
+            return parse(b"", os.path.basename(file_name))
+        data = mmap.mmap(dxf_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return parse(data, os.path.basename(file_name))
+        finally:
+            data.close()
+
+
+def describe(drawing):
+    kinds = Counter(KINDS[kind] for kind in drawing.kind.tolist())
+    parts = ["{} {}".format(count, kind) for kind, count in sorted(kinds.items())]
+    parts += ["{} {} (skipped)".format(count, kind) for kind, count in sorted(drawing.skipped.items())]
+    bounds = drawing.bounds()
+    if bounds is None:
+        return ", ".join(parts) or "empty"
+    return "{}, {} layers, {:.2f} x {:.2f}mm, {} loops, {} cutouts, {:.1f}mm2 of plate".format(
+        ", ".join(parts), len(drawing.layers), bounds[2] - bounds[0], bounds[3] - bounds[1], len(drawing.loops()),
+        len(drawing.cutouts()), drawing.area())
+
+
+def _summary(file_name):
+    return describe(read(file_name))
+
+
+def main(file_names, processes=None):
+    return batch.summary(batch.run(_summary, [(name, (name,)) for name in file_names], processes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", metavar="FILE", help="DXF files")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    sys.exit(1 if main(args.files, args.jobs) else 0)
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+"""
+Excellon drill file reader and writer that orders the hits of every tool
+for a shorter drill path.
+
+KiCad writes the hits of a tool sorted by x, so the spindle sweeps the
+board back and forth for every row of keys. The hits of each tool get a
+new order (the slots, which KiCad writes after all the holes, stay as
+they are):
+
+  - a nearest neighbour tour, starting where the previous tool ended (the
+    first from the origin), with a KD-tree that drops the drilled hits so
+    every step only looks at the few cells around the spindle
+  - 2-opt: two legs of the path are swapped for two shorter ones by
+    reversing the part in between
+  - Or-opt: runs of one to three hits move, either way round, to a
+    better place in the path
+
+Both refinements only try connecting a hit to its nearest neighbours (from
+the same KD-tree) and repeat until nothing gets shorter, which takes a
+few seconds for tens of thousands of hits.
+
+    excellon.py -o out 103key-project/gerbers/103key.DRD.drl
+
+prints the travel of every tool before and after and writes the reordered
+file to out/103key.DRD.drl in the same format KiCad writes. Several files
+are done in parallel.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import math
+import heapq
+import argparse
+from collections import OrderedDict
+
+import numpy
+
+import batch
+
+_tool = re.compile(r"T(\d+)(?:F[\d.]+|S[\d.]+)*C([\d.]+)")
+_coordinates = re.compile(r"(?:X([+-]?[\d.]+))?(?:Y([+-]?[\d.]+))?(?:G85(?:X([+-]?[\d.]+))?(?:Y([+-]?[\d.]+))?)?$")
+_format = re.compile(r"(\d+)\.(\d+)")
+
+
+class Drill(object):
+    """
+    The tools of a drill file and what they drill, in mm: hits[tool] is an
+    (n, 2) array of x, y and slots[tool] an (n, 4) array of x0, y0, x1, y1,
+    in drilling order. tools maps tool number to diameter, in file order.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.units = "mm"
+        self.comments = []
+        self.tools = OrderedDict()
+        self.hits = {}
+        self.slots = {}
+
+    def copy(self):
+        drill = Drill(self.name)
+        drill.units = self.units
+        drill.comments = list(self.comments)
+        drill.tools = OrderedDict(self.tools)
+        drill.hits = dict((tool, hits.copy()) for tool, hits in self.hits.items())
+        drill.slots = dict((tool, slots.copy()) for tool, slots in self.slots.items())
+        return drill
+
+    def hit_count(self):
+        return sum(len(hits) for hits in self.hits.values())
+
+
+def parse(text, name=""):
+    """Read the Excellon text into a Drill."""
+    drill = Drill(name)
+    scale = 1.0
+    decimals = 3
+    integers = 3
+    leading_zeros = False
+    x = y = 0.0
+    tool = None
+    hits = {}
+    slots = {}
+
+    def number(text):
+        if "." in text:
+            return float(text) * scale
+        sign = -1 if text[:1] == "-" else 1
+        digits = text.lstrip("+-")
+        if leading_zeros:
+            digits = digits.ljust(integers + decimals, "0")
+        return sign * int(digits) / 10.0 ** decimals * scale
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(";"):
+            drill.comments.append(line)
+            continue
+        if line.startswith(("METRIC", "INCH")):
+            fields = line.split(",")
+            drill.units = "mm" if fields[0] == "METRIC" else "in"
+            scale = 1.0 if fields[0] == "METRIC" else 25.4
+            integers, decimals = (3, 3) if fields[0] == "METRIC" else (2, 4)
+            leading_zeros = "LZ" in fields
+            for field in fields[1:]:
+                match = _format.match(field)
+                if match:
+                    integers, decimals = len(match.group(1)), len(match.group(2))
+            continue
+        match = _tool.match(line)
+        if match:
+            drill.tools[int(match.group(1))] = float(match.group(2)) * scale
+            continue
+        if line[0] == "T" and line[1:].isdigit():
+            tool = int(line[1:]) or None
+            continue
+        if line[0] not in "XY":
+            # M48, %, G90, G05, M71, FMAT, M30, ...
+            continue
+        match = _coordinates.match(line)
+        if match is None or tool is None:
+            raise ValueError("{}: can't read {!r}".format(name, line))
+        x = number(match.group(1)) if match.group(1) else x
+        y = number(match.group(2)) if match.group(2) else y
+        if "G85" in line:
+            x1 = number(match.group(3)) if match.group(3) else x
+            y1 = number(match.group(4)) if match.group(4) else y
+            slots.setdefault(tool, []).extend((x, y, x1, y1))
+            x, y = x1, y1
+        else:
+            hits.setdefault(tool, []).extend((x, y))
+    for tool in drill.tools:
+        drill.hits[tool] = numpy.array(hits.get(tool, ()), dtype=numpy.float64).reshape(-1, 2)
+        drill.slots[tool] = numpy.array(slots.get(tool, ()), dtype=numpy.float64).reshape(-1, 4)
+    return drill
+
+
+def read(file_name):
+    with open(file_name) as drill_file:
+        return parse(drill_file.read(), os.path.basename(file_name))
+
+
+def _number(value, decimals):
+    text = "{:.{}f}".format(value, decimals).rstrip("0")
+    return "0." if text in ("-0.", "0.") else text
+
+
+def dumps(drill):
+    """The Drill as Excellon text, decimal, in the layout KiCad uses."""
+    metric = drill.units == "mm"
+    scale = 1.0 if metric else 1 / 25.4
+    decimals = 3 if metric else 4
+
+    def xy(x, y):
+        return "X{}Y{}".format(_number(x * scale, decimals), _number(y * scale, decimals))
+
+    lines = ["M48"] + drill.comments + ["FMAT,2", "METRIC,TZ" if metric else "INCH,TZ"]
+    for tool, diameter in drill.tools.items():
+        lines.append("T{}C{:.{}f}".format(tool, diameter * scale, decimals))
+    lines.extend(["%", "G90", "G05", "M71" if metric else "M72"])
+    # Holes of every tool, then the slots of every tool
+    for tool in drill.tools:
+        if len(drill.hits[tool]):
+            lines.append("T{}".format(tool))
+            lines.extend(xy(x, y) for x, y in drill.hits[tool])
+    for tool in drill.tools:
+        if len(drill.slots[tool]):
+            lines.append("T{}".format(tool))
+        for x0, y0, x1, y1 in drill.slots[tool]:
+            lines.append("{}G85{}".format(xy(x0, y0), xy(x1, y1)))
+            lines.append("G05")
+    lines.extend(["T0", "M30"])
+    return "\n".join(lines) + "\n"
+
+
+def write(file_name, drill):
+    with open(file_name, mode="w") as drill_file:
+        drill_file.write(dumps(drill))
+
+
+class KDTree(object):
+    """
+    2-d tree over points (x, y lists) with buckets of leaf_size points. Points
+    can be removed, every node counts the points it still holds so empty
+    subtrees are skipped.
+    """
+
+    def __init__(self, xs, ys, leaf_size=8):
+        self.xs, self.ys = xs, ys
+        self.order = list(range(len(xs)))
+        self.removed = [False] * len(xs)
+        self.leaf = [0] * len(xs)
+        # Per node: first, end (into order), children, parent, points left, box
+        self.first, self.end, self.low, self.high, self.parent, self.count, self.box = [], [], [], [], [], [], []
+        if xs:
+            self._build(0, len(xs), -1, leaf_size)
+
+    def _build(self, first, end, parent, leaf_size):
+        node = len(self.first)
+        members = self.order[first:end]
+        box = (min(self.xs[i] for i in members), min(self.ys[i] for i in members),
+               max(self.xs[i] for i in members), max(self.ys[i] for i in members))
+        for values in (self.first, self.end, self.low, self.high, self.parent, self.count, self.box):
+            values.append(None)
+        self.first[node], self.end[node], self.parent[node], self.count[node], self.box[node] = (
+            first, end, parent, end - first, box)
+        if end - first <= leaf_size:
+            for i in members:
+                self.leaf[i] = node
+            return node
+        coordinates = self.xs if box[2] - box[0] >= box[3] - box[1] else self.ys
+        self.order[first:end] = sorted(members, key=coordinates.__getitem__)
+        middle = (first + end) // 2
+        self.low[node] = self._build(first, middle, node, leaf_size)
+        self.high[node] = self._build(middle, end, node, leaf_size)
+        return node
+
+    def remove(self, i):
+        self.removed[i] = True
+        node = self.leaf[i]
+        while node != -1:
+            self.count[node] -= 1
+            node = self.parent[node]
+
+    def nearest(self, x, y, k=1):
+        """Up to k points left nearest to (x, y), nearest first."""
+        xs, ys, removed = self.xs, self.ys, self.removed
+        found = []
+        stack = [0] if self.first else []
+        while stack:
+            node = stack.pop()
+            if not self.count[node]:
+                continue
+            x0, y0, x1, y1 = self.box[node]
+            dx = x0 - x if x < x0 else x - x1 if x > x1 else 0.0
+            dy = y0 - y if y < y0 else y - y1 if y > y1 else 0.0
+            if len(found) == k and dx * dx + dy * dy >= -found[0][0]:
+                continue
+            low = self.low[node]
+            if low is None:
+                for i in self.order[self.first[node]:self.end[node]]:
+                    if removed[i]:
+                        continue
+                    distance = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+                    if len(found) < k:
+                        heapq.heappush(found, (-distance, -i))
+                    elif distance < -found[0][0]:
+                        heapq.heapreplace(found, (-distance, -i))
+                continue
+            high = self.high[node]
+            # Push the far child first so the near one is searched first
+            if self._gap(high, x, y) < self._gap(low, x, y):
+                low, high = high, low
+            stack.append(high)
+            stack.append(low)
+        return [-i for _, i in sorted(found, reverse=True)]
+
+    def _gap(self, node, x, y):
+        x0, y0, x1, y1 = self.box[node]
+        dx = x0 - x if x < x0 else x - x1 if x > x1 else 0.0
+        dy = y0 - y if y < y0 else y - y1 if y > y1 else 0.0
+        return dx * dx + dy * dy
+
+
+def travel(points, start=(0.0, 0.0)):
+    """Length of the path from start through points, an (n, 2) array, in order."""
+    if not len(points):
+        return 0.0
+    path = numpy.vstack((numpy.asarray(start, dtype=numpy.float64).reshape(1, 2), points))
+    return float(numpy.hypot(*numpy.diff(path, axis=0).T).sum())
+
+
+def nearest_neighbour(xs, ys, start):
+    """Order of the points that always goes to the nearest one left, from start."""
+    tree = KDTree(xs, ys)
+    x, y = start
+    order = []
+    for _ in range(len(xs)):
+        i = tree.nearest(x, y)[0]
+        tree.remove(i)
+        order.append(i)
+        x, y = xs[i], ys[i]
+    return order
+
+
+def _two_opt(tour, position, neighbours, distance, active, touched):
+    """
+    One pass of 2-opt over an open path whose first node stays, True if it
+    got shorter. Only nodes marked active are tried, a node is unmarked when
+    nothing is found for it and marked again, in active and touched (the
+    marks of the other pass), when one of its legs changes.
+    """
+    improved = False
+    size = len(tour)
+    for a in tour[1:]:
+        if not active[a]:
+            continue
+        moved = False
+        for c in neighbours[a]:
+            i, j = position[a], position[c]
+            gap = distance(a, c)
+            # Only worth it when the new leg is shorter than one it replaces
+            after = distance(a, tour[i + 1]) if i + 1 < size else 0.0
+            before = distance(tour[i - 1], a)
+            if gap >= max(after, before):
+                break
+            first, last = min(i, j), max(i, j)
+            # Reversing tour[p + 1:q + 1] joins tour[p] to tour[q] and tour[p + 1] to tour[q + 1]
+            for p, q in ((first, last), (first - 1, last - 1)):
+                if p < 0 or q - p < 2:
+                    continue
+                tp, tp1, tq = tour[p], tour[p + 1], tour[q]
+                delta = distance(tp, tq) - distance(tp, tp1)
+                tq1 = tour[q + 1] if q + 1 < size else None
+                if tq1 is not None:
+                    delta += distance(tp1, tq1) - distance(tq, tq1)
+                if delta < -1e-9:
+                    tour[p + 1:q + 1] = tour[p + 1:q + 1][::-1]
+                    for n in range(p + 1, q + 1):
+                        position[tour[n]] = n
+                    for node in (tp, tp1, tq, tq1):
+                        if node is not None:
+                            active[node] = touched[node] = True
+                    moved = improved = True
+                    break
+            if moved:
+                break
+        if not moved:
+            active[a] = False
+    return improved
+
+
+def _or_opt(tour, position, neighbours, distance, active, touched):
+    """One pass of Or-opt over an open path, like _two_opt(), True if it got shorter."""
+    improved = False
+    for length in (1, 2, 3):
+        i = 1
+        while i + length <= len(tour):
+            if not active[tour[i]]:
+                i += 1
+                continue
+            size = len(tour)
+            segment = tour[i:i + length]
+            first, last = segment[0], segment[-1]
+            previous = tour[i - 1]
+            following = tour[i + length] if i + length < size else None
+            saved = distance(previous, first)
+            if following is not None:
+                saved += distance(last, following) - distance(previous, following)
+            best = None
+            for end, other in ((first, last), (last, first)):
+                for c in neighbours[end]:
+                    gap = distance(c, end)
+                    # The new leg to c alone already costs more than removing saves
+                    if gap >= saved:
+                        break
+                    j = position[c]
+                    if i - 1 <= j < i + length:
+                        continue
+                    # After c: c, end .. other, successor
+                    successor = tour[j + 1] if j + 1 < size else None
+                    cost = gap
+                    if successor is not None:
+                        cost += distance(other, successor) - distance(c, successor)
+                    if cost - saved < -1e-9 and (best is None or cost - saved < best[0]):
+                        best = (cost - saved, j, True, end)
+                    # Before c: predecessor, other .. end, c
+                    predecessor = previous if j == i + length else tour[j - 1]
+                    cost = distance(predecessor, other) + gap - distance(predecessor, c)
+                    if cost - saved < -1e-9 and (best is None or cost - saved < best[0]):
+                        best = (cost - saved, j, False, end)
+            if best is None:
+                if length == 3:
+                    active[first] = False
+                i += 1
+                continue
+            _, j, after, end = best
+            c = tour[j]
+            rest = tour[:i] + tour[i + length:]
+            at = (j if j < i else j - length) + (1 if after else 0)
+            placed = segment if (end == first) == after else segment[::-1]
+            tour[:] = rest[:at] + placed + rest[at:]
+            for n in range(min(i, at), max(i + length, at + length)):
+                position[tour[n]] = n
+            for node in (previous, following, first, last, c):
+                if node is not None:
+                    active[node] = touched[node] = True
+            improved = True
+            i += 1
+    return improved
+
+
+def optimize(points, start=(0.0, 0.0), neighbours=8, rounds=50):
+    """
+    An order (list of indices) of points, an (n, 2) array, for a short path
+    from start: nearest neighbour, then 2-opt and Or-opt until neither finds
+    anything or rounds is reached.
+    """
+    count = len(points)
+    if count < 2:
+        return list(range(count))
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    order = nearest_neighbour(xs, ys, start)
+    # The start is node count, it stays in front
+    xs.append(float(start[0]))
+    ys.append(float(start[1]))
+    tree = KDTree(xs[:count], ys[:count])
+    near = [[j for j in tree.nearest(xs[i], ys[i], neighbours + 1) if j != i][:neighbours] for i in range(count)]
+    hypot = math.hypot
+
+    def distance(a, b):
+        return hypot(xs[a] - xs[b], ys[a] - ys[b])
+
+    tour = [count] + order
+    position = [0] * (count + 1)
+    for n, node in enumerate(tour):
+        position[node] = n
+    two_opt_active, or_opt_active = [True] * (count + 1), [True] * (count + 1)
+    for _ in range(rounds):
+        shorter = _two_opt(tour, position, near, distance, two_opt_active, or_opt_active)
+        if not _or_opt(tour, position, near, distance, or_opt_active, two_opt_active) and not shorter:
+            break
+    return tour[1:]
+
+
+def optimize_drill(drill, start=(0.0, 0.0), neighbours=8, rounds=50):
+    """
+    A copy of drill with the hits of every tool reordered, and
+    [(tool, hits, before, after), ...] with the travel per tool in mm. The
+    spindle goes from start through the hits of the tools in order and then
+    through the slots, like the file is written.
+    """
+    optimized = drill.copy()
+    travels = OrderedDict((tool, [len(drill.hits[tool]), 0.0, 0.0]) for tool in drill.tools)
+    before_at = after_at = start
+    for tool in drill.tools:
+        hits = drill.hits[tool]
+        if not len(hits):
+            continue
+        optimized.hits[tool] = hits[optimize(hits, after_at, neighbours, rounds)]
+        travels[tool][1] += travel(hits, before_at)
+        travels[tool][2] += travel(optimized.hits[tool], after_at)
+        before_at, after_at = tuple(hits[-1]), tuple(optimized.hits[tool][-1])
+    for tool in drill.tools:
+        for x0, y0, x1, y1 in drill.slots[tool]:
+            travels[tool][1] += math.hypot(x0 - before_at[0], y0 - before_at[1]) + math.hypot(x1 - x0, y1 - y0)
+            travels[tool][2] += math.hypot(x0 - after_at[0], y0 - after_at[1]) + math.hypot(x1 - x0, y1 - y0)
+            before_at = after_at = (x1, y1)
+    return optimized, [(tool, hits, before, after) for tool, (hits, before, after) in travels.items()]
+
+
+def _optimize_file(file_name, output, neighbours, rounds):
+    drill = read(file_name)
+    optimized, report = optimize_drill(drill, neighbours=neighbours, rounds=rounds)
+    if output:
+        write(os.path.join(output, os.path.basename(file_name)), optimized)
+    return report
+
+
+def main(file_names, output=None, neighbours=8, rounds=50, processes=None):
+    jobs = [(name, (name, output, neighbours, rounds)) for name in file_names]
+    results = batch.run(_optimize_file, jobs, processes)
+    for result in results:
+        if not result.ok:
+            continue
+        print("{} ({:.2f}s):".format(result.name, result.elapsed))
+        for tool, hits, before, after in result.result:
+            print("  T{:<3} {:5} hits {:10.1f}mm -> {:10.1f}mm".format(tool, hits, before, after))
+        before = sum(row[2] for row in result.result)
+        after = sum(row[3] for row in result.result)
+        print("  total           {:10.1f}mm -> {:10.1f}mm ({:.0f}% less)".format(
+            before, after, 100 * (1 - after / before) if before else 0))
+    return batch.summary([result for result in results if not result.ok]) if any(
+        not result.ok for result in results) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", metavar="FILE", help="Excellon drill files")
+    parser.add_argument("-o", "--output", help="write the reordered files to this directory")
+    parser.add_argument("--neighbours", type=int, default=8, help="neighbours tried per hit (default: 8)")
+    parser.add_argument("--rounds", type=int, default=50, help="at most this many 2-opt and Or-opt rounds")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    sys.exit(1 if main(args.files, args.output, args.neighbours, args.rounds, args.jobs) else 0)
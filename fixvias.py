@@ -1,59 +1,131 @@
 #!/usr/bin/python
 """
-Create a json file using http://www.keyboard-layout-editor.com/
+Put the pads of matching modules on a net, eg the GND stitching vias.
 
-Use that file to create a kicad schematic and pcb with the switches.
+Rules look like FIELD:PATTERN=NET, FIELD is the module's value or
+reference, PATTERN a shell style pattern and NET the name of a net from the
+board's own net table:
+
+    fixvias.py -r "value:GND Via=GND" -r "reference:H*=GND" board.kicad_pcb
+
+The board is read as text and only the (net ...) of the affected pads is
+rewritten, everything else is copied through as is, so KiCad is not needed.
+Several boards are fixed in parallel.
 """
 
-import six
-import json
-import codecs
-from time import time
-from pprint import pprint
-
-# export PYTHONPATH=/usr/local/kicad/Frameworks/python/site-packages
-import pcbnew
-kicad = pcbnew.IO_MGR.PluginFind(pcbnew.IO_MGR.KICAD)
-
-
-# def place_footprint(pcb, x, y, reference=None, i=None):
-#     # Place the switch
-#     fp = kicad.FootprintLoad()
-#     pcb.Add(fp)
-#     fp.Rotate(pcbnew.wxPoint(0, 0), 1800)
-#     fp.SetPosition(pcbnew.wxPoint(x * spacing, y * spacing))
-#     if reference is None:
-#         reference = "SW%d_%d" % (x, y)
-#     fp.SetReference(reference)
-#     fp.SetValue(reference)
-#     fp.SetLocked(True)
-#     # Place the diode
-#     fp = kicad.FootprintLoad(diode_lib, diode_part)
-#     pcb.Add(fp)
-#     fp.Rotate(pcbnew.wxPoint(0, 0), 2700)
-#     fp.SetPosition(pcbnew.wxPoint(x * spacing + diode_x_offset, y * spacing + diode_y_offset))
-#     if i is not None:
-#         reference = "D%d" % (i)
-#     if reference is None:
-#         reference = "D%d_%d" % (x, y)
-#     fp.SetReference(reference)
-#     fp.SetValue(reference)
-#     fp.SetLocked(True)
-
-
-def main():
-    pcb = pcbnew.LoadBoard("test.kicad_pcb")
-    # pprint(dir(pcbnew))
-    for module in pcb.GetModules():
-        if module.GetValue() == "GND Via":
-            # pprint(dir(module))
-            # help(module.Pads())
-            pads = module.Pads()
-            for p in pads:
-                p.SetNetCode(108)
-                # pprint(dir(p))
-                print p.GetNetCode(), p.GetNetname()
-    pcb.Save("test-out.kicad_pcb")
+from __future__ import print_function
+
+import re
+import sys
+import fnmatch
+import argparse
+
+import batch
+import output_cache
+from kicad_sexpr import Index, child_spans, module_value, quote
+
+# Used when no rules are given
+default_rules = ["value:GND Via=GND"]
+
+rule_fields = ("value", "reference")
+
+_unconnected_pad = re.compile(br'\(pad\s+(?:"(?:[^"\\]|\\.)*"|[^\s()]+)\s+np_thru_hole')
+
+
+def parse_rule(text):
+    """Split "value:GND Via=GND" into ("value", "GND Via", "GND")."""
+    field, colon, rest = text.partition(":")
+    pattern, equals, net = rest.rpartition("=")
+    if not colon or not equals or not pattern or not net or field not in rule_fields:
+        raise ValueError("Bad rule {!r}, expected FIELD:PATTERN=NET with FIELD one of {}".format(
+            text, ", ".join(rule_fields)))
+    return field, pattern, net
+
+
+def pad_edits(data, start, end, net):
+    """
+    (start, end, replacement) edits that put the pads of the module in
+    data[start:end] on net, eg b'(net 1 GND)'. Non plated holes can't have a
+    net and are left alone, as are pads that already have the right one.
+    """
+    edits = []
+    for kind, pad_start, pad_end in child_spans(data, start, end):
+        if kind != b"pad" or _unconnected_pad.match(data, pad_start):
+            continue
+        old = layers = None
+        for child, child_start, child_end in child_spans(data, pad_start, pad_end):
+            if child == b"net":
+                old = (child_start, child_end)
+            elif child == b"layers":
+                layers = child_end
+        if old is not None:
+            if data[old[0]:old[1]] != net:
+                edits.append((old[0], old[1], net))
+        else:
+            position = pad_end - 1 if layers is None else layers
+            edits.append((position, position, b" " + net))
+    return edits
+
+
+def fix_board(file_name, rules, output_name):
+    """
+    Apply rules, a list of (field, pattern, net), to one board and write the
+    result to output_name. The first rule that matches a module wins.
+    """
+    with open(file_name, mode="rb") as board_file:
+        data = board_file.read()
+    index = Index(data)
+    codes = dict((name, code) for code, name in index.nets().items())
+    for _, _, net in rules:
+        if net not in codes:
+            raise ValueError("{} has no net called {}".format(file_name, net))
+    edits = []
+    modules = 0
+    for node in index.nodes(b"module"):
+        fields = {"value": module_value(data, node.start, node.end), "reference": node.reference()}
+        for field, pattern, net in rules:
+            if fields[field] is not None and fnmatch.fnmatchcase(fields[field], pattern):
+                net_text = "(net {} {})".format(codes[net], quote(net)).encode("utf-8")
+                module_edits = pad_edits(data, node.start, node.end, net_text)
+                edits.extend(module_edits)
+                modules += 1 if module_edits else 0
+                break
+    out = []
+    pos = 0
+    for start, end, text in sorted(edits, key=lambda edit: edit[:2]):
+        out.append(data[pos:start])
+        out.append(text)
+        pos = end
+    out.append(data[pos:])
+    output_cache.write_if_changed(output_name, b"".join(out))
+    return "{} pads on {} modules changed".format(len(edits), modules)
+
+
+def output_file_name(file_name, in_place):
+    if in_place:
+        return file_name
+    base, ext = file_name.rsplit(".", 1)
+    return "{}-out.{}".format(base, ext)
+
+
+def main(boards, rules=None, in_place=False, processes=None):
+    """Fix every board, returns the number of boards that failed."""
+    rules = [parse_rule(rule) for rule in (rules or default_rules)]
+    jobs = [(name, (name, rules, output_file_name(name, in_place))) for name in boards]
+    return batch.summary(batch.run(fix_board, jobs, processes))
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("boards", nargs="+", metavar="BOARD", help=".kicad_pcb files to fix")
+    parser.add_argument("-r", "--rule", action="append", dest="rules", metavar="RULE",
+                        help="FIELD:PATTERN=NET, may be repeated (default: {})".format(" ".join(default_rules)))
+    parser.add_argument("-i", "--in-place", action="store_true",
+                        help="overwrite the boards instead of writing <board>-out.kicad_pcb")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    try:
+        failed = main(args.boards, args.rules, args.in_place, args.jobs)
+    except ValueError as error:
+        parser.error(str(error))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,328 @@
+"""
+Indexed, cached loader for KiCad footprint libraries (*.pretty directories).
+
+Every .kicad_mod file is parsed once into a plain dict:
+
+    {
+        "name": "MXALPS",
+        "layer": "F.Cu", "at": [x, y, angle],
+        "descr": "MXALPS", "tags": "MXALPS", "attr": None,
+        "pads": [{"number": "SW1", "type": "thru_hole", "shape": "oval",
+                  "at": [x, y, angle], "size": [w, h],
+                  "drill": [w, h] or None, "layers": [...], "net": None}, ...],
+        "lines": [{"start": [x, y], "end": [x, y], "layer": ..., "width": ...}, ...],
+        "circles": [{"center": [x, y], "end": [x, y], "layer": ..., "width": ...}, ...],
+        "arcs": [{"start": [x, y], "end": [x, y], "angle": ..., "layer": ..., "width": ...}, ...],
+        "texts": [{"kind": "reference", "text": ..., "at": [x, y, angle], "layer": ..., "hide": bool}, ...],
+        "courtyard": [xmin, ymin, xmax, ymax],
+        "template": "(module MXALPS (layer F.Cu) (tedit {tedit}) ...",
+    }
+
+The courtyard is the bounding box of everything on F.CrtYd/B.CrtYd, or of
+the pads and outlines when the footprint has no courtyard. template is a
+str.format template that takes the same fields as the footprints in
+layout.py, so any library footprint can be placed like the built in ones.
+
+The parsed form of each library is kept in a json cache. A file is only
+read again when its mtime or size changed, and only parsed again when its
+contents (sha1) changed as well.
+"""
+
+import os
+import re
+import json
+import hashlib
+
+from kicad_sexpr import parse, top_level_spans
+
+# Bump when the parsed form changes so old caches are thrown away
+CACHE_VERSION = 2
+
+default_cache_directory = os.path.join(os.path.expanduser("~"), ".cache", "mechkeys", "footprints")
+
+_courtyard_layers = ("F.CrtYd", "B.CrtYd")
+_text_name = re.compile(br'(\(fp_text\s+(?:reference|value)\s+)("(?:[^"\\]|\\.)*"|[^\s()]+)')
+
+
+def _floats(values):
+    return [float(value) for value in values]
+
+
+def _children(node, name):
+    return [child for child in node if isinstance(child, list) and child and child[0] == name]
+
+
+def _child(node, name, default=None):
+    for child in node:
+        if isinstance(child, list) and child and child[0] == name:
+            return child
+    return default
+
+
+def _value(node, name, default=None):
+    child = _child(node, name)
+    return child[1] if child and len(child) > 1 else default
+
+
+def _point(node, name):
+    child = _child(node, name)
+    return _floats(child[1:3]) if child else None
+
+
+def _graphic(item, *points):
+    shape = dict((name, _point(item, name)) for name in points)
+    shape["layer"] = _value(item, "layer")
+    width = _value(item, "width")
+    shape["width"] = float(width) if width is not None else 0.0
+    return shape
+
+
+def _at(node):
+    at = _floats(_child(node, "at", ["at", "0", "0"])[1:])
+    return at + [0.0] * (3 - len(at))
+
+
+def _pad(item):
+    drill = _child(item, "drill")
+    if drill is not None:
+        # (drill 1.5), (drill oval 1.5 3.17) or (drill 1 (offset ...))
+        sizes = [value for value in drill[1:] if not isinstance(value, list) and value != "oval"]
+        drill = _floats(sizes * 2 if len(sizes) == 1 else sizes[:2]) if sizes else None
+    layers = _child(item, "layers", ["layers"])
+    net = _child(item, "net")
+    return {
+        "number": item[1],
+        "type": item[2],
+        "shape": item[3],
+        "at": _at(item),
+        "size": _floats(_child(item, "size", ["size", "0", "0"])[1:3]),
+        "drill": drill,
+        "layers": layers[1:],
+        "net": net[2] if net and len(net) > 2 else None,
+    }
+
+
+def _bbox(points):
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def _outline_points(footprint, layers=None):
+    points = []
+    for line in footprint["lines"]:
+        if layers is None or line["layer"] in layers:
+            points.extend((line["start"], line["end"]))
+    for circle in footprint["circles"]:
+        if layers is None or circle["layer"] in layers:
+            (cx, cy), (ex, ey) = circle["center"], circle["end"]
+            radius = ((ex - cx) ** 2 + (ey - cy) ** 2) ** 0.5
+            points.extend(([cx - radius, cy - radius], [cx + radius, cy + radius]))
+    for arc in footprint["arcs"]:
+        if layers is None or arc["layer"] in layers:
+            points.extend((arc["start"], arc["end"]))
+    return points
+
+
+def courtyard(footprint, fallback=True):
+    """
+    Bounding box of the courtyard, falls back to pads and outlines, or to
+    None without fallback.
+    """
+    points = _outline_points(footprint, _courtyard_layers)
+    if not points and not fallback:
+        return None
+    if not points:
+        points = _outline_points(footprint)
+        for pad in footprint["pads"]:
+            (x, y), (w, h) = pad["at"][:2], pad["size"]
+            points.extend(([x - w / 2, y - h / 2], [x + w / 2, y + h / 2]))
+    return _bbox(points) if points else [0.0, 0.0, 0.0, 0.0]
+
+
+def make_template(data):
+    """
+    Turn the text of a .kicad_mod file into a layout.py footprint template.
+
+    The header gets {tedit}/{tstamp} and an (at {x_pos} {y_pos} {rotate})
+    and the reference and value texts become {reference}.
+    """
+    spans = list(top_level_spans(data))
+    header = data[:spans[0][1]].strip() if spans else data.strip()[:-1]
+    out = [b" ".join(header.split())]
+    body = []
+    for kind, start, end in spans:
+        if kind in (b"tedit", b"tstamp", b"at"):
+            continue
+        child = data[start:end].replace(b"{", b"{{").replace(b"}", b"}}")
+        if kind == b"fp_text":
+            child = _text_name.sub(br"\1{reference}", child, count=1)
+        if kind == b"layer":
+            out.append(child)
+        else:
+            body.append(b"    " + child)
+    out.append(b"(tedit {tedit}) (tstamp {tstamp})")
+    lines = [b" ".join(out), b"    (at {x_pos} {y_pos} {rotate})"] + body + [b"  )"]
+    return b"\n".join(lines).decode("utf-8")
+
+
+def parse_module(node):
+    """
+    The normalized form of a parsed (module ...), without the template.
+
+    Works on the modules of a .kicad_pcb as well, their pads have a net then.
+    """
+    if not node or node[0] != "module":
+        raise ValueError("Not a footprint, expected (module ...)")
+    footprint = {
+        "name": node[1],
+        "layer": _value(node, "layer"),
+        "at": _at(node),
+        "descr": _value(node, "descr"),
+        "tags": _value(node, "tags"),
+        "attr": _value(node, "attr"),
+        "pads": [_pad(item) for item in _children(node, "pad")],
+        "lines": [_graphic(item, "start", "end") for item in _children(node, "fp_line")],
+        "circles": [_graphic(item, "center", "end") for item in _children(node, "fp_circle")],
+        "arcs": [],
+        "texts": [],
+    }
+    for item in _children(node, "fp_arc"):
+        arc = _graphic(item, "start", "end")
+        arc["angle"] = float(_value(item, "angle", 0))
+        footprint["arcs"].append(arc)
+    for item in _children(node, "fp_text"):
+        footprint["texts"].append({
+            "kind": item[1],
+            "text": item[2],
+            "at": _at(item),
+            "layer": _value(item, "layer"),
+            "hide": "hide" in item,
+        })
+    footprint["courtyard"] = courtyard(footprint)
+    return footprint
+
+
+def parse_footprint(data):
+    """Parse the text of a .kicad_mod file into its normalized form."""
+    footprint = parse_module(parse(data))
+    footprint["template"] = make_template(data)
+    return footprint
+
+
+class FootprintLibrary(object):
+    """
+    One .pretty directory, indexed by footprint name.
+
+    Loading only stats the files; anything whose mtime and size match the
+    cache is taken from it as is.
+    """
+
+    def __init__(self, path, cache_directory=default_cache_directory):
+        self.path = os.path.abspath(path)
+        self.nickname = os.path.splitext(os.path.basename(self.path.rstrip(os.sep)))[0]
+        self.cache_name = None
+        if cache_directory:
+            key = hashlib.sha1(self.path.encode("utf-8")).hexdigest()[:12]
+            self.cache_name = os.path.join(cache_directory, "{}-{}.json".format(self.nickname, key))
+        self.parsed = 0
+        self.footprints = self._load()
+
+    def _read_cache(self):
+        if self.cache_name is None or not os.path.exists(self.cache_name):
+            return {}
+        try:
+            with open(self.cache_name) as cache_file:
+                cache = json.load(cache_file)
+        except ValueError:
+            return {}
+        if cache.get("version") != CACHE_VERSION:
+            return {}
+        return cache.get("files", {})
+
+    def _write_cache(self, entries):
+        directory = os.path.dirname(self.cache_name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_name = self.cache_name + ".tmp"
+        with open(temp_name, mode="w") as cache_file:
+            json.dump({"version": CACHE_VERSION, "path": self.path, "files": entries}, cache_file)
+        if hasattr(os, "replace"):
+            os.replace(temp_name, self.cache_name)
+        else:
+            os.rename(temp_name, self.cache_name)
+
+    def _load(self):
+        cached = self._read_cache()
+        entries = {}
+        dirty = False
+        for file_name in sorted(os.listdir(self.path)):
+            if not file_name.endswith(".kicad_mod"):
+                continue
+            full_name = os.path.join(self.path, file_name)
+            stat = os.stat(full_name)
+            entry = cached.get(file_name)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                entries[file_name] = entry
+                continue
+            with open(full_name, mode="rb") as footprint_file:
+                data = footprint_file.read()
+            digest = hashlib.sha1(data).hexdigest()
+            if not entry or entry["sha1"] != digest:
+                entry = {"sha1": digest, "footprint": parse_footprint(data)}
+                self.parsed += 1
+            entry["mtime"] = stat.st_mtime
+            entry["size"] = stat.st_size
+            entries[file_name] = entry
+            dirty = True
+        if set(cached) - set(entries):
+            dirty = True
+        if dirty and self.cache_name is not None:
+            self._write_cache(entries)
+        return dict(
+            (file_name[:-len(".kicad_mod")], entry["footprint"]) for file_name, entry in entries.items())
+
+    def __contains__(self, name):
+        return name in self.footprints
+
+    def __getitem__(self, name):
+        return self.footprints[name]
+
+
+class FootprintLibraries(object):
+    """
+    Several libraries searched in order.
+
+    Footprints are named "Nickname:Footprint" like in KiCad, eg
+    "Keyboard:MXALPS", or just "MXALPS" to take the first match.
+    """
+
+    def __init__(self, paths, cache_directory=default_cache_directory):
+        self.libraries = [FootprintLibrary(path, cache_directory) for path in paths]
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, name):
+        nickname, _, footprint = name.rpartition(":")
+        for library in self.libraries:
+            if nickname and library.nickname != nickname:
+                continue
+            if footprint in library:
+                return library[footprint]
+        raise KeyError("Footprint {} not found in {}".format(
+            name, ", ".join(library.path for library in self.libraries)))
+
+    def template(self, name, locked=False):
+        template = self[name]["template"]
+        if locked:
+            header, newline, rest = template.partition("\n")
+            atoms = header.split(" ")
+            if "locked" not in atoms:
+                atoms.insert(2, "locked")
+            template = " ".join(atoms) + newline + rest
+        return template
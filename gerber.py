@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+"""
+Streaming reader for Gerber (RS-274X) files, like the fab outputs in
+103key-project/gerbers and smk65/SMK65-gerbers.
+
+The file is mapped into memory and walked statement by statement with one
+compiled regex, so it is never split into lines or held twice. What it
+draws ends up in numpy arrays grouped by aperture:
+
+    flashes[code]   (n, 2) x, y of every D03
+    draws[code]     (n, 4) x0, y0, x1, y1 of every straight D01
+    arcs[code]      (n, 7) x0, y0, x1, y1, cx, cy, clockwise of every G02/G03 D01
+    regions         G36/G37 contours, points (n, 2) with the first point
+                    of each contour in starts, arcs flattened
+
+Coordinates and aperture sizes are in mm whatever %MO says. A %LP polarity
+change starts a new Level, a layer is the list of its levels drawn in order
+(KiCad only writes %LPD%). Apertures are C, R, O and P with their %AD
+parameters, macro apertures (%AM) are kept by name but not expanded. While
+reading, the coordinates collect in array("d") buffers, so a layer takes
+about as much memory as its numbers:
+
+    gerber.py 103key-project/gerbers
+
+prints what every layer holds. Files in a directory are read over a
+process pool.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import math
+import mmap
+import argparse
+from array import array
+from collections import namedtuple
+
+import numpy
+
+import batch
+
+Aperture = namedtuple("Aperture", ("code", "shape", "params"))
+
+gerber_types = (".gbr", ".gtl", ".gbl", ".gto", ".gbo", ".gts", ".gbs", ".gtp", ".gbp", ".gko", ".gm1")
+
+# Flattened region arcs get a point at least every this many degrees
+arc_step = 5.0
+
+_statement = re.compile(
+    br"%([^%]*)%"
+    br"|G0?4[^*]*\*"
+    br"|(?:G0?(\d+))?(?:X([+-]?\d+))?(?:Y([+-]?\d+))?(?:I([+-]?\d+))?(?:J([+-]?\d+))?(?:D0?(\d+))?\*"
+    br"|M0?([02])\*"
+    br"|\s+")
+_format = re.compile(br"FS([LT])([AI])X(\d)(\d)Y(\d)(\d)")
+_aperture = re.compile(br"AD\s*D(\d+)([A-Za-z_.$][^,*]*)(?:,([^*]*))?\*")
+# Parameters of a P (polygon) aperture that are lengths: outer and hole diameter
+_polygon_lengths = (0, 3)
+
+
+class Level(object):
+    """What one polarity of a layer draws, see the module docstring."""
+
+    def __init__(self, dark=True):
+        self.dark = dark
+        self.flashes = {}
+        self.draws = {}
+        self.arcs = {}
+        self.region_points = array("d")
+        self.region_starts = array("l")
+        self.regions = None
+        self.starts = None
+
+    def _buffer(self, kind, code):
+        buffers = getattr(self, kind)
+        buffer = buffers.get(code)
+        if buffer is None:
+            buffer = buffers[code] = array("d")
+        return buffer
+
+    def finish(self):
+        """Turn the buffers into numpy arrays."""
+        for kind, width in (("flashes", 2), ("draws", 4), ("arcs", 7)):
+            buffers = getattr(self, kind)
+            for code, buffer in buffers.items():
+                buffers[code] = numpy.frombuffer(buffer, dtype=numpy.float64).reshape(-1, width).copy()
+        self.regions = numpy.frombuffer(self.region_points, dtype=numpy.float64).reshape(-1, 2).copy()
+        self.starts = numpy.array(self.region_starts, dtype=numpy.int64)
+        self.region_points = self.region_starts = None
+
+    def contours(self):
+        """The region contours, one (n, 2) array each."""
+        ends = list(self.starts[1:]) + [len(self.regions)]
+        return [self.regions[start:end] for start, end in zip(self.starts, ends)]
+
+
+class Layer(object):
+    """A Gerber file: its apertures and the Levels it draws, in mm."""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.units = "mm"
+        self.apertures = {}
+        self.macros = {}
+        self.levels = [Level()]
+
+    def count(self, kind):
+        """Number of flashes, draws or arcs over all apertures and levels."""
+        return sum(len(items) for level in self.levels for items in getattr(level, kind).values())
+
+    def region_count(self):
+        return sum(len(level.starts) for level in self.levels)
+
+    def bounds(self):
+        """(xmin, ymin, xmax, ymax) of everything drawn, apertures included, or None."""
+        boxes = []
+        for level in self.levels:
+            for kind, columns in (("flashes", ((0, 1),)), ("draws", ((0, 1), (2, 3))),
+                                  ("arcs", ((0, 1), (2, 3), (4, 5)))):
+                for code, items in getattr(level, kind).items():
+                    if not len(items):
+                        continue
+                    reach = aperture_radius(self.apertures.get(code))
+                    if kind == "arcs":
+                        # The whole circle, arcs are rare enough
+                        radius = numpy.hypot(items[:, 0] - items[:, 4], items[:, 1] - items[:, 5])
+                        boxes.append(((items[:, 4] - radius).min() - reach, (items[:, 5] - radius).min() - reach,
+                                      (items[:, 4] + radius).max() + reach, (items[:, 5] + radius).max() + reach))
+                        continue
+                    for x, y in columns:
+                        boxes.append((items[:, x].min() - reach, items[:, y].min() - reach,
+                                      items[:, x].max() + reach, items[:, y].max() + reach))
+            if len(level.regions):
+                boxes.append(tuple(level.regions.min(axis=0)) + tuple(level.regions.max(axis=0)))
+        if not boxes:
+            return None
+        boxes = numpy.array(boxes)
+        return boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()
+
+
+def aperture_radius(aperture):
+    """Half the largest extent of an aperture, 0 for unknown ones."""
+    if aperture is None or not aperture.params:
+        return 0.0
+    if aperture.shape in ("R", "O"):
+        return math.hypot(aperture.params[0], aperture.params[1]) / 2 if len(aperture.params) > 1 else 0.0
+    return aperture.params[0] / 2
+
+
+def arc_points(x0, y0, x1, y1, cx, cy, clockwise, step=arc_step):
+    """Points along an arc, without its start, with y up like Gerber."""
+    start = math.atan2(y0 - cy, x0 - cx)
+    end = math.atan2(y1 - cy, x1 - cx)
+    if clockwise:
+        sweep = start - end
+    else:
+        sweep = end - start
+    sweep %= 2 * math.pi
+    if sweep < 1e-9:
+        sweep = 2 * math.pi
+    radius = math.hypot(x0 - cx, y0 - cy)
+    count = max(1, int(math.ceil(math.degrees(sweep) / step)))
+    direction = -1 if clockwise else 1
+    points = []
+    for n in range(1, count):
+        angle = start + direction * sweep * n / count
+        points.append((cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+    points.append((x1, y1))
+    return points
+
+
+def _single_quadrant_centre(x0, y0, x1, y1, i, j):
+    """G74: I and J come without sign, the centre is the one equally far from both ends."""
+    best = None
+    for cx, cy in ((x0 + i, y0 + j), (x0 - i, y0 + j), (x0 + i, y0 - j), (x0 - i, y0 - j)):
+        error = abs(math.hypot(x0 - cx, y0 - cy) - math.hypot(x1 - cx, y1 - cy))
+        if best is None or error < best[0]:
+            best = (error, cx, cy)
+    return best[1], best[2]
+
+
+def parse(data, name=""):
+    """Read the Gerber text in data (bytes or an mmap) into a Layer."""
+    layer = Layer(name)
+    level = layer.levels[0]
+    scale = 1.0
+    leading = True
+    incremental = False
+    digits = (4, 6)
+    divisor = 10.0 ** 6
+    x = y = 0.0
+    aperture = None
+    interpolation = 1
+    multi_quadrant = True
+    in_region = False
+    contour = False
+
+    def number(text, divisor=divisor):
+        if not leading:
+            sign = text[:1] if text[:1] in b"+-" else b""
+            text = sign + text[len(sign):].ljust(sum(digits), b"0")
+        return int(text) / divisor * scale
+
+    for match in _statement.finditer(data):
+        extended, code, x_text, y_text, i_text, j_text, d_code, m_code = match.groups()
+        if extended is not None:
+            command = extended[:2]
+            if command == b"FS":
+                fs = _format.match(extended)
+                if fs is None:
+                    raise ValueError("{}: unsupported format {}".format(name, extended.decode("ascii", "replace")))
+                leading = fs.group(1) == b"L"
+                incremental = fs.group(2) == b"I"
+                digits = (int(fs.group(3)), int(fs.group(4)))
+                divisor = 10.0 ** digits[1]
+            elif command == b"MO":
+                layer.units = "in" if extended[2:4] == b"IN" else "mm"
+                scale = 25.4 if layer.units == "in" else 1.0
+            elif command == b"AD":
+                ad = _aperture.match(extended)
+                if ad is None:
+                    raise ValueError("{}: bad aperture {}".format(name, extended.decode("ascii", "replace")))
+                shape = ad.group(2).decode("ascii")
+                # A polygon's vertex count and rotation aren't lengths
+                params = tuple(float(value) * (scale if shape != "P" or n in _polygon_lengths else 1.0)
+                               for n, value in enumerate(ad.group(3).split(b"X"))) if ad.group(3) else ()
+                layer.apertures[int(ad.group(1))] = Aperture(int(ad.group(1)), shape, params)
+            elif command == b"AM":
+                macro = extended[2:].split(b"*", 1)
+                layer.macros[macro[0].decode("ascii")] = macro[1] if len(macro) > 1 else b""
+            elif command == b"LP":
+                dark = extended[2:3] == b"D"
+                if level.dark != dark:
+                    level = Level(dark)
+                    layer.levels.append(level)
+            continue
+        if m_code is not None:
+            break
+        if code is not None:
+            code = int(code)
+            if code in (1, 2, 3):
+                interpolation = code
+            elif code == 36:
+                in_region, contour = True, False
+            elif code == 37:
+                in_region = contour = False
+            elif code == 74:
+                multi_quadrant = False
+            elif code == 75:
+                multi_quadrant = True
+        if x_text is None and y_text is None and d_code is None:
+            continue
+        d = int(d_code) if d_code is not None else 1 if x_text is not None or y_text is not None else None
+        if d is not None and d >= 10:
+            aperture = d
+            continue
+        new_x = number(x_text, divisor) + (x if incremental else 0.0) if x_text is not None else x
+        new_y = number(y_text, divisor) + (y if incremental else 0.0) if y_text is not None else y
+        if d == 1:
+            arc = interpolation in (2, 3)
+            if arc:
+                i = number(i_text, divisor) if i_text is not None else 0.0
+                j = number(j_text, divisor) if j_text is not None else 0.0
+                if multi_quadrant:
+                    cx, cy = x + i, y + j
+                else:
+                    cx, cy = _single_quadrant_centre(x, y, new_x, new_y, abs(i), abs(j))
+            if in_region:
+                if not contour:
+                    level.region_starts.append(len(level.region_points) // 2)
+                    level.region_points.extend((x, y))
+                    contour = True
+                if arc:
+                    for point in arc_points(x, y, new_x, new_y, cx, cy, interpolation == 2):
+                        level.region_points.extend(point)
+                else:
+                    level.region_points.extend((new_x, new_y))
+            elif arc:
+                level._buffer("arcs", aperture).extend((x, y, new_x, new_y, cx, cy, 1.0 if interpolation == 2 else 0.0))
+            else:
+                level._buffer("draws", aperture).extend((x, y, new_x, new_y))
+        elif d == 2:
+            contour = False
+        elif d == 3:
+            level._buffer("flashes", aperture).extend((new_x, new_y))
+        x, y = new_x, new_y
+    for level in layer.levels:
+        level.finish()
+    return layer
+
+
+def read(file_name):
+    """Read a Gerber file into a Layer named after the file."""
+    with open(file_name, mode="rb") as gerber_file:
+        if not os.fstat(gerber_file.fileno()).st_size:
+            return parse(b"", os.path.basename(file_name))
+        data = mmap.mmap(gerber_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return parse(data, os.path.basename(file_name))
+        finally:
+            data.close()
+
+
+def find_files(paths):
+    """The Gerber files in paths, directories are searched (not recursively)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(gerber_types))
+        else:
+            files.append(path)
+    return files
+
+
+def read_set(paths, processes=None):
+    """{file name: Layer} for the Gerber files in paths, read over a process pool."""
+    files = find_files(paths)
+    layers = {}
+    for result in batch.run(read, [(name, (name,)) for name in files], processes):
+        if not result.ok:
+            raise ValueError("Reading {} failed:\n{}".format(result.name, result.error))
+        layers[result.name] = result.result
+    return layers
+
+
+def describe(layer):
+    bounds = layer.bounds()
+    size = "{:.2f} x {:.2f}mm".format(bounds[2] - bounds[0], bounds[3] - bounds[1]) if bounds else "empty"
+    return "{} apertures, {} flashes, {} draws, {} arcs, {} regions, {}".format(
+        len(layer.apertures), layer.count("flashes"), layer.count("draws"), layer.count("arcs"),
+        layer.region_count(), size)
+
+
+def _summary(file_name):
+    return describe(read(file_name))
+
+
+def main(paths, processes=None):
+    files = find_files(paths)
+    return batch.summary(batch.run(_summary, [(name, (name,)) for name in files], processes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="Gerber files or directories holding them")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    sys.exit(1 if main(args.paths, args.jobs) else 0)
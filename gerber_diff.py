@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+"""
+Show what changed between two revisions of a board's Gerbers.
+
+Both revisions of a layer are rasterized at the same dpi on one pixel grid
+and compared pixel by pixel:
+
+  - an aperture becomes a span of columns per pixel row, flashes stamp
+    those spans at every position at once
+  - draws and arcs are sampled a pixel apart along their path and the
+    aperture is stamped at every sample, which gives the rounded ends of a
+    stroked trace for free
+  - regions are filled by scanline: the crossings of every contour edge
+    with every pixel row are sorted and paired (even-odd), a span per pair
+  - all spans of a level go into one array, +1 at the start and -1 past
+    the end of every span, its running sum along the rows is the bitmap
+  - a clear polarity level (%LPC%) clears what the levels before it drew
+
+The board is cut into tiles which are rendered and compared in a process
+pool, so only the tiles and the resulting difference are ever held in
+memory. The changed pixels are counted in cells of --cell mm and touching
+cells make a region, the summary lists each region with the area that
+disappeared and appeared:
+
+    gerber_diff.py 103key-project/gerbers rev2/gerbers -o diff
+
+compares the layers with the same name after the project name (F.Cu.GTL,
+B.SilkS.GBO, ...) and writes diff/F.Cu.GTL.png and so on: unchanged copper
+grey, removed red, added green. Positions are in Gerber coordinates, mm with
+y pointing up.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import math
+import zlib
+import struct
+import argparse
+from timeit import default_timer
+
+import numpy
+
+import batch
+import gerber
+
+# Pixel values of a difference image
+EMPTY, SAME, REMOVED, ADDED = 0, 1, 2, 3
+palette = ((255, 255, 255), (160, 160, 160), (220, 0, 0), (0, 170, 0))
+
+
+def _offsets(aperture, ppmm):
+    """
+    (rows, lefts, rights, reach) of an aperture: the pixels it covers, as a
+    span of columns [left, right) per row, relative to its centre pixel.
+    The supported apertures are all convex, one span per row is enough.
+    """
+    params = aperture.params if aperture is not None else ()
+    reach = int(math.ceil(gerber.aperture_radius(aperture) * ppmm)) + 1
+    rows, columns = numpy.mgrid[-reach:reach + 1, -reach:reach + 1]
+    x, y = columns / ppmm, -rows / ppmm
+    shape = aperture.shape if aperture is not None else None
+    if shape == "C" and params:
+        mask = x * x + y * y <= (params[0] / 2) ** 2
+    elif shape == "R" and len(params) > 1:
+        mask = (numpy.abs(x) <= params[0] / 2) & (numpy.abs(y) <= params[1] / 2)
+    elif shape == "O" and len(params) > 1:
+        width, height = params[0], params[1]
+        if width < height:
+            x, y, width, height = y, x, height, width
+        along = numpy.maximum(numpy.abs(x) - (width - height) / 2, 0)
+        mask = along * along + y * y <= (height / 2) ** 2
+    elif shape == "P" and len(params) > 1:
+        vertices = int(params[1])
+        rotation = math.radians(params[2]) if len(params) > 2 else 0.0
+        mask = numpy.ones(x.shape, dtype=bool)
+        for n in range(vertices):
+            normal = rotation + 2 * math.pi * (n + 0.5) / vertices
+            mask &= x * math.cos(normal) + y * math.sin(normal) <= params[0] / 2 * math.cos(math.pi / vertices)
+    else:
+        # Macros aren't expanded, zero size apertures still leave a mark
+        mask = numpy.zeros(x.shape, dtype=bool)
+    mask[reach, reach] = True
+    used = mask.any(axis=1)
+    lefts = numpy.argmax(mask, axis=1) - reach
+    rights = mask.shape[1] - numpy.argmax(mask[:, ::-1], axis=1) - reach
+    return numpy.arange(-reach, reach + 1)[used], lefts[used], rights[used], reach
+
+
+def _stamp(rows, columns, offsets):
+    """The spans (rows, starts, ends) of an aperture stamped at every board pixel (rows, columns)."""
+    stamp_rows, lefts, rights, _ = offsets
+    return ((rows[:, None] + stamp_rows[None, :]).ravel(), (columns[:, None] + lefts[None, :]).ravel(),
+            (columns[:, None] + rights[None, :]).ravel())
+
+
+def _samples(segments, ppmm):
+    """Board pixels (rows, columns) a pixel apart along segments, (n, 4) x0, y0, x1, y1 in mm."""
+    x0, y0 = segments[:, 0] * ppmm, -segments[:, 1] * ppmm
+    x1, y1 = segments[:, 2] * ppmm, -segments[:, 3] * ppmm
+    counts = numpy.ceil(numpy.hypot(x1 - x0, y1 - y0)).astype(numpy.int64) + 1
+    firsts = numpy.cumsum(counts) - counts
+    which = numpy.repeat(numpy.arange(len(segments)), counts)
+    t = (numpy.arange(counts.sum()) - firsts[which]) / numpy.maximum(counts - 1, 1)[which]
+    rows = numpy.rint(y0[which] + (y1 - y0)[which] * t).astype(numpy.int64)
+    columns = numpy.rint(x0[which] + (x1 - x0)[which] * t).astype(numpy.int64)
+    return rows, columns
+
+
+def _arc_segments(arcs, step=2.0):
+    """Arcs (n, 7) as straight segments (m, 4) at most step degrees long."""
+    x0, y0, x1, y1, cx, cy, clockwise = arcs.T
+    start = numpy.arctan2(y0 - cy, x0 - cx)
+    sweep = numpy.where(clockwise > 0, start - numpy.arctan2(y1 - cy, x1 - cx),
+                        numpy.arctan2(y1 - cy, x1 - cx) - start) % (2 * math.pi)
+    # Start and end in the same place is a whole circle, like in gerber.arc_points
+    sweep[sweep < 1e-9] = 2 * math.pi
+    sweep *= numpy.where(clockwise > 0, -1, 1)
+    radius = numpy.hypot(x0 - cx, y0 - cy)
+    counts = numpy.maximum(numpy.ceil(numpy.degrees(numpy.abs(sweep)) / step), 1).astype(numpy.int64)
+    which = numpy.repeat(numpy.arange(len(arcs)), counts)
+    n = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    angles = start[which] + sweep[which] * n / counts[which]
+    following = start[which] + sweep[which] * (n + 1) / counts[which]
+    return numpy.stack((cx[which] + radius[which] * numpy.cos(angles), cy[which] + radius[which] * numpy.sin(angles),
+                        cx[which] + radius[which] * numpy.cos(following),
+                        cy[which] + radius[which] * numpy.sin(following)), axis=1)
+
+
+def _touching(items, columns, reach, window, ppmm):
+    """Which items (rows of coordinates in mm) reach into window (row, column, height, width)."""
+    xs = items[:, columns[0]] * ppmm
+    ys = -items[:, columns[1]] * ppmm
+    low_x, high_x, low_y, high_y = xs, xs, ys, ys
+    for x_column, y_column in zip(columns[2::2], columns[3::2]):
+        low_x = numpy.minimum(low_x, items[:, x_column] * ppmm)
+        high_x = numpy.maximum(high_x, items[:, x_column] * ppmm)
+        low_y = numpy.minimum(low_y, -items[:, y_column] * ppmm)
+        high_y = numpy.maximum(high_y, -items[:, y_column] * ppmm)
+    row, column, height, width = window
+    return ((high_x + reach >= column) & (low_x - reach < column + width) &
+            (high_y + reach >= row) & (low_y - reach < row + height))
+
+
+def _fill(level, window, ppmm):
+    """The spans (rows, starts, ends) that fill the region contours of level, in the rows of window."""
+    if not len(level.starts):
+        return None
+    points = level.regions
+    ends = numpy.append(level.starts[1:], len(points))
+    # Every point to the next one of its contour, the last back to the first
+    following = numpy.arange(1, len(points) + 1)
+    following[ends - 1] = level.starts
+    contour = numpy.repeat(numpy.arange(len(level.starts)), ends - level.starts)
+    x0, y0 = points[:, 0] * ppmm, -points[:, 1] * ppmm
+    x1, y1 = x0[following], y0[following]
+    # Pixel rows are centred on whole numbers, an edge crosses [low, high)
+    first = numpy.maximum(numpy.ceil(numpy.minimum(y0, y1)), window[0]).astype(numpy.int64)
+    last = numpy.minimum(numpy.ceil(numpy.maximum(y0, y1)), window[0] + window[2]).astype(numpy.int64)
+    counts = numpy.maximum(last - first, 0)
+    if not counts.sum():
+        return None
+    edge = numpy.repeat(numpy.arange(len(points)), counts)
+    rows = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + first[edge]
+    xs = x0[edge] + (rows - y0[edge]) * (x1 - x0)[edge] / (y1 - y0)[edge]
+    order = numpy.lexsort((xs, rows, contour[edge]))
+    rows, xs = rows[order], numpy.ceil(xs[order]).astype(numpy.int64)
+    return rows[0::2], xs[0::2], xs[1::2]
+
+
+def _paint(spans, window):
+    """A bool bitmap of window with the union of spans, (rows, starts, ends) in board pixels, set."""
+    row, column, height, width = window
+    rows = numpy.concatenate([part[0] for part in spans]) - row
+    starts = numpy.clip(numpy.concatenate([part[1] for part in spans]) - column, 0, width)
+    ends = numpy.clip(numpy.concatenate([part[2] for part in spans]) - column, 0, width)
+    keep = (rows >= 0) & (rows < height) & (starts < ends)
+    rows, starts, ends = rows[keep], starts[keep], ends[keep]
+    bitmap = numpy.zeros((height, width), dtype=bool)
+    if not len(rows):
+        return bitmap
+    # +1 where a span starts, -1 past its end, covered where the running sum
+    # is positive, only over the rows that have spans
+    used, rows = numpy.unique(rows, return_inverse=True)
+    size = len(used) * (width + 1)
+    coverage = (numpy.bincount(rows * (width + 1) + starts, minlength=size) -
+                numpy.bincount(rows * (width + 1) + ends, minlength=size)).astype(numpy.int32)
+    bitmap[used] = numpy.cumsum(coverage.reshape(len(used), width + 1), axis=1)[:, :width] > 0
+    return bitmap
+
+
+def rasterize(layer, window, ppmm):
+    """
+    A bool bitmap of layer over window, (row, column, height, width) in
+    board pixels: pixel (row, column) is centred on x = column / ppmm,
+    y = -row / ppmm mm.
+    """
+    height, width = window[2:]
+    bitmap = numpy.zeros((height, width), dtype=bool)
+    cache = {}
+    for level in layer.levels:
+        spans = []
+        for kind, columns in (("flashes", (0, 1)), ("draws", (0, 1, 2, 3)), ("arcs", (0, 1, 2, 3))):
+            for code, items in getattr(level, kind).items():
+                if not len(items):
+                    continue
+                if code not in cache:
+                    cache[code] = _offsets(layer.apertures.get(code), ppmm)
+                offsets = cache[code]
+                if kind == "arcs":
+                    # The box of the whole circle, then the pieces that are in the tile
+                    radius = numpy.hypot(items[:, 0] - items[:, 4], items[:, 1] - items[:, 5])
+                    circles = numpy.stack((items[:, 4] - radius, items[:, 5] - radius,
+                                           items[:, 4] + radius, items[:, 5] + radius), axis=1)
+                    items = _arc_segments(items[_touching(circles, columns, offsets[3], window, ppmm)])
+                items = items[_touching(items, columns, offsets[3], window, ppmm)]
+                if not len(items):
+                    continue
+                if kind == "flashes":
+                    rows = numpy.rint(-items[:, 1] * ppmm).astype(numpy.int64)
+                    points = numpy.rint(items[:, 0] * ppmm).astype(numpy.int64)
+                else:
+                    rows, points = _samples(items, ppmm)
+                spans.append(_stamp(rows, points, offsets))
+        fill = _fill(level, window, ppmm)
+        if fill is not None:
+            spans.append(fill)
+        if not spans:
+            continue
+        if level.dark:
+            bitmap |= _paint(spans, window)
+        else:
+            bitmap &= ~_paint(spans, window)
+    return bitmap
+
+
+def board_window(layers, ppmm, margin=1.0):
+    """(row, column, height, width) in board pixels around everything layers draw, or None."""
+    boxes = [box for box in (layer.bounds() for layer in layers) if box is not None]
+    if not boxes:
+        return None
+    x0 = min(box[0] for box in boxes) - margin
+    y0 = min(box[1] for box in boxes) - margin
+    x1 = max(box[2] for box in boxes) + margin
+    y1 = max(box[3] for box in boxes) + margin
+    row, column = int(math.floor(-y1 * ppmm)), int(math.floor(x0 * ppmm))
+    return row, column, int(math.ceil(-y0 * ppmm)) - row + 1, int(math.ceil(x1 * ppmm)) - column + 1
+
+
+def tiles(window, size):
+    row, column, height, width = window
+    return [(row + top, column + left, min(size, height - top), min(size, width - left))
+            for top in range(0, height, size) for left in range(0, width, size)]
+
+
+def render(layer, dpi=1000, size=2048, processes=None):
+    """(bitmap, window) of a whole layer, rendered tile by tile in a process pool."""
+    ppmm = dpi / 25.4
+    window = board_window([layer], ppmm)
+    if window is None:
+        return numpy.zeros((0, 0), dtype=bool), None
+    bitmap = numpy.zeros(window[2:], dtype=bool)
+    parts = tiles(window, size)
+    for part, result in zip(parts, batch.run(rasterize, [(str(part), (layer, part, ppmm)) for part in parts],
+                                             processes)):
+        if not result.ok:
+            raise ValueError("Rendering {} failed:\n{}".format(layer.name, result.error))
+        top, left = part[0] - window[0], part[1] - window[1]
+        bitmap[top:top + part[2], left:left + part[3]] = result.result
+    return bitmap, window
+
+
+def _diff_tile(old, new, window, ppmm, cell, image):
+    """Counts of removed and added pixels per cell in window, plus the image tile when image."""
+    before = rasterize(old, window, ppmm)
+    after = rasterize(new, window, ppmm)
+    removed = before & ~after
+    added = after & ~before
+    counts = {}
+    for kind, changed in ((0, removed), (1, added)):
+        if not changed.any():
+            continue
+        rows, columns = numpy.nonzero(changed)
+        cells = numpy.stack(((rows + window[0]) // cell, (columns + window[1]) // cell), axis=1)
+        found, number = numpy.unique(cells, axis=0, return_counts=True)
+        for (cell_row, cell_column), count in zip(found.tolist(), number.tolist()):
+            counts.setdefault((cell_row, cell_column), [0, 0])[kind] += count
+    if not image:
+        return counts, None
+    pixels = numpy.full(before.shape, EMPTY, dtype=numpy.uint8)
+    pixels[before & after] = SAME
+    pixels[removed] = REMOVED
+    pixels[added] = ADDED
+    return counts, pixels
+
+
+def regions(counts):
+    """The cells in counts grouped into touching (8 way) regions, largest change first."""
+    left = set(counts)
+    found = []
+    while left:
+        todo = [left.pop()]
+        members = []
+        while todo:
+            cell = todo.pop()
+            members.append(cell)
+            for row in (cell[0] - 1, cell[0], cell[0] + 1):
+                for column in (cell[1] - 1, cell[1], cell[1] + 1):
+                    if (row, column) in left:
+                        left.remove((row, column))
+                        todo.append((row, column))
+        found.append(sorted(members))
+    return sorted(found, key=lambda members: (-sum(sum(counts[cell]) for cell in members), members[0]))
+
+
+def write_png(file_name, pixels, colours=palette):
+    """Write a uint8 array of palette indices as an 8 bit palette PNG."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    height, width = pixels.shape
+    compressor = zlib.compressobj(6)
+    data = []
+    for top in range(0, height, 256):
+        block = pixels[top:top + 256]
+        rows = numpy.zeros((len(block), width + 1), dtype=numpy.uint8)
+        rows[:, 1:] = block
+        data.append(compressor.compress(rows.tobytes()))
+    data.append(compressor.flush())
+    with open(file_name, mode="wb") as png_file:
+        png_file.write(b"\x89PNG\r\n\x1a\n")
+        png_file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)))
+        png_file.write(chunk(b"PLTE", b"".join(struct.pack("BBB", *colour) for colour in colours)))
+        png_file.write(chunk(b"IDAT", b"".join(data)))
+        png_file.write(chunk(b"IEND", b""))
+
+
+def diff(old, new, dpi=1000, cell=10.0, size=2048, image_name=None, processes=None):
+    """
+    Compare Layers old and new, returns [(box, removed, added), ...] per
+    changed region, box (x0, y0, x1, y1) and the areas in mm, and writes the
+    difference image to image_name if given.
+    """
+    ppmm = dpi / 25.4
+    window = board_window([old, new], ppmm)
+    if window is None:
+        return []
+    cell_pixels = max(1, int(round(cell * ppmm)))
+    parts = tiles(window, size)
+    jobs = [(str(part), (old, new, part, ppmm, cell_pixels, image_name is not None)) for part in parts]
+    counts = {}
+    pixels = numpy.zeros(window[2:], dtype=numpy.uint8) if image_name else None
+    for part, result in zip(parts, batch.run(_diff_tile, jobs, processes)):
+        if not result.ok:
+            raise ValueError("Comparing {} failed:\n{}".format(old.name, result.error))
+        for key, (removed, added) in result.result[0].items():
+            total = counts.setdefault(key, [0, 0])
+            total[0] += removed
+            total[1] += added
+        if pixels is not None:
+            top, left = part[0] - window[0], part[1] - window[1]
+            pixels[top:top + part[2], left:left + part[3]] = result.result[1]
+    if pixels is not None:
+        write_png(image_name, pixels)
+    changes = []
+    for members in regions(counts):
+        rows = [row for row, _ in members]
+        columns = [column for _, column in members]
+        box = (min(columns) * cell_pixels / ppmm, -(max(rows) + 1) * cell_pixels / ppmm,
+               (max(columns) + 1) * cell_pixels / ppmm, -min(rows) * cell_pixels / ppmm)
+        changes.append((box, sum(counts[cell][0] for cell in members) / ppmm ** 2,
+                        sum(counts[cell][1] for cell in members) / ppmm ** 2))
+    return changes
+
+
+def layer_name(file_name):
+    """The layer part of a KiCad Gerber name, project-F.Cu.GTL -> F.Cu.GTL."""
+    return os.path.basename(file_name).rsplit("-", 1)[-1]
+
+
+def pairs(old_path, new_path):
+    """[(name, old file, new file), ...] of the layers in both, unmatched files are reported."""
+    if not os.path.isdir(old_path) or not os.path.isdir(new_path):
+        return [(layer_name(new_path), old_path, new_path)]
+    old = dict((layer_name(name).lower(), name) for name in gerber.find_files([old_path]))
+    new = dict((layer_name(name).lower(), name) for name in gerber.find_files([new_path]))
+    for key in sorted(set(old) ^ set(new)):
+        print("{} is only in {}".format(layer_name((old.get(key) or new.get(key))),
+                                        old_path if key in old else new_path))
+    return [(layer_name(new[key]), old[key], new[key]) for key in sorted(set(old) & set(new))]
+
+
+def main(old_path, new_path, dpi=1000, cell=10.0, size=2048, output=None, processes=None):
+    """Compare two Gerber files or directories, returns the number of changed layers."""
+    changed = 0
+    for name, old_name, new_name in pairs(old_path, new_path):
+        start = default_timer()
+        image_name = os.path.join(output, name + ".png") if output else None
+        changes = diff(gerber.read(old_name), gerber.read(new_name), dpi, cell, size, image_name, processes)
+        elapsed = default_timer() - start
+        if not changes:
+            print("{}: unchanged ({:.2f}s)".format(name, elapsed))
+            continue
+        changed += 1
+        print("{}: {:.3f}mm2 removed, {:.3f}mm2 added in {} regions ({:.2f}s)".format(
+            name, sum(change[1] for change in changes), sum(change[2] for change in changes), len(changes), elapsed))
+        for (x0, y0, x1, y1), removed, added in changes:
+            print("  x {:8.2f} .. {:8.2f}  y {:8.2f} .. {:8.2f}: {:.3f}mm2 removed, {:.3f}mm2 added".format(
+                x0, x1, y0, y1, removed, added))
+    return changed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", help="Gerber file or directory of the old revision")
+    parser.add_argument("new", help="Gerber file or directory of the new revision")
+    parser.add_argument("--dpi", type=float, default=1000, help="resolution (default: 1000)")
+    parser.add_argument("--cell", type=float, default=10.0, help="size of the cells changes are counted in, mm")
+    parser.add_argument("--tile", type=int, default=2048, help="tile size in pixels (default: 2048)")
+    parser.add_argument("-o", "--output", help="write the difference images to this directory")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    if args.output and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    sys.exit(1 if main(args.old, args.new, args.dpi, args.cell, args.tile, args.output, args.jobs) else 0)
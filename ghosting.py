@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Ghosting and rollover analysis of a keyboard matrix.
+
+The matrix is read from a .net or .kicad_pcb (see connectivity.py) and
+treated as a circuit: a pressed switch joins its two nets both ways, a diode
+only lets current through from its anodes to its cathode. The scan drives a
+row and reads the columns, so a column sees a row when there is a path from
+the column to the row through pressed switches and forward diodes.
+
+Keys are kept as bits of an int, the keys of every row and column as
+bitsets, so what a set of pressed keys reports is a few bitset breadth first
+searches. Switches wired in parallel (clones, eg S15 and S115) are one key.
+
+Nothing is enumerated. The smallest set of pressed keys that makes a key
+show up without being pressed is the shortest path from its column to its
+row that doesn't use its own switch, counting switches but not diodes. The
+matrix has n key rollover when the smallest such set over all keys has n + 1
+keys, and full NKRO when there is none. A group of keys is checked by
+pressing all of it (ghosting only grows as more keys are pressed) and then
+finding the smallest subset of the group behind every ghost:
+
+    ghosting.py smk65.net -g S59,S60,S61,S18,S31,S32,S33
+"""
+
+from __future__ import print_function
+
+import re
+import argparse
+from collections import deque
+
+from connectivity import DIODE_PREFIX, SWITCH_PINS, column_net, read_pins, row_net
+
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _natural_key(ref):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", ref)]
+
+
+class Matrix(object):
+    """
+    The switches and diodes of a board as a graph over its nets.
+
+    keys are named after their first switch, refs[key] lists all the
+    switches wired in parallel as that key.
+    """
+
+    def __init__(self, pins):
+        self.nets = {}
+        switch_pins = {}
+        diode_pins = {}
+        for ref, pin, net in pins:
+            if not net:
+                continue
+            if pin in SWITCH_PINS:
+                switch_pins.setdefault(ref, {})[pin] = self._net(net)
+            elif ref.startswith(DIODE_PREFIX):
+                diode_pins.setdefault(ref, []).append(net)
+        # Diodes point from their other pins to the one on a row
+        self.forward = [0] * len(self.nets)
+        for ref, nets in diode_pins.items():
+            cathodes = [self._net(net) for net in nets if row_net.match(net)]
+            anodes = [self._net(net) for net in nets if not row_net.match(net)]
+            for anode in anodes:
+                for cathode in cathodes:
+                    self._edge(anode, cathode)
+        self.forward.extend([0] * (len(self.nets) - len(self.forward)))
+        by_nets = {}
+        for ref in sorted(switch_pins, key=_natural_key):
+            nets = switch_pins[ref]
+            if len(nets) == len(SWITCH_PINS):
+                by_nets.setdefault(frozenset(nets.values()), []).append(ref)
+        self.keys = []
+        self.refs = {}
+        self.ends = []
+        for nets, refs in sorted(by_nets.items(), key=lambda item: _natural_key(item[1][0])):
+            self.keys.append(refs[0])
+            self.refs[refs[0]] = refs
+            self.ends.append(tuple(sorted(nets)) * (2 if len(nets) == 1 else 1))
+        self.bit = dict((key, bit) for bit, key in enumerate(self.keys))
+        self.key_of = dict((ref, key) for key, refs in self.refs.items() for ref in refs)
+        names = sorted(self.nets, key=self.nets.get)
+        self.rows = [net for net, name in enumerate(names) if row_net.match(name)]
+        self.columns = [net for net, name in enumerate(names) if column_net.match(name)]
+        self.net_names = names
+        self.row_mask = sum(1 << row for row in self.rows)
+        # The keys on every row and column, from what each key reports alone
+        self.row_keys = dict((row, 0) for row in self.rows)
+        self.column_keys = dict((column, 0) for column in self.columns)
+        self.positions = {}
+        self.unplaced = []
+        for key in self.keys:
+            seen = self.reach(1 << self.bit[key])
+            pairs = [(row, column) for column, rows in seen.items() for row in _bits(rows)]
+            if len(pairs) != 1:
+                self.unplaced.append(key)
+                continue
+            row, column = pairs[0]
+            self.positions[key] = pairs[0]
+            self.row_keys[row] |= 1 << self.bit[key]
+            self.column_keys[column] |= 1 << self.bit[key]
+
+    def _net(self, name):
+        if name not in self.nets:
+            self.nets[name] = len(self.nets)
+        return self.nets[name]
+
+    def _edge(self, start, end):
+        while len(self.forward) <= max(start, end):
+            self.forward.append(0)
+        self.forward[start] |= 1 << end
+
+    def mask(self, keys):
+        mask = 0
+        for key in keys:
+            mask |= 1 << self.bit[key]
+        return mask
+
+    def names(self, mask):
+        return [self.keys[bit] for bit in _bits(mask)]
+
+    def reach(self, pressed):
+        """column -> bitset of the rows it sees with the keys in pressed down."""
+        adjacent = list(self.forward)
+        for bit in _bits(pressed):
+            a, b = self.ends[bit]
+            adjacent[a] |= 1 << b
+            adjacent[b] |= 1 << a
+        seen = {}
+        for column in self.columns:
+            reached = frontier = 1 << column
+            while frontier:
+                step = 0
+                for net in _bits(frontier):
+                    step |= adjacent[net]
+                frontier = step & ~reached
+                reached |= frontier
+            if reached & self.row_mask:
+                seen[column] = reached & self.row_mask
+        return seen
+
+    def reported(self, pressed):
+        """Bitset of the keys the scan reports with the keys in pressed down."""
+        reported = 0
+        for column, rows in self.reach(pressed).items():
+            for row in _bits(rows):
+                reported |= self.column_keys[column] & self.row_keys[row]
+        return reported
+
+    def ghosts(self, pressed):
+        return self.reported(pressed) & ~pressed
+
+    def smallest_ghost_set(self, key, allowed=None):
+        """
+        The fewest keys, from the bitset allowed (default all), that make key
+        show up without it being pressed, or None if nothing can.
+        """
+        row, column = self.positions[key]
+        allowed = ((1 << len(self.keys)) - 1 if allowed is None else allowed) & ~(1 << self.bit[key])
+        switches = [[] for _ in self.forward]
+        for bit in _bits(allowed):
+            a, b = self.ends[bit]
+            switches[a].append((b, bit))
+            switches[b].append((a, bit))
+        # 0-1 breadth first search, diodes are free and switches cost one key
+        distance = {column: 0}
+        previous = {column: None}
+        queue = deque([column])
+        while queue:
+            net = queue.popleft()
+            if net == row:
+                break
+            for target in _bits(self.forward[net]):
+                if distance.get(target, len(self.keys) + 1) > distance[net]:
+                    distance[target] = distance[net]
+                    previous[target] = (net, None)
+                    queue.appendleft(target)
+            for target, bit in switches[net]:
+                if distance.get(target, len(self.keys) + 1) > distance[net] + 1:
+                    distance[target] = distance[net] + 1
+                    previous[target] = (net, bit)
+                    queue.append(target)
+        if row not in distance:
+            return None
+        keys = []
+        net = row
+        while previous[net] is not None:
+            net, bit = previous[net]
+            if bit is not None:
+                keys.append(self.keys[bit])
+        return sorted(keys, key=_natural_key)
+
+    def ghost_sets(self, keys=None, allowed=None):
+        """(key, smallest ghost set) for every placed key in keys that can be ghosted, smallest first."""
+        found = []
+        for key in keys or self.keys:
+            if key in self.positions:
+                keys_down = self.smallest_ghost_set(key, allowed)
+                if keys_down is not None:
+                    found.append((key, keys_down))
+        return sorted(found, key=lambda item: (len(item[1]), _natural_key(item[0])))
+
+    def rollover(self, sets=None):
+        """n for n key rollover, None for full NKRO."""
+        sets = self.ghost_sets() if sets is None else sets
+        return len(sets[0][1]) - 1 if sets else None
+
+    def group_ghost_sets(self, group):
+        """
+        Every ghost a group of keys can cause, with the smallest subset of
+        the group that causes it.
+        """
+        group_mask = self.mask(group)
+        candidates = self.names(self.ghosts(group_mask))
+        # A key of the group can also show up while it is up and the rest is down
+        candidates.extend(key for key in group if key in self.positions and
+                          self.reported(group_mask & ~(1 << self.bit[key])) >> self.bit[key] & 1)
+        return self.ghost_sets(candidates, group_mask)
+
+    def describe(self, key):
+        return "{} ({})".format(key, ", ".join(self.refs[key][1:])) if len(self.refs[key]) > 1 else key
+
+
+def main(file_name, group=None, show=10):
+    matrix = Matrix(read_pins(file_name))
+    print("{}: {} keys on {} rows and {} columns".format(
+        file_name, len(matrix.positions), len(matrix.rows), len(matrix.columns)))
+    if matrix.unplaced:
+        print("Not in the matrix: {}".format(", ".join(matrix.unplaced)))
+    sets = matrix.ghost_sets()
+    rollover = matrix.rollover(sets)
+    if rollover is None:
+        print("Full NKRO, no combination of keys ghosts")
+    else:
+        print("{} key rollover, worst cases:".format(rollover))
+        for key, keys_down in sets[:show]:
+            print("  {} -> {}".format(" + ".join(keys_down), matrix.describe(key)))
+    if group:
+        unknown = [ref for ref in group if ref not in matrix.key_of]
+        if unknown:
+            raise ValueError("Not a key: {}".format(", ".join(unknown)))
+        group = [matrix.key_of[ref] for ref in group]
+        group_sets = matrix.group_ghost_sets(group)
+        if not group_sets:
+            print("{} can be pressed in any combination".format(" + ".join(group)))
+        for key, keys_down in group_sets[:show]:
+            print("  {} -> {}".format(" + ".join(keys_down), matrix.describe(key)))
+    return matrix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", metavar="FILE", help=".net or .kicad_pcb file")
+    parser.add_argument("-g", "--group", help="comma separated switch references to check together, eg modifiers and WASD")
+    parser.add_argument("-n", "--show", type=int, default=10, help="number of ghost sets to list")
+    args = parser.parse_args()
+    try:
+        main(args.file, args.group.split(",") if args.group else None, args.show)
+    except ValueError as error:
+        parser.error(str(error))
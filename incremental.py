@@ -0,0 +1,150 @@
+"""
+Incremental pcb regeneration for layout.py.
+
+Every generated module is fingerprinted (template plus placement values) and
+the fingerprints are stored next to the pcb. On the next run only modules
+whose fingerprint changed are replaced; everything else in the existing
+.kicad_pcb, including routed segments, vias, zones and any modules that were
+added by hand, is copied through byte for byte.
+"""
+
+import os
+import re
+import json
+
+from kicad_sexpr import top_level_spans, root_end, module_reference
+from output_cache import write_if_changed
+
+_nets_count = re.compile(br"\(nets \d+\)")
+
+
+def fingerprints_file_name(pcb_name):
+    return os.path.splitext(pcb_name)[0] + "-fingerprints.json"
+
+
+def load_fingerprints(file_name):
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name) as fingerprints_file:
+        return json.load(fingerprints_file)
+
+
+def save_fingerprints(file_name, fingerprints):
+    with open(file_name, mode="w") as fingerprints_file:
+        json.dump(fingerprints, fingerprints_file, indent=0, sort_keys=True)
+
+
+def write_pcb(pcb_name, header, emitter, footer):
+    """
+    Write a complete pcb and remember the fingerprint of every module.
+
+    The file is left alone if it already has exactly these contents, returns
+    True if it was written.
+    """
+    written = write_if_changed(pcb_name, header + emitter.getvalue() + footer)
+    fingerprints = dict((reference, fingerprint) for reference, fingerprint, _ in emitter.modules())
+    fingerprints_name = fingerprints_file_name(pcb_name)
+    if written or load_fingerprints(fingerprints_name) != fingerprints:
+        save_fingerprints(fingerprints_name, fingerprints)
+    return written
+
+
+def _line_start(data, pos):
+    """Move pos back over the indentation in front of it."""
+    while pos > 0 and data[pos - 1:pos] in (b" ", b"\t"):
+        pos -= 1
+    return pos
+
+
+def update_pcb(pcb_name, emitter, net_table=None):
+    """
+    Patch the modules of an existing pcb in place.
+
+    Modules are matched on their reference. A module is replaced when its
+    fingerprint differs from the one recorded by the previous run, removed
+    when the previous run created it but the layout no longer has it, and
+    appended when it is new. Modules that were never generated are left
+    alone. net_table, the (net ...) lines of the pcb as bytes, replaces the
+    existing ones and the (nets N) count when it differs. It has to keep the
+    codes of the existing nets (see netlist.Netlist), the tracks and zones
+    that are kept still use them. The file is only rewritten when something
+    changed.
+
+    Returns (changed, added, removed) module counts.
+    """
+    fingerprints_name = fingerprints_file_name(pcb_name)
+    old = load_fingerprints(fingerprints_name)
+    new = {}
+    order = []
+    for reference, fingerprint, text in emitter.modules():
+        if reference not in new:
+            order.append(reference)
+        new[reference] = (fingerprint, text.strip())
+
+    with open(pcb_name, mode="rb") as pcb_txt:
+        data = pcb_txt.read()
+    # (start, end, replacement) for every part of data that changes
+    edits = []
+    seen = set()
+    changed = removed = 0
+    nets = []
+    net_class = None
+    general = None
+    for kind, start, end in top_level_spans(data):
+        if kind == b"general" and general is None:
+            general = (start, end)
+        elif kind == b"net":
+            nets.append((start, end))
+        elif kind == b"net_class" and net_class is None:
+            net_class = start
+        if kind != b"module":
+            continue
+        reference = module_reference(data, start, end)
+        if reference in seen:
+            continue
+        if reference in new:
+            seen.add(reference)
+            fingerprint, text = new[reference]
+            if old.get(reference) == fingerprint:
+                continue
+            edits.append((start, end, text))
+            changed += 1
+        elif reference in old:
+            if data[end:end + 1] == b"\n":
+                end += 1
+            edits.append((_line_start(data, start), end, b""))
+            removed += 1
+
+    if net_table is not None:
+        if nets:
+            start, end = _line_start(data, nets[0][0]), nets[-1][1]
+            if data[start:end] != net_table:
+                edits.append((start, end, net_table))
+        else:
+            start = _line_start(data, net_class) if net_class is not None else root_end(data)
+            edits.append((start, start, net_table + b"\n\n"))
+        count = _nets_count.search(data, *general) if general is not None else None
+        if count is not None:
+            text = "(nets {})".format(net_table.count(b"(net ")).encode("ascii")
+            if data[count.start():count.end()] != text:
+                edits.append((count.start(), count.end(), text))
+
+    added = [reference for reference in order if reference not in seen]
+    if added:
+        close = root_end(data)
+        text = b"".join(b"  " + new[reference][1] + b"\n" for reference in added)
+        if not data[:close].endswith(b"\n"):
+            text = b"\n" + text
+        edits.append((close, close, text))
+    if edits:
+        out = []
+        pos = 0
+        for start, end, text in sorted(edits, key=lambda edit: edit[:2]):
+            out.append(data[pos:start])
+            out.append(text)
+            pos = end
+        out.append(data[pos:])
+        write_if_changed(pcb_name, b"".join(out))
+    if edits or old != dict((ref, new[ref][0]) for ref in order):
+        save_fingerprints(fingerprints_name, dict((ref, new[ref][0]) for ref in order))
+    return changed, len(added), removed
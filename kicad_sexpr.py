@@ -0,0 +1,317 @@
+"""
+Helpers for KiCad s-expression files (.kicad_pcb, .kicad_mod).
+
+The files are handled as bytes so that everything that is not touched can
+be copied through exactly as KiCad wrote it.
+"""
+
+import os
+import re
+import mmap
+
+_string = re.compile(br'"(?:[^"\\]|\\.)*"')
+_token = re.compile(br'"(?:[^"\\]|\\.)*"|(\()|(\))')
+_leaf = re.compile(br'\([^()]*\)')
+_head = re.compile(br'\(\s*([^\s()"]+)')
+_atom = re.compile(br'(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+)')
+_reference = re.compile(br'\(fp_text\s+reference\s+("(?:[^"\\]|\\.)*"|[^\s()]+)')
+_value = re.compile(br'\(fp_text\s+value\s+("(?:[^"\\]|\\.)*"|[^\s()]+)')
+# Where KiCad starts a child of the root: a new line indented by two spaces,
+# or right after the closing parenthesis of the previous child.
+_child_start = re.compile(br'\n  \)?(?=\()')
+
+
+def _scan(data, pos, end, depth=1):
+    """Exact, token by token scan of data[pos:end] starting at depth."""
+    start = pos
+    for match in _token.finditer(data, pos, end):
+        if match.lastindex == 1:
+            depth += 1
+            if depth == 2:
+                start = match.start()
+        elif match.lastindex == 2:
+            depth -= 1
+            if depth == 1:
+                yield _head.match(data, start).group(1), start, match.end()
+            elif depth < 1:
+                return
+    if depth != 1:
+        raise ValueError("Unbalanced node starting at offset {}".format(start))
+
+
+def _is_child(node):
+    """
+    Cheap check that node (stripped) is exactly one child formatted the way
+    KiCad writes them: balanced, still open at the end of the first line and
+    every further line indented by four spaces except the closing one.
+    """
+    if b'"' in node:
+        node = _string.sub(b'""', node)
+    if not node.startswith(b"(") or node.count(b"(") != node.count(b")"):
+        return False
+    first_line, newline, rest = node.partition(b"\n")
+    if not newline:
+        # A single line could hold several nodes. Drop the nested leaf nodes
+        # of a line like (segment (start 1 2) (end 3 4) (net 5)), what is
+        # left must not contain any parentheses.
+        inner = node[1:-1]
+        for _ in range(3):
+            inner = _leaf.sub(b"", inner)
+            if b"(" not in inner and b")" not in inner:
+                return node.endswith(b")")
+        depth = 0
+        for match in _token.finditer(first_line):
+            depth += 1 if match.lastindex == 1 else -1
+            if depth == 0:
+                return match.end() == len(first_line)
+        return False
+    if first_line.count(b"(") <= first_line.count(b")"):
+        return False
+    lines = rest.count(b"\n") + 1
+    if rest.endswith(b")") and rest.rfind(b"\n") == rest.rfind(b"\n  )"):
+        lines -= 1
+    return rest.startswith(b"    ") and rest.count(b"\n    ") == lines - 1
+
+
+def top_level_spans(data):
+    """
+    Yield (kind, start, end) for every direct child of the root node.
+
+    data[start:end] is the complete child from its opening to its closing
+    parenthesis and kind is its first atom, eg b"module" or b"segment".
+
+    KiCad starts every child of the root on a line of its own, so the file
+    is cut there and each piece only gets a cheap check. Anything that does
+    not look the way KiCad writes files is scanned token by token instead.
+    """
+    root = _head.search(data)
+    if root is None:
+        raise ValueError("No root node found")
+    root_close = root_end(data)
+    bounds = [match.end() for match in _child_start.finditer(data, root.end(), root_close)]
+    bounds.append(root_close)
+    pos = root.end()
+    for bound in bounds:
+        node = data[pos:bound]
+        stripped = node.strip()
+        if not stripped:
+            pos = bound
+            continue
+        if _is_child(stripped):
+            start = pos + node.index(b"(")
+            yield _head.match(data, start).group(1), start, start + len(stripped)
+            pos = bound
+            continue
+        if b"\n" not in stripped:
+            # Several children on one line, eg (version 4) (host pcbnew 4.0.2)
+            try:
+                spans = list(_scan(data, pos, bound))
+            except ValueError:
+                spans = None
+            if spans:
+                for span in spans:
+                    yield span
+                pos = bound
+                continue
+        # Not the usual layout: scan the remainder exactly
+        for span in _scan(data, pos, root_close + 1):
+            yield span
+        return
+
+
+def root_end(data):
+    """Offset of the parenthesis that closes the root node."""
+    # Works on an mmap too, which has no rstrip()
+    end = data.rfind(b")")
+    if end < 0:
+        raise ValueError("No root node found")
+    return end
+
+
+def unquote(atom):
+    if atom.startswith(b'"') and atom.endswith(b'"'):
+        return re.sub(br'\\(.)', br'\1', atom[1:-1])
+    return atom
+
+
+def quote(atom):
+    """atom as KiCad writes it, quoted only if it has to be."""
+    if atom and not re.search(r'[\s()"\\]', atom):
+        return atom
+    return '"' + atom.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def module_reference(data, start=0, end=None):
+    """The reference of the module in data[start:end], None if it has none."""
+    match = _reference.search(data, start, len(data) if end is None else end)
+    if match is None:
+        return None
+    return unquote(match.group(1)).decode("utf-8")
+
+
+def module_value(data, start=0, end=None):
+    """The value of the module in data[start:end], None if it has none."""
+    match = _value.search(data, start, len(data) if end is None else end)
+    if match is None:
+        return None
+    return unquote(match.group(1)).decode("utf-8")
+
+
+def child_spans(data, start, end):
+    """Yield (kind, start, end) for the direct children of the node data[start:end]."""
+    return _scan(data, start + 1, end - 1)
+
+
+def parse(data):
+    """
+    Parse the first s-expression in data into nested lists.
+
+    Atoms are returned as text, quoted strings without their quotes, so
+    (pad 1 smd rect (at 0 1)) becomes ["pad", "1", "smd", "rect", ["at", "0", "1"]].
+    """
+    stack = []
+    node = None
+    for match in _atom.finditer(data):
+        kind = match.lastindex
+        if kind == 1:
+            child = []
+            if node is not None:
+                node.append(child)
+                stack.append(node)
+            node = child
+        elif kind == 2:
+            if not stack:
+                return node
+            node = stack.pop()
+        elif node is None:
+            raise ValueError("Expected '(' at offset {}".format(match.start()))
+        elif kind == 3:
+            node.append(unquote(b'"' + match.group(3) + b'"').decode("utf-8"))
+        else:
+            node.append(match.group(4).decode("utf-8"))
+    raise ValueError("Unexpected end of data")
+
+
+class Node(object):
+    """
+    A direct child of the root of an indexed file.
+
+    Only its kind and byte offsets are known up front, the text is read and
+    parsed into nested lists (see parse) the first time it is asked for.
+    """
+
+    __slots__ = ("data", "kind", "start", "end", "_tree")
+
+    def __init__(self, data, kind, start, end):
+        self.data = data
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self._tree = None
+
+    def __repr__(self):
+        return "<Node {} {}:{}>".format(self.kind.decode("utf-8"), self.start, self.end)
+
+    def text(self):
+        return self.data[self.start:self.end]
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            self._tree = parse(self.text())
+        return self._tree
+
+    @property
+    def parsed(self):
+        return self._tree is not None
+
+    def reference(self):
+        """Reference of a module, without parsing it."""
+        return module_reference(self.data, self.start, self.end)
+
+
+class Index(object):
+    """
+    Byte offsets of the direct children of the root node of a KiCad file.
+
+    Building the index only finds where each top level node (module, segment,
+    via, zone, net, ...) starts and ends; a node is only parsed when its tree
+    is used. Index.open() maps the file into memory instead of reading it, so
+    a query only touches the parts of the file it looks at:
+
+        with Index.open("smk65.kicad_pcb") as board:
+            zones = board.nodes(b"zone")
+            print(len(zones), board.nets()[1])
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.by_kind = {}
+        self.all = []
+        for kind, start, end in top_level_spans(data):
+            node = Node(data, kind, start, end)
+            self.all.append(node)
+            self.by_kind.setdefault(kind, []).append(node)
+        self._file = None
+        self._modules = None
+
+    @classmethod
+    def open(cls, file_name):
+        data_file = open(file_name, mode="rb")
+        try:
+            if os.fstat(data_file.fileno()).st_size:
+                data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = b""
+            index = cls(data)
+        except Exception:
+            data_file.close()
+            raise
+        index._file = data_file
+        return index
+
+    def close(self):
+        """Let go of the file, nodes can not be parsed anymore after this."""
+        if hasattr(self.data, "close"):
+            self.data.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.all)
+
+    def __iter__(self):
+        return iter(self.all)
+
+    def kinds(self):
+        """Number of nodes of every kind, eg {b"module": 206, b"segment": 47, ...}."""
+        return dict((kind, len(nodes)) for kind, nodes in self.by_kind.items())
+
+    def nodes(self, kind=None):
+        """All nodes in file order, or those of one kind."""
+        if kind is None:
+            return list(self.all)
+        return list(self.by_kind.get(kind, ()))
+
+    def module(self, reference):
+        """The module with reference, KeyError if there is none."""
+        if self._modules is None:
+            self._modules = {}
+            for node in self.by_kind.get(b"module", ()):
+                self._modules.setdefault(node.reference(), node)
+        return self._modules[reference]
+
+    def nets(self):
+        """{code: name} from the net table."""
+        nets = {}
+        for node in self.by_kind.get(b"net", ()):
+            tree = node.tree
+            nets[int(tree[1])] = tree[2] if len(tree) > 2 else ""
+        return nets
@@ -0,0 +1,174 @@
+"""
+Parser for http://www.keyboard-layout-editor.com/ json.
+
+A layout is compiled into a KeyTable: one array per property (position,
+size, secondary size, rotation, legend) rather than one object per key, so
+that large layouts stay small in memory and every coordinate on the board
+can be worked out in a single pass over the columns.
+
+Coordinates are in key units (1u = one 19.05mm switch pitch) with y going
+down, like keyboard-layout-editor. Rotations are in degrees, clockwise as
+seen on screen, around (rx, ry).
+"""
+
+import math
+from array import array
+
+import six
+
+# Key flags
+DECAL = 1      # d: true, a label that is not a key
+GHOST = 2      # g: true, drawn translucent, eg an alternative position
+STEPPED = 4    # l: true, stepped caps lock
+NUB = 8        # n: true, homing nub
+
+_float_columns = ("x", "y", "w", "h", "x2", "y2", "w2", "h2", "r", "rx", "ry")
+
+
+class KeyTable(object):
+    """
+    Columnar storage for the keys of a layout.
+
+    x, y, w, h is the key's primary rectangle (before rotation), x2, y2, w2,
+    h2 the secondary rectangle relative to it (ISO enter, stepped keys),
+    r, rx, ry the rotation. legend holds an index into legends, row the row
+    of the json the key was defined in and flags the DECAL/GHOST/... bits.
+    """
+
+    def __init__(self):
+        for name in _float_columns:
+            setattr(self, name, array("d"))
+        self.legend = array("i")
+        self.row = array("i")
+        self.flags = array("B")
+        self.legends = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, legend, row, flags, x, y, w, h, x2, y2, w2, h2, r, rx, ry):
+        self.legend.append(len(self.legends))
+        self.legends.append(legend)
+        self.row.append(row)
+        self.flags.append(flags)
+        for name, value in zip(_float_columns, (x, y, w, h, x2, y2, w2, h2, r, rx, ry)):
+            getattr(self, name).append(value)
+
+    def switches(self):
+        """Indices of the keys that need a switch, ie everything but decals and ghosts."""
+        flags = self.flags
+        return [i for i in six.moves.range(len(flags)) if not flags[i] & (DECAL | GHOST)]
+
+    def placements(self, offsets, scale=1.0, origin=(0.0, 0.0), keys=None):
+        """
+        Board coordinates for points attached to each key's switch.
+
+        The switch sits in the centre of the primary rectangle. Every key gets
+        one affine transform (rotation about (rx, ry), then scale and origin)
+        which is applied to all offsets at once; offsets are (dx, dy) pairs in
+        board units relative to the switch, eg (diode_x_offset,
+        diode_y_offset), and turn with the key.
+
+        origin is added to the key position in key units before scaling and
+        refers to the centre of a 1u key at (0, 0). Returns
+        (rotations, [(xs, ys) for each offset]) with one entry per key in
+        keys (default: switches()).
+        """
+        if keys is None:
+            keys = self.switches()
+        ox, oy = origin
+        kx, ky, kw, kh = self.x, self.y, self.w, self.h
+        kr, krx, kry = self.r, self.rx, self.ry
+        count = len(keys)
+        # Per key affine transform: board = (e, f) + [[a, -b], [b, a]] . offset
+        a = array("d", [1.0]) * count
+        b = array("d", [0.0]) * count
+        e = array("d", [0.0]) * count
+        f = array("d", [0.0]) * count
+        rotations = array("d", [0.0]) * count
+        trig = {}
+        for n, i in enumerate(keys):
+            angle = kr[i]
+            if angle:
+                if angle not in trig:
+                    radians = math.radians(angle)
+                    trig[angle] = (math.cos(radians), math.sin(radians))
+                cos, sin = trig[angle]
+                # Turn the switch centre around the rotation origin
+                cx = kx[i] + kw[i] / 2 - krx[i]
+                cy = ky[i] + kh[i] / 2 - kry[i]
+                px = ox + krx[i] + cx * cos - cy * sin - 0.5
+                py = oy + kry[i] + cx * sin + cy * cos - 0.5
+                a[n], b[n] = cos, sin
+                rotations[n] = angle
+            else:
+                px = ox + kx[i] + (kw[i] - 1.0) / 2
+                py = oy + ky[i] + (kh[i] - 1.0) / 2
+            e[n] = px * scale
+            f[n] = py * scale
+        points = []
+        for dx, dy in offsets:
+            if not dx and not dy:
+                points.append((array("d", e), array("d", f)))
+                continue
+            xs = array("d", e)
+            ys = array("d", f)
+            for n in six.moves.range(count):
+                if b[n]:
+                    xs[n] += a[n] * dx - b[n] * dy
+                    ys[n] += b[n] * dx + a[n] * dy
+                else:
+                    xs[n] += dx
+                    ys[n] += dy
+            points.append((xs, ys))
+        return rotations, points
+
+
+def parse(layout):
+    """Compile the decoded json of a layout into a KeyTable."""
+    table = KeyTable()
+    x = y = 0.0
+    w = h = 1.0
+    x2 = y2 = w2 = h2 = 0.0
+    r = rx = ry = 0.0
+    flags = 0
+    row_number = 0
+    for row in layout:
+        if not isinstance(row, list):
+            # Layout metadata (name, author, background...)
+            continue
+        for item in row:
+            if isinstance(item, dict):
+                if "r" in item:
+                    r = float(item["r"])
+                if "rx" in item:
+                    rx = float(item["rx"])
+                    x, y = rx, ry
+                if "ry" in item:
+                    ry = float(item["ry"])
+                    x, y = rx, ry
+                x += float(item.get("x", 0))
+                y += float(item.get("y", 0))
+                if "w" in item:
+                    w = float(item["w"])
+                if "h" in item:
+                    h = float(item["h"])
+                x2 = float(item.get("x2", x2))
+                y2 = float(item.get("y2", y2))
+                w2 = float(item.get("w2", w2))
+                h2 = float(item.get("h2", h2))
+                for key, flag in (("d", DECAL), ("l", STEPPED), ("n", NUB), ("g", GHOST)):
+                    if key in item:
+                        flags = flags | flag if item[key] else flags & ~flag
+            elif isinstance(item, six.string_types):
+                table.append(item, row_number, flags, x, y, w, h,
+                             x2, y2, w2 or w, h2 or h, r, rx, ry)
+                x += w
+                w = h = 1.0
+                x2 = y2 = w2 = h2 = 0.0
+                # Everything but ghost resets after each key
+                flags &= GHOST
+        y += 1
+        x = rx
+        row_number += 1
+    return table
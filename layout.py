@@ -5,13 +5,29 @@ Create a json file using http://www.keyboard-layout-editor.com/
 Use that file to create a kicad schematic and pcb with the switches.
 """
 
-import six
+import io
 import json
 import codecs
 import os
+import sys
+import glob
+import argparse
+import zlib
 from time import time
 from pprint import pprint
 
+import batch
+import drc
+import footprint_lib
+import incremental
+import kicad_sexpr
+import kle
+import netlist
+import output_cache
+import overlap
+import schematic
+from pcb_emitter import PcbEmitter
+
 #
 # footprint_name is used to look up the pcb template below
 #
@@ -25,6 +41,9 @@ from pprint import pprint
 # mxalps-reversed   - mx merged with alps rotated 180 no LEDs or holes
 # mxalps-no-led     - mx merged with alps, but no LEDs or holes
 #
+# Any other name is looked up in footprint_libraries, eg "Keyboard:MXALPS"
+# or just "MXALPS" for the first library that has it.
+#
 footprint_name = "mxalps"
 
 # If 0 the LED slot will be at the top, if you're not using LEDs
@@ -80,6 +99,14 @@ y_origin = 1.5
 diode_template = "diode_MiniMELF"
 # diode_template = "diode_SOD-123"  # 'diode_MiniMELF' 'diode_SOD-123' or 'diode_DO-35'
 
+# KiCad footprint libraries (*.pretty) searched for a footprint_name or
+# diode_template that is not one of the templates below. Parsed footprints
+# are cached in ~/.cache/mechkeys/footprints.
+footprint_libraries = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "kicad-modules", "Keyboard.pretty"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "kicad-modules", "Teensy.pretty"),
+]
+
 diode_rotate = 90
 diode_x_offset = -2 * 2.54
 diode_y_offset = 2 * 2.54
@@ -88,6 +115,38 @@ diode_label_rotate = 90
 diode_label_x_offset = 0
 diode_label_y_offset = -1.8
 
+# Nets of the switch and diode pads, by pad number. "row" and "column" are
+# the matrix nets of the key (R1, C1, ...) and "diode" joins the switch to its
+# diode. The pcb comes out with these nets on its pads, together with a
+# matching .net file, so it can be routed without going through eeschema.
+switch_pad_nets = {"SW1": "column", "SW2": "diode"}
+diode_pad_nets = {"1": "row", "2": "diode"}
+
+# Matrix
+#   Rows and columns come from where the keys are. A key more than
+#   matrix_row_tolerance (key units) below the first key of a row starts the
+#   next row, columns follow x. With matrix_max_columns set the columns are
+#   squeezed to fit and longer rows continue in an extra row.
+matrix_row_tolerance = 0.5
+matrix_max_columns = None
+
+# Alternative keys
+#   Keys drawn on top of each other (split backspace, stepped caps, ISO
+#   enter, ...) are one matrix position: the first is a normal key, the
+#   others are clones, switch footprints without a diode wired in parallel
+#   with it. Keys are alternatives when more than clone_overlap of the
+#   smaller one is covered by the other, see overlap.py. None gives every key
+#   its own position.
+clone_overlap = 0.5
+
+# Collision check
+#   The pads, holes and courtyards of the placed parts are checked for
+#   overlaps with other parts, see drc.py. Shapes closer than drc_clearance
+#   (mm) count too, None skips the check. The collisions are marked on
+#   drc_marker_layer of the pcb unless it is None.
+drc_clearance = 0.0
+drc_marker_layer = "Eco2.User"
+
 # Schematic
 #   Switches
 sw_spacing = 1000
@@ -97,6 +156,13 @@ sw_y_origin = 100
 led_spacing = 1000
 led_x_origin = 100
 led_y_origin = 6000
+#   Sheets
+#     "flat" puts every key on one sheet, "row" gives every keyboard row a
+#     hierarchical sub-sheet of its own and "block" makes one sub-sheet per
+#     schematic_block_size keys. The sub-sheets are written in parallel and
+#     are much quicker to open in eeschema than one big sheet.
+schematic_sheets = "flat"
+schematic_block_size = 32
 
 
 #
@@ -229,6 +295,30 @@ pcb_header = """(kicad_pcb (version 4) (host pcbnew 4.0.2-stable)
 pcb_footer = """)
 """
 
+# What to do with existing output files, "ask" prompts for each one, "always"
+# replaces them, "keep" leaves them alone and "skip" skips the whole project.
+# "update" keeps the project and schematic but patches the pcb in place: only
+# modules whose placement changed are rewritten, routing is left untouched.
+overwrite_policies = ("ask", "always", "keep", "skip", "update")
+
+# Bump when this script generates different files for the same layout and
+# config so that the output cache (<project>-cache.json) is thrown away
+generator_version = 6
+
+# The config variables that end up in the generated files, a re-run with the
+# same layout and the same values skips generation (see output_cache.py)
+config_names = (
+    "footprint_name", "switch_rotate", "pcb_spacing", "x_origin", "y_origin",
+    "diode_template", "diode_rotate", "diode_x_offset", "diode_y_offset",
+    "diode_label_rotate", "diode_label_x_offset", "diode_label_y_offset",
+    "switch_pad_nets", "diode_pad_nets", "matrix_row_tolerance", "matrix_max_columns", "clone_overlap",
+    "drc_clearance", "drc_marker_layer",
+    "sw_spacing", "sw_x_origin", "sw_y_origin", "led_spacing", "led_x_origin", "led_y_origin",
+    "schematic_sheets", "schematic_block_size",
+    "pcb_header", "pcb_footer", "schem_template_header", "schem_template_footer",
+    "project_template", "component_templates",
+)
+
 #
 # mx                - Standard, includes mounting holes, but no LEDs
 # mx_led            - Standard, includes LEDs and mounting holes
@@ -765,7 +855,7 @@ $EndComp"""
 }
 
 
-def add_to_schematic(schem, x, y, timestamp=None, reference=None):
+def add_to_schematic(schem, x, y, timestamp=None, reference=None, diode=True):
     if reference is None:
         reference = "%d_%d" % (x, y)
     schem.write(component_templates["switch"] % {
@@ -775,7 +865,7 @@ def add_to_schematic(schem, x, y, timestamp=None, reference=None):
         "pkg": 1,
         "ref": unicode(reference),
         "timestamp": time() if timestamp is None else timestamp
-    })
+    } + "\n")
     schem.write(component_templates["led"] % {
         "x": int((x * led_spacing + led_x_origin) / 100) * 100,
         "y": int((y * led_spacing + led_y_origin) / 100) * 100,
@@ -783,7 +873,9 @@ def add_to_schematic(schem, x, y, timestamp=None, reference=None):
         "pkg": 2,
         "ref": unicode(reference),
         "timestamp": time() if timestamp is None else timestamp + 1
-    })
+    } + "\n")
+    if not diode:
+        return
     schem.write(component_templates["diode"] % {
         "x": int((x * sw_spacing + sw_x_origin) / 100) * 100 + 400,
         "y": int((y * sw_spacing + sw_y_origin) / 100) * 100 + 150,
@@ -792,97 +884,356 @@ def add_to_schematic(schem, x, y, timestamp=None, reference=None):
         "pkg": 1,
         "ref": unicode(reference.replace("SW_", "D")),
         "timestamp": time() if timestamp is None else timestamp
-    })
+    } + "\n")
 
 
-def place_text_footprint(pcb_text, x, y, reference=None, i=None, timestamp=None):
+def write_schematic_sheet(file_name, keys, number=1, count=1):
+    """
+    Write one schematic sheet with the parts of keys, a list of
+    (x, y, timestamp, reference, diode). Returns True if the file changed.
+    """
+    buffer = io.BytesIO()
+    sheet = codecs.getwriter("utf-8")(buffer)
+    sheet.write(schematic.sheet_header(schem_template_header, number, count) + "\n")
+    for x, y, timestamp, reference, diode in keys:
+        add_to_schematic(sheet, x, y, timestamp, reference, diode)
+    sheet.write(schem_template_footer + "\n")
+    return output_cache.write_if_changed(file_name, buffer.getvalue())
+
+
+def write_schematic(sch_name, keys, rows, processes=None):
+    """
+    Write the schematic for keys, a list of (x, y, timestamp, reference, diode),
+    split up as set by schematic_sheets. rows is the matrix row of each key.
+
+    For hierarchical schematics sch_name becomes the root sheet and the
+    sub-sheets are written next to it over a process pool. Returns
+    (files, written): every schematic file and those that changed.
+    """
+    if schematic_sheets == "flat":
+        return [sch_name], [sch_name] if write_schematic_sheet(sch_name, keys) else []
+    sheets = schematic.shard(range(len(keys)), rows, schematic_sheets, schematic_block_size)
+    jobs = []
+    for number, (name, members) in enumerate(sheets):
+        sheet_keys = [keys[n] for n in members]
+        # Move the keys up so that every sheet starts at the top
+        top = int(min(key[1] for key in sheet_keys) - y_origin)
+        sheet_keys = [(key[0], key[1] - top) + key[2:] for key in sheet_keys]
+        file_name = schematic.sheet_file_name(sch_name, name)
+        jobs.append((file_name, (file_name, sheet_keys, number + 2, len(sheets) + 1)))
+    results = batch.run(write_schematic_sheet, jobs, processes)
+    for result in results:
+        if not result.ok:
+            raise RuntimeError("Writing {} failed:\n{}".format(result.name, result.error))
+    files = [sch_name] + [result.name for result in results]
+    written = [result.name for result in results if result.result]
+    root = schematic.root_sheet(schem_template_header, schem_template_footer, [
+        (name, os.path.basename(schematic.sheet_file_name(sch_name, name))) for name, _ in sheets])
+    if output_cache.write_if_changed(sch_name, root.encode("utf-8")):
+        written.insert(0, sch_name)
+    return files, written
+
+
+def turned(angle, rotation):
+    """KiCad angle of something at angle on a key that is rotated by rotation."""
+    if not rotation:
+        return angle
+    # keyboard-layout-editor turns clockwise, KiCad counter clockwise
+    angle = (angle - rotation) % 360
+    return int(angle) if angle == int(angle) else angle
+
+
+def place_text_footprint(emitter, switch_pos, diode_pos, rotation=0, reference=None, i=None, timestamp=None,
+                         nets=None):
+    nets = nets or {}
+    x, y = switch_pos
     if reference is None:
-        reference = "SW%d_%d" % (x, y)
-    pcb_text.write(footprints[footprint_name].format(
+        reference = "SW%d_%d" % (x / pcb_spacing, y / pcb_spacing)
+    emitter.add(footprint_name, dict(
         reference=unicode(reference),
-        x_pos=x * pcb_spacing,
-        y_pos=y * pcb_spacing,
-        rotate=switch_rotate,
+        x_pos=x,
+        y_pos=y,
+        rotate=turned(switch_rotate, rotation),
         tstamp=unicode(time() if timestamp is None else timestamp),
-        tedit=unicode(time() if timestamp is None else timestamp)
+        tedit=unicode(time() if timestamp is None else timestamp),
+        **nets
     ))
     if i is not None:
         reference = "D%d" % (i)
     if reference is None:
-        reference = "D%d_%d" % (x, y)
-    pcb_text.write(footprints[diode_template].format(
+        reference = "D%d_%d" % (x / pcb_spacing, y / pcb_spacing)
+    if diode_pos is None:
+        return
+    x, y = diode_pos
+    emitter.add(diode_template, dict(
         reference=unicode(reference),
-        x_pos=x * pcb_spacing + diode_x_offset,
-        y_pos=y * pcb_spacing + diode_y_offset,
-        rotate=diode_rotate,
+        x_pos=x,
+        y_pos=y,
+        rotate=turned(diode_rotate, rotation),
         label_x_pos=diode_label_x_offset,
         label_y_pos=diode_label_y_offset,
-        label_rotate=diode_label_rotate,
+        label_rotate=turned(diode_label_rotate, rotation),
         tstamp=unicode(time() if timestamp is None else timestamp),
-        tedit=unicode(time() if timestamp is None else timestamp)
+        tedit=unicode(time() if timestamp is None else timestamp),
+        **nets
     ))
 
 
-def main():
-    if not os.path.exists(output_directory):
-        os.mkdir(output_directory)
-    if os.path.exists(project_file_name):
-        print "Project exists, destroy it (y/n)?"
-        if raw_input().lower() == "y":
-            with open(project_file_name, mode="w") as project_file:
-                project_file.write(project_template)
+def connect_key(nets, switch_ref, diode_ref, position, timestamp, clone=False, reversed_pins=False):
+    """
+    Add the switch and diode of a key to nets, a netlist.Netlist.
+
+    position is the key's (row, column) in the matrix. A clone only adds its
+    switch, on the nets of the key whose diode is diode_ref, reversed_pins
+    swaps its column and diode pads. Returns the net_<role> values that the
+    netted footprint templates take.
+    """
+    row, column = position
+    names = {
+        "row": "R%d" % (row + 1),
+        "column": "C%d" % (column + 1),
+        "diode": "Net-(%s-Pad2)" % diode_ref,
+    }
+    if reversed_pins:
+        names["column"], names["diode"] = names["diode"], names["column"]
+    parts = [(switch_ref, "MX_LED", footprint_name, switch_pad_nets)]
+    if not clone:
+        parts.append((diode_ref, "D", diode_template, diode_pad_nets))
+    for reference, value, name, pad_nets in parts:
+        footprint = name if ":" in name else netlist.footprint_id(footprints[name])
+        nets.add_component(reference, value, footprint, timestamp)
+        for pad, role in sorted(pad_nets.items()):
+            nets.connect(names[role], reference, pad)
+    return dict(("net_" + role, nets.pcb_net(name)) for role, name in names.items())
+
+
+def load_library_footprints():
+    """Add footprint_name and diode_template to footprints if they come from a library."""
+    missing = [name for name in (footprint_name, diode_template) if name not in footprints]
+    if missing:
+        libraries = footprint_lib.FootprintLibraries(footprint_libraries)
+        for name in missing:
+            footprints[name] = libraries.template(name, locked=name == footprint_name)
+
+
+def key_timestamp(reference):
+    """
+    KiCad timestamp for the parts of a key.
+
+    Derived from the reference rather than the clock, so the same layout
+    always gives the same files. Kept below 2**31 so the LED's timestamp + 1
+    still fits in 32 bits.
+    """
+    return zlib.crc32(reference.encode("utf-8")) & 0x7fffffff
+
+
+def config_digest():
+    """The config variables and footprint templates that the outputs depend on."""
+    values = [(name, globals()[name]) for name in config_names]
+    values.append(("footprints", [footprints[footprint_name], footprints[diode_template]]))
+    return json.dumps(values, sort_keys=True)
+
+
+def should_write(file_name, overwrite, prompt, destroy_by_default=True):
+    """
+    Decide if an existing output file may be replaced.
+
+    overwrite is one of overwrite_policies, "ask" prompts on the console.
+    """
+    if not os.path.exists(file_name) or overwrite == "always":
+        return True
+    if overwrite != "ask":
+        return False
+    print prompt
+    answer = raw_input().lower()
+    if destroy_by_default:
+        return answer != "n"
+    return answer == "y"
+
+
+def main(layout_file=None, project=None, output_dir=None, overwrite="ask"):
+    """
+    Create the project, schematic and pcb for one layout.
+
+    Without arguments the config variables at the top of this file are used.
+    Returns a short description of what was written.
+    """
+    if layout_file is None:
+        layout_file = layout_file_name
+    if project is None and output_dir is None:
+        output_dir = output_directory
+        pro_name, sch_name, pcb_name = project_file_name, schematic_file_name, pcb_file_name
+    else:
+        project = project_name if project is None else project
+        output_dir = os.path.join(os.getcwd(), project) if output_dir is None else output_dir
+        pro_name, sch_name, pcb_name = (
+            os.path.join(output_dir, project + ext) for ext in (".pro", ".sch", ".kicad_pcb"))
+    if overwrite == "skip" and any(os.path.exists(name) for name in (pro_name, sch_name, pcb_name)):
+        return "skipped, project exists"
+    with open(layout_file, mode="rb") as layout_json:
+        layout_data = layout_json.read()
+    layout = json.loads(layout_data.decode("utf-8"))
+    load_library_footprints()
+    net_name = os.path.splitext(pcb_name)[0] + ".net"
+    output_names = (pro_name, sch_name, pcb_name, net_name)
+    cache_name = output_cache.cache_file_name(pcb_name)
+    inputs = output_cache.digest(layout_data, config_digest(), generator_version)
+    if output_cache.is_current(cache_name, inputs, output_names):
+        return "unchanged, nothing written"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    written = []
+    # Only a run that generated every file may record them in the cache,
+    # "update" owns the files it keeps so they count as generated
+    complete = True
+    if should_write(pro_name, overwrite, "Project exists, destroy it (y/n)?", destroy_by_default=False):
+        if output_cache.write_if_changed(pro_name, project_template.encode("utf-8")):
+            written.append(pro_name)
     else:
-        with open(project_file_name, mode="w") as project_file:
-            project_file.write(project_template)
-    sch_name = schematic_file_name
-    if os.path.exists(sch_name):
-        print "Schematic exists, destroy it (y/n)?"
-        if raw_input().lower() == "n":
-            sch_name = os.devnull
-    switch_sch = codecs.open(sch_name, mode="w", encoding='utf-8')
-    pcb_name = pcb_file_name
-    if os.path.exists(pcb_name):
-        print "PCB exists, destroy it (y/n)?"
-        if raw_input().lower() == "n":
-            pcb_name = os.devnull
-    pcb_txt = codecs.open(pcb_name, mode="w", encoding='utf-8')
-    with open(layout_file_name) as layout_file:
-        layout = json.load(layout_file)
-    switch_sch.write(schem_template_header)
-    pcb_txt.write(pcb_header)
-    x, y = x_origin, y_origin
-    i = 1
-    timestamp = int(time())
-    for row in layout:
-        if not isinstance(row, list):
-            continue
-        x = x_origin
-        y_offset = 0.0
-        width = 1.0
-        for col in row:
-            if isinstance(col, dict):
-                y_offset = (float(col.get("h", 1)) - 1) / 2
-                width = float(col.get("w", 1))
-                x += float(col.get("x", 0))
-                y += float(col.get("y", 0))
-            elif isinstance(col, six.string_types):
-                ref = "SW_X%dY%d" % (x, y)
-                if col.split() and col.split()[0].isalnum():
-                    ref = u"SW_" + col.split()[0]
-                ref += "_%d" % i
-                ref = "SW_%d" % i  # just want them numbered by order
-                x_offset = (width - 1.0) / 2
-                place_text_footprint(pcb_txt, x + x_offset, y + y_offset, ref, i, timestamp + i)
-                add_to_schematic(switch_sch, x + x_offset, y + y_offset, timestamp + i, ref)
-                x += width
-                width = 1.0
-                i += 1
-        y += 1
-    switch_sch.write(schem_template_footer)
-    switch_sch.close()
-    pcb_txt.write(pcb_footer)
-    pcb_txt.close()
+        complete = False
+    if not should_write(sch_name, overwrite, "Schematic exists, destroy it (y/n)?"):
+        sch_name = None
+        complete = False
+    update_pcb = overwrite == "update" and os.path.exists(pcb_name)
+    if not update_pcb and not should_write(pcb_name, overwrite, "PCB exists, destroy it (y/n)?"):
+        pcb_name = None
+        complete = False
+    keys = kle.parse(layout)
+    switches = keys.switches()
+    # Schematic positions are in key units, the pcb in mm
+    _, ((sch_xs, sch_ys),) = keys.placements([(0.0, 0.0)], 1.0, (x_origin, y_origin), switches)
+    rotations, ((switch_xs, switch_ys), (diode_xs, diode_ys)) = keys.placements(
+        [(0.0, 0.0), (diode_x_offset, diode_y_offset)], pcb_spacing, (x_origin, y_origin), switches)
+    if clone_overlap is None:
+        parents, reversed_keys = [None] * len(switches), [False] * len(switches)
+    else:
+        parents, reversed_keys = overlap.clones(keys, switches, clone_overlap)
+    # Only the primaries take up matrix positions, clones share theirs
+    primaries = [n for n, parent in enumerate(parents) if parent is None]
+    positions = [None] * len(switches)
+    for n, position in zip(primaries, netlist.matrix(
+            [sch_xs[n] for n in primaries], [sch_ys[n] for n in primaries],
+            matrix_row_tolerance, matrix_max_columns)):
+        positions[n] = position
+    existing_nets = None
+    if update_pcb:
+        # Tracks and zones that the update keeps refer to nets by code
+        with kicad_sexpr.Index.open(pcb_name) as board:
+            existing_nets = board.nets()
+    nets = netlist.Netlist(existing_nets)
+    templates = dict(footprints)
+    templates[footprint_name] = netlist.netted_template(footprints[footprint_name], switch_pad_nets)
+    templates[diode_template] = netlist.netted_template(footprints[diode_template], diode_pad_nets)
+    emitter = PcbEmitter(templates)
+    sch_keys = []
+    # A primary and its clones may overlap, see drc.check
+    groups = {}
+    for n in range(len(switches)):
+        i = n + 1
+        ref = "SW_%d" % i  # just want them numbered by order
+        timestamp = key_timestamp(ref)
+        parent = n if parents[n] is None else parents[n]
+        clone = parent != n
+        key_nets = connect_key(
+            nets, ref, "D%d" % (parent + 1), positions[parent], timestamp, clone, reversed_keys[n])
+        place_text_footprint(
+            emitter, (switch_xs[n], switch_ys[n]), None if clone else (diode_xs[n], diode_ys[n]), rotations[n],
+            ref, i, timestamp, key_nets)
+        sch_keys.append((sch_xs[n], sch_ys[n], timestamp, ref, not clone))
+        groups.setdefault(parent, []).append(ref)
+    collisions = []
+    if drc_clearance is not None:
+        clone_pairs = [(a, b) for refs in groups.values() for k, a in enumerate(refs) for b in refs[k + 1:]]
+        collisions = drc.check(drc.read_modules(text for _, _, text in emitter.modules()), drc_clearance,
+                               clones=clone_pairs)
+    sheet_names = []
+    if sch_name is not None:
+        sheet_names, sheets_written = write_schematic(
+            sch_name, sch_keys, [positions[n if parent is None else parent][0] for n, parent in enumerate(parents)])
+        written.extend(sheets_written)
+    if update_pcb:
+        changed, added, removed = incremental.update_pcb(pcb_name, emitter, nets.pcb_table().encode("utf-8"))
+        marked = drc_marker_layer and drc.write_markers(pcb_name, collisions, drc_marker_layer)
+        if changed or added or removed:
+            written.append("{} ({} modules changed, {} added, {} removed)".format(
+                pcb_name, changed, added, removed))
+        elif marked:
+            written.append(pcb_name)
+    elif pcb_name is not None:
+        header = nets.pcb_header(pcb_header)
+        footer = pcb_footer
+        if drc_marker_layer and collisions:
+            footer = drc.markers(collisions, drc_marker_layer) + "\n" + footer
+        if incremental.write_pcb(pcb_name, header.encode("utf-8"), emitter, footer.encode("utf-8")):
+            written.append(pcb_name)
+    if pcb_name is not None:
+        source = os.path.basename(output_names[1])
+        if output_cache.write_if_changed(net_name, nets.export(source).encode("utf-8")):
+            written.append(net_name)
+    if complete or overwrite == "update":
+        output_cache.record(cache_name, inputs, set(output_names).union(sheet_names))
+    clones = len(switches) - len(primaries)
+    return "{} keys{}, {}wrote {}".format(
+        len(primaries), " and {} clones".format(clones) if clones else "",
+        "{} collisions, ".format(len(collisions)) if collisions else "",
+        ", ".join(os.path.basename(name) for name in written) or "nothing")
+
+
+def find_layouts(patterns):
+    """Expand directories and glob patterns into a list of layout files."""
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.json")
+        for name in sorted(glob.glob(pattern)):
+            if name not in found:
+                found.append(name)
+    return found
+
+
+def batch_main(patterns, output_root=None, overwrite="skip", processes=None):
+    """
+    Generate one project per layout file, spread over a process pool.
+
+    Every project is named after its layout file and created in its own
+    directory below output_root. Returns the number of failed layouts.
+    """
+    if overwrite == "ask":
+        raise ValueError("Batch mode can not prompt, pick another overwrite policy")
+    if output_root is None:
+        output_root = os.getcwd()
+    jobs = []
+    projects = {}
+    for name in find_layouts(patterns):
+        project = os.path.splitext(os.path.basename(name))[0]
+        if project in projects:
+            raise ValueError("{} and {} would both create project {}".format(projects[project], name, project))
+        projects[project] = name
+        jobs.append((name, (name, project, os.path.join(output_root, project), overwrite)))
+    return batch.summary(batch.run(main, jobs, processes))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "layouts", nargs="*",
+        help="layout json files, directories or glob patterns to generate in batch; "
+             "without any the layout_file_name and project_name config is used")
+    parser.add_argument(
+        "-o", "--output",
+        help="directory the project directories are created in (default: current directory)")
+    parser.add_argument(
+        "--overwrite", choices=overwrite_policies,
+        help="what to do with existing output files, default is to ask for a single "
+             "layout and to skip existing projects in batch mode")
+    parser.add_argument(
+        "-j", "--jobs", type=int,
+        help="number of worker processes in batch mode (default: one per cpu)")
+    args = parser.parse_args()
+    if args.layouts:
+        if args.overwrite == "ask":
+            parser.error("--overwrite ask is not available in batch mode")
+        sys.exit(1 if batch_main(args.layouts, args.output, args.overwrite or "skip", args.jobs) else 0)
+    print(main(
+        output_dir=os.path.join(args.output, project_name) if args.output else None,
+        overwrite=args.overwrite or "ask"))
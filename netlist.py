@@ -0,0 +1,198 @@
+"""
+Nets for the keyboard matrix, written straight into the pcb and a .net file.
+
+Without nets a generated board has to go through eeschema (annotate, export
+the netlist) and back into pcbnew before it can be routed. layout.py knows
+the whole matrix already, so it names the nets itself:
+
+    R<n>              row n, joins the diode cathodes of a row
+    C<n>              column n, joins one side of the switches of a column
+    Net-(D<n>-Pad2)   joins switch n to its diode, named like eeschema does
+
+and puts them in the pcb's net table, on the pads of every module and in a
+KiCad netlist (.net) that matches, so the schematic can be re-synced later.
+"""
+
+import re
+import math
+
+from kicad_sexpr import quote
+
+_pad = re.compile(r'\(pad\s+("(?:[^"\\]|\\.)*"|[^\s()]+)\s[^\n]*?\(layers[^()]*\)')
+_module_name = re.compile(r'\(module\s+("(?:[^"\\]|\\.)*"|[^\s()]+)')
+_nets_count = re.compile(r'\(nets \d+\)')
+
+
+def matrix(xs, ys, row_tolerance=0.5, max_columns=None):
+    """
+    (row, column) for every key, both counted from 0, from where the keys
+    are rather than how the layout file happens to list them.
+
+    xs and ys are the key centres in key units. Rows come from a sweep down
+    the sorted ys, a key more than row_tolerance below the first key of the
+    current row starts a new one. Within a row the keys go left to right
+    onto the column nearest their x (one column per key unit of width) while
+    keeping their order, and a row with more keys than max_columns carries on
+    in an extra row. Unused columns are dropped at the end, so moving a key
+    only renumbers the columns of other keys when it empties a column or
+    starts a new one. Sorting dominates, so it is O(n log n).
+    """
+    count = len(xs)
+    if not count:
+        return []
+    if max_columns is not None and max_columns < 1:
+        raise ValueError("max_columns must be at least 1, not {}".format(max_columns))
+    # Columns are counted from x = 0 rather than from the leftmost key, so
+    # moving that key doesn't shift the others. Squeezing the board into
+    # max_columns depends on its whole width anyway.
+    left = 0.0
+    pitch = 1.0
+    if max_columns is not None and max_columns > 1:
+        left = min(xs)
+        pitch = max(pitch, (max(xs) - left) / (max_columns - 1))
+    rows = []
+    row_y = None
+    for key in sorted(range(count), key=lambda key: (ys[key], xs[key])):
+        if row_y is None or ys[key] - row_y > row_tolerance:
+            rows.append([])
+            row_y = ys[key]
+        rows[-1].append(key)
+    positions = [None] * count
+    row_number = 0
+    used = set()
+    for keys in rows:
+        keys.sort(key=lambda key: xs[key])
+        chunk = len(keys) if max_columns is None else max_columns
+        for start in range(0, len(keys), chunk):
+            part = keys[start:start + chunk]
+            columns = [int(math.floor((xs[key] - left) / pitch + 0.5)) for key in part]
+            # Strictly increasing, then pulled back under max_columns
+            for n in range(1, len(columns)):
+                columns[n] = max(columns[n], columns[n - 1] + 1)
+            if max_columns is not None:
+                for n in range(len(columns) - 1, -1, -1):
+                    limit = max_columns - len(columns) + n
+                    columns[n] = min(columns[n], limit if n == len(columns) - 1 else min(limit, columns[n + 1] - 1))
+            for key, column in zip(part, columns):
+                positions[key] = (row_number, column)
+                used.add(column)
+            row_number += 1
+    renumber = dict((column, n) for n, column in enumerate(sorted(used)))
+    return [(row, renumber[column]) for row, column in positions]
+
+
+def netted_template(template, pad_nets):
+    """
+    Add a (net {net_<role>}) to the pads of a footprint template.
+
+    pad_nets maps pad numbers to roles, eg {"SW1": "column", "SW2": "diode"},
+    the net is filled in through the net_<role> field, see Netlist.pcb_net.
+    """
+    def add_net(match):
+        pad = match.group(1).strip('"')
+        if pad not in pad_nets:
+            return match.group(0)
+        return "{} (net {{net_{}}})".format(match.group(0), pad_nets[pad])
+    return _pad.sub(add_net, template)
+
+
+def footprint_id(template):
+    """The footprint name in the (module ...) header of a template."""
+    match = _module_name.search(template)
+    return match.group(1).strip('"') if match else ""
+
+
+class Netlist(object):
+    """
+    Nets and the components connected to them.
+
+    Net 0 is the unconnected net "" like in KiCad, the others are numbered
+    in the order they are first used. existing, {code: name} of a board
+    being updated (see kicad_sexpr.Index.nets), keeps the codes its tracks
+    and zones use: its nets keep their codes, even when nothing connects to
+    them any more, and new ones are numbered after them.
+    """
+
+    def __init__(self, existing=None):
+        self.names = [""]
+        self.codes = {"": 0}
+        self.nodes = {}
+        self.components = []
+        for code, name in sorted((existing or {}).items()):
+            if code and name not in self.codes:
+                # Gaps in the codes are kept as unnamed nets
+                while len(self.names) < code:
+                    self.names.append(None)
+                self.codes[name] = len(self.names)
+                self.names.append(name)
+                self.nodes[name] = []
+
+    def __len__(self):
+        return len(self.codes)
+
+    def net(self, name):
+        """Code of the net called name, added if it is new."""
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+            self.nodes[name] = []
+        return code
+
+    def add_component(self, reference, value, footprint, timestamp):
+        self.components.append((reference, value, footprint, timestamp))
+
+    def connect(self, name, reference, pin):
+        """Connect pin of component reference to net name, returns the pcb net."""
+        self.net(name)
+        self.nodes[name].append((reference, pin))
+        return self.pcb_net(name)
+
+    def pcb_net(self, name):
+        """The net as it goes into a pad, eg '3 C1'."""
+        return "{} {}".format(self.net(name), quote(name))
+
+    def pcb_table(self):
+        """The (net ...) lines of the pcb, indented like the root's children."""
+        return "\n".join(
+            "  (net {} {})".format(code, quote(name)) for code, name in enumerate(self.names) if name is not None)
+
+    def pcb_header(self, header):
+        """
+        header with the net table added before the net classes (or at the
+        end) and the (nets N) count in (general ...) brought up to date.
+        """
+        header = _nets_count.sub("(nets {})".format(len(self)), header, count=1)
+        table = self.pcb_table()
+        position = header.find("\n  (net_class")
+        if position < 0:
+            return header + "\n\n" + table
+        return header[:position] + "\n" + table + "\n" + header[position:]
+
+    def export(self, source=""):
+        """The KiCad netlist (.net) text."""
+        lines = [
+            "(export (version D)",
+            "  (design",
+            "    (source {})".format(quote(source)),
+            '    (tool "layout.py"))',
+            "  (components",
+        ]
+        for reference, value, footprint, timestamp in self.components:
+            lines.append("    (comp (ref {})".format(quote(reference)))
+            lines.append("      (value {})".format(quote(value)))
+            lines.append("      (footprint {})".format(quote(footprint)))
+            lines.append("      (tstamp {:X}))".format(timestamp))
+        lines[-1] += ")"
+        lines.append("  (nets")
+        for code, name in enumerate(self.names):
+            nodes = self.nodes.get(name)
+            # Nets only kept for an updated board's tracks aren't in the schematic
+            if not code or not nodes:
+                continue
+            lines.append("    (net (code {}) (name {})".format(code, quote(name)))
+            for reference, pin in nodes:
+                lines.append("      (node (ref {}) (pin {}))".format(quote(reference), quote(pin)))
+            lines[-1] += ")"
+        lines[-1] += "))"
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,91 @@
+"""
+Content addressed cache for generated files.
+
+Next to the outputs of a run a small json file records a hash of everything
+that went into them (layout, config, generator version) and the sha1 of every
+file written. When the next run has the same inputs and the files are still
+exactly as they were left, nothing needs to be generated or written at all.
+
+Files are only ever replaced when their contents change, so editors and file
+watchers (KiCad reloads a changed board) do not see a change that isn't one.
+"""
+
+import os
+import json
+import hashlib
+
+
+def cache_file_name(output_name):
+    return os.path.splitext(output_name)[0] + "-cache.json"
+
+
+def digest(*parts):
+    """sha1 over parts, each bytes or text."""
+    sha1 = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = u"{}".format(part).encode("utf-8")
+        # Length prefix so ("ab", "c") and ("a", "bc") differ
+        sha1.update(u"{}:".format(len(part)).encode("utf-8"))
+        sha1.update(part)
+    return sha1.hexdigest()
+
+
+def file_digest(file_name):
+    """sha1 of a file, None if it does not exist."""
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, mode="rb") as data_file:
+        return hashlib.sha1(data_file.read()).hexdigest()
+
+
+def is_current(cache_name, inputs, file_names):
+    """
+    True when the outputs recorded for inputs are all still on disk unchanged.
+
+    inputs is the digest() of everything the files are generated from,
+    file_names the outputs that must be among the recorded ones. Recorded
+    files are looked up next to the cache file.
+    """
+    if not os.path.exists(cache_name):
+        return False
+    try:
+        with open(cache_name) as cache_file:
+            cache = json.load(cache_file)
+    except ValueError:
+        return False
+    files = cache.get("files", {})
+    if cache.get("inputs") != inputs or any(os.path.basename(name) not in files for name in file_names):
+        return False
+    directory = os.path.dirname(cache_name)
+    return all(file_digest(os.path.join(directory, name)) == sha1 for name, sha1 in files.items())
+
+
+def record(cache_name, inputs, file_names):
+    """Remember that file_names, as they are on disk now, were generated from inputs."""
+    files = dict((os.path.basename(name), file_digest(name)) for name in file_names)
+    write_if_changed(cache_name, json.dumps(
+        {"inputs": inputs, "files": files}, indent=0, sort_keys=True).encode("utf-8"))
+
+
+def write_if_changed(file_name, data):
+    """
+    Replace file_name with data unless it already holds exactly that.
+
+    The new contents go to a temporary file that is renamed over the old one
+    so a reader never sees half a file. Returns True if the file was written.
+    """
+    if os.path.exists(file_name) and os.path.getsize(file_name) == len(data):
+        with open(file_name, mode="rb") as old_file:
+            if old_file.read() == data:
+                return False
+    temp_name = file_name + ".tmp"
+    with open(temp_name, mode="wb") as new_file:
+        new_file.write(data)
+    if hasattr(os, "replace"):
+        os.replace(temp_name, file_name)
+    else:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        os.rename(temp_name, file_name)
+    return True
@@ -0,0 +1,145 @@
+"""
+Find the keys of a layout that are alternatives for each other.
+
+Layouts for boards that take several key layouts draw the alternatives on
+top of each other: a 2u backspace over two 1u keys, stepped caps lock over
+caps lock, ISO enter over ANSI enter, a row of spacebar sizes. Each of those
+gets a switch footprint, but only one can be fitted, so they have to be one
+key of the matrix, wired in parallel.
+
+Every key is a rectangle in key units (its primary rectangle, turned with
+the key). Two keys are alternatives when their switches are within
+position_tolerance of each other or when the part of the smaller key that
+the other covers is more than threshold. The keys go in file order into a
+uniform grid hash with one key unit cells, so a key is only compared with
+the keys in the cells it touches and a layout is resolved in linear time
+however many alternatives it has.
+
+A key that overlaps nothing before it is a primary, otherwise it becomes a
+clone of the primary it overlaps most, as long as it also overlaps the
+clones that primary already has. That keeps the two 1u keys under a 2u
+backspace apart: the first one is a clone of the backspace, the second
+doesn't overlap the first and stays a key of its own. A clone that is turned
+the other way round (more than 90 degrees) from its primary is reversed, its
+switch pins swap so its pads line up with the primary's nets.
+"""
+
+import math
+from collections import namedtuple
+
+import six
+
+Box = namedtuple("Box", ("x0", "y0", "x1", "y1"))
+
+
+class GridHash(object):
+    """Items with a bounding box, found again through the cells they touch."""
+
+    def __init__(self, cell=1.0):
+        self.cell = cell
+        self.cells = {}
+
+    def _cells(self, box):
+        cell = self.cell
+        for column in six.moves.range(int(math.floor(box.x0 / cell)), int(math.floor(box.x1 / cell)) + 1):
+            for row in six.moves.range(int(math.floor(box.y0 / cell)), int(math.floor(box.y1 / cell)) + 1):
+                yield column, row
+
+    def add(self, item, box):
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, []).append(item)
+
+    def near(self, box):
+        """The items whose cells box touches, each once, in the order they were added."""
+        found = []
+        seen = set()
+        for cell in self._cells(box):
+            for item in self.cells.get(cell, ()):
+                if item not in seen:
+                    seen.add(item)
+                    found.append(item)
+        return found
+
+
+def _corners(table, i):
+    x, y, w, h = table.x[i], table.y[i], table.w[i], table.h[i]
+    corners = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
+    angle = table.r[i]
+    if not angle:
+        return corners
+    cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    rx, ry = table.rx[i], table.ry[i]
+    return [(rx + (px - rx) * cos - (py - ry) * sin, ry + (px - rx) * sin + (py - ry) * cos) for px, py in corners]
+
+
+def _box(points):
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return Box(min(xs), min(ys), max(xs), max(ys))
+
+
+def _intersection(a, b):
+    width = min(a.x1, b.x1) - max(a.x0, b.x0)
+    height = min(a.y1, b.y1) - max(a.y0, b.y0)
+    return width * height if width > 0 and height > 0 else 0.0
+
+
+def covered(table, i, j):
+    """
+    How much of the smaller of keys i and j the other one covers, 0 to 1.
+
+    Keys turned the same way around the same point are compared in their
+    own frame, which is exact, others by their bounding boxes on the board.
+    """
+    if (table.r[i], table.rx[i], table.ry[i]) == (table.r[j], table.rx[j], table.ry[j]):
+        a = Box(table.x[i], table.y[i], table.x[i] + table.w[i], table.y[i] + table.h[i])
+        b = Box(table.x[j], table.y[j], table.x[j] + table.w[j], table.y[j] + table.h[j])
+    else:
+        a, b = _box(_corners(table, i)), _box(_corners(table, j))
+    smaller = min((a.x1 - a.x0) * (a.y1 - a.y0), (b.x1 - b.x0) * (b.y1 - b.y0))
+    return _intersection(a, b) / smaller if smaller > 0 else 0.0
+
+
+def _turned(a, b):
+    difference = (a - b) % 360
+    return 90 < difference < 270
+
+
+def clones(table, keys=None, threshold=0.5, position_tolerance=0.1, cell=1.0):
+    """
+    (parents, reversed) for keys (indices into table, default its switches):
+    parents[n] is the position in keys of the primary that key n is a clone
+    of, or None for a primary, reversed[n] is True for clones turned the
+    other way round.
+    """
+    if keys is None:
+        keys = table.switches()
+    _, ((xs, ys),) = table.placements([(0.0, 0.0)], 1.0, (0.0, 0.0), keys)
+    grid = GridHash(cell)
+    parents = [None] * len(keys)
+    reversed_keys = [False] * len(keys)
+    members = {}
+
+    def alternative(n, m):
+        if math.hypot(xs[n] - xs[m], ys[n] - ys[m]) <= position_tolerance:
+            return 1.0
+        overlap = covered(table, keys[n], keys[m])
+        return overlap if overlap > threshold else 0.0
+
+    for n, key in enumerate(keys):
+        box = _box(_corners(table, key))
+        best = None
+        for m in grid.near(box):
+            overlap = alternative(n, m)
+            if overlap and (best is None or overlap > best[0]) and all(
+                    alternative(n, clone) for clone in members[m]):
+                best = (overlap, m)
+        if best is None:
+            members[n] = []
+            grid.add(n, box)
+            continue
+        parent = best[1]
+        parents[n] = parent
+        reversed_keys[n] = _turned(table.r[key], table.r[keys[parent]])
+        members[parent].append(n)
+    return parents, reversed_keys
@@ -0,0 +1,143 @@
+"""
+Precompiled footprint emitter for the text pcb writer in layout.py.
+
+The footprint templates are several kilobytes each and only a handful of
+fields change per key, so every template is split once into static byte
+chunks and placeholder slots. Rendering a board then only formats the slot
+values; all modules are copied into one pre-sized buffer that is written
+with a single call.
+"""
+
+import hashlib
+from itertools import chain
+from string import Formatter
+
+
+_formatter = Formatter()
+
+# Joins the slot values while formatting, must not appear in any value.
+_SEPARATOR = u"\x1f"
+_SEPARATOR_BYTES = b"\x1f"
+
+# Values that differ between runs without the module changing
+_unstable_fields = ("tstamp", "tedit")
+
+
+def _to_bytes(text, encoding):
+    if isinstance(text, bytes):
+        return text
+    return text.encode(encoding)
+
+
+class CompiledTemplate(object):
+    """
+    A str.format style template split into static chunks and slots.
+
+    chunks always has one more entry than slots; rendering interleaves
+    chunks[0], slot[0], chunks[1], ... chunks[-1]. The slots themselves are
+    formatted in one go through a small format string that only contains
+    the placeholders, so the static text is never parsed again.
+    """
+
+    def __init__(self, template, encoding="utf-8"):
+        self.encoding = encoding
+        self.chunks = []
+        self.slots = []
+        literal = []
+        placeholders = []
+        for text, field_name, format_spec, conversion in _formatter.parse(template):
+            literal.append(text)
+            if field_name is None:
+                continue
+            if not field_name or not field_name.replace("_", "").isalnum():
+                raise ValueError("Unsupported template field {%s}" % field_name)
+            if format_spec and "{" in format_spec:
+                raise ValueError("Nested format specs are not supported: {%s}" % field_name)
+            self.chunks.append(_to_bytes("".join(literal), encoding))
+            self.slots.append((field_name, format_spec or "", conversion))
+            placeholders.append("{%s%s%s}" % (
+                field_name,
+                "!" + conversion if conversion else "",
+                ":" + format_spec if format_spec else ""))
+            literal = []
+        self.chunks.append(_to_bytes("".join(literal), encoding))
+        self._slot_format = _SEPARATOR.join(placeholders)
+        self.digest = hashlib.sha1(b"".join(self.chunks) + _to_bytes(self._slot_format, encoding)).hexdigest()
+
+    def fields(self, values):
+        """Format the slot values, returns one bytes object per slot."""
+        if not self.slots:
+            return []
+        fields = _to_bytes(self._slot_format.format(**values), self.encoding).split(_SEPARATOR_BYTES)
+        if len(fields) != len(self.slots):
+            raise ValueError("Template values may not contain %r" % _SEPARATOR)
+        return fields
+
+    def render(self, **values):
+        """Render a single copy of the template, mostly useful for testing."""
+        out = []
+        self.extend(out, values)
+        return b"".join(out)
+
+    def extend(self, out, values):
+        """Append the rendered template to out as a run of byte chunks."""
+        chunks = self.chunks
+        out.extend(chain.from_iterable(zip(chunks, self.fields(values))))
+        out.append(chunks[-1])
+
+
+class PcbEmitter(object):
+    """
+    Collects modules for a pcb and renders them in one pass.
+
+    templates is a dict of name -> str.format template (eg layout.footprints),
+    each one is compiled the first time it is used. Modules are kept as a run
+    of byte chunks; getvalue sizes the output from the chunk lengths and
+    copies each chunk into place exactly once.
+    """
+
+    def __init__(self, templates, encoding="utf-8"):
+        self.templates = templates
+        self.encoding = encoding
+        self._compiled = {}
+        self._chunks = []
+        self._modules = []
+
+    def compiled(self, name):
+        compiled = self._compiled.get(name)
+        if compiled is None:
+            compiled = CompiledTemplate(self.templates[name], self.encoding)
+            self._compiled[name] = compiled
+        return compiled
+
+    def add(self, name, values):
+        compiled = self.compiled(name)
+        start = len(self._chunks)
+        compiled.extend(self._chunks, values)
+        self._modules.append((compiled, values, start, len(self._chunks)))
+
+    def __len__(self):
+        return len(self._modules)
+
+    def modules(self):
+        """
+        Yield (reference, fingerprint, text) for every module added so far.
+
+        The fingerprint covers the template and every value except the time
+        stamps, so it only changes when the module itself would change.
+        """
+        chunks = self._chunks
+        for compiled, values, start, end in self._modules:
+            fingerprint = hashlib.sha1(_to_bytes(repr((
+                compiled.digest,
+                sorted((k, v) for k, v in values.items() if k not in _unstable_fields))), "utf-8")).hexdigest()
+            yield values.get("reference"), fingerprint, b"".join(chunks[start:end])
+
+    def getvalue(self):
+        # bytes.join measures every chunk, allocates the result once and
+        # then copies, which is the pre-sized buffer without a python loop.
+        return b"".join(self._chunks)
+
+    def write(self, stream):
+        """Write every collected module to a binary stream with one call."""
+        stream.write(self.getvalue())
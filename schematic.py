@@ -0,0 +1,96 @@
+"""
+Hierarchical schematics for layout.py.
+
+A flat schematic with three components per key gets slow to open and
+annotate in eeschema once a board has a few hundred keys. Instead the keys
+can be split into shards, one per keyboard row or per block of N keys, each
+written to its own sub-sheet, with a small root sheet that only holds the
+$Sheet symbols pointing at them. The sub-sheets do not depend on each other
+so they can be written in parallel.
+"""
+
+import re
+import zlib
+
+sheet_modes = ("flat", "row", "block")
+
+_sheet_number = re.compile(r"^Sheet \d+ \d+$", re.MULTILINE)
+
+# Size of the sheet symbols on the root sheet, in mils
+sheet_width = 2000
+sheet_height = 700
+sheet_spacing = 500
+sheets_per_column = 8
+
+
+def shard(keys, rows, mode, block_size=32):
+    """
+    Split keys (indices) into sheets.
+
+    rows holds the matrix row of every key, see netlist.matrix. Returns
+    a list of (name, [key, ...]) in key order, one entry for "flat".
+    """
+    if mode == "flat":
+        return [("", list(keys))]
+    if mode == "row":
+        sheets = []
+        by_row = {}
+        for key in keys:
+            row = rows[key]
+            if row not in by_row:
+                by_row[row] = []
+                sheets.append(("row{}".format(len(sheets) + 1), by_row[row]))
+            by_row[row].append(key)
+        return sheets
+    if mode == "block":
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1, not {}".format(block_size))
+        keys = list(keys)
+        return [("keys{}-{}".format(start + 1, min(start + block_size, len(keys))), keys[start:start + block_size])
+                for start in range(0, len(keys), block_size)]
+    raise ValueError("Unknown sheet mode {}, expected one of {}".format(mode, ", ".join(sheet_modes)))
+
+
+def sheet_file_name(sch_name, name):
+    """File of the sub-sheet called name next to the root sheet sch_name."""
+    base, ext = sch_name.rsplit(".", 1)
+    return "{}-{}.{}".format(base, name, ext)
+
+
+def sheet_header(header, number, count):
+    """header with its "Sheet 1 1" line changed to sheet number of count."""
+    return _sheet_number.sub("Sheet {} {}".format(number, count), header, count=1)
+
+
+def sheet_timestamp(file_name):
+    """Stable timestamp for a sheet symbol, derived from the file it points at."""
+    return zlib.crc32(file_name.encode("utf-8")) & 0xffffffff
+
+
+def sheet_symbol(name, file_name, number):
+    """The $Sheet block for sub-sheet number (0 based) on the root sheet."""
+    column, row = divmod(number, sheets_per_column)
+    x = 1000 + column * (sheet_width + sheet_spacing)
+    y = 1000 + row * (sheet_height + sheet_spacing)
+    return "\n".join((
+        "$Sheet",
+        "S {} {} {} {}".format(x, y, sheet_width, sheet_height),
+        "U {:08X}".format(sheet_timestamp(file_name)),
+        'F0 "{}" 60'.format(name),
+        'F1 "{}" 60'.format(file_name),
+        "$EndSheet",
+    ))
+
+
+def root_sheet(header, footer, sheets):
+    """
+    Text of the root sheet for sheets, a list of (name, file_name).
+
+    file_name should be relative to the root sheet, eeschema looks for the
+    sub-sheets next to it.
+    """
+    lines = [sheet_header(header, 1, len(sheets) + 1)]
+    for number, (name, file_name) in enumerate(sheets):
+        lines.append(sheet_symbol(name, file_name, number))
+    lines.append(footer)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,244 @@
+"""
+Put the switches of every row on 1SS309 style quad diodes.
+
+A package has one common cathode on its row and four anodes, so the
+switches of a row are split into as few packages as possible and every
+switch gets a package and an anode pin. The split and the pins are chosen
+to keep the anode to switch distances short:
+
+  - the switches of a row are ordered along the row (its principal axis, so
+    a row that runs at an angle works too)
+  - a dynamic program over that order finds the split into runs of at most
+    four with the lowest cost, using exactly as many packages as needed
+  - a package goes at the centre of its switches plus offset, the cost of
+    a run is the best matching of its switches to the anode pads, all 24
+    orders are tried
+
+The pad positions come from a diode on the board when there is one.
+
+    python3 diode_pack.py -o smk65_matrix-packed.json --placements diodes.json
+
+prints the new d_ref/d_pin table and the diode positions, and writes them.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import argparse
+from itertools import permutations
+from collections import OrderedDict, namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from kicad_sexpr import Index  # noqa: E402
+
+import matrix_netlist  # noqa: E402
+
+Package = namedtuple("Package", ("row", "x", "y", "pins"))
+
+ANODE_PINS = (1, 3, 4, 5)
+# Anode pads of the SC-74A as placed on smk65 (rotated 180), relative to its centre
+default_pads = {1: (0.95, 1.2), 3: (-0.95, 1.2), 4: (-0.95, -1.2), 5: (0.95, -1.2)}
+# Diodes sit a third of a key below the middle of their switches
+default_offset = (0.0, 6.35)
+
+_at = re.compile(br"\(at\s+(-?[\d.]+)\s+(-?[\d.]+)")
+
+
+def board_positions(file_name, refs):
+    """ref -> (x, y) of the modules in refs on a .kicad_pcb."""
+    positions = {}
+    with open(file_name, mode="rb") as board_file:
+        index = Index(board_file.read())
+    for node in index.nodes(b"module"):
+        ref = node.reference()
+        if ref in refs:
+            match = _at.search(index.data, node.start, node.end)
+            positions[ref] = (float(match.group(1)), float(match.group(2)))
+    missing = sorted(set(refs) - set(positions))
+    if missing:
+        raise ValueError("{} has no {}".format(file_name, ", ".join(missing)))
+    return positions
+
+
+def board_pads(file_name, ref, pins=ANODE_PINS):
+    """
+    Offsets of the pads pins of module ref on a .kicad_pcb from its centre,
+    turned like the module, KeyError if there is no such module.
+    """
+    with open(file_name, mode="rb") as board_file:
+        tree = Index(board_file.read()).module(ref).tree
+    at = next(item for item in tree if isinstance(item, list) and item[0] == "at")
+    angle = math.radians(float(at[3])) if len(at) > 3 else 0.0
+    cos, sin = math.cos(angle), math.sin(angle)
+    pads = {}
+    for item in tree:
+        if isinstance(item, list) and item[0] == "pad" and item[1].isdigit() and int(item[1]) in pins:
+            pad_at = next(child for child in item if isinstance(child, list) and child[0] == "at")
+            x, y = float(pad_at[1]), float(pad_at[2])
+            # KiCad turns counter clockwise with y pointing down
+            pads[int(item[1])] = (round(x * cos + y * sin, 6), round(-x * sin + y * cos, 6))
+    return pads
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def along(points, keys):
+    """keys ordered along their principal axis, left to right for a flat row."""
+    if len(keys) < 2:
+        return list(keys)
+    mx = sum(points[key][0] for key in keys) / len(keys)
+    my = sum(points[key][1] for key in keys) / len(keys)
+    sxx = sum((points[key][0] - mx) ** 2 for key in keys)
+    syy = sum((points[key][1] - my) ** 2 for key in keys)
+    sxy = sum((points[key][0] - mx) * (points[key][1] - my) for key in keys)
+    angle = 0.5 * math.atan2(2 * sxy, sxx - syy)
+    dx, dy = math.cos(angle), math.sin(angle)
+    if dx < 0 or (dx == 0 and dy < 0):
+        dx, dy = -dx, -dy
+    return sorted(keys, key=lambda key: ((points[key][0] - mx) * dx + (points[key][1] - my) * dy, key))
+
+
+def place(points, keys, pads=None, offset=default_offset):
+    """
+    (cost, x, y, [(key, pin), ...]) for a package serving keys: at their
+    centre plus offset, with the pads matched to keys for the shortest total.
+    """
+    pads = default_pads if pads is None else pads
+    x = sum(points[key][0] for key in keys) / len(keys) + offset[0]
+    y = sum(points[key][1] for key in keys) / len(keys) + offset[1]
+    best = None
+    for pins in permutations(sorted(pads), len(keys)):
+        cost = sum(_distance(points[key], (x + pads[pin][0], y + pads[pin][1])) for key, pin in zip(keys, pins))
+        if best is None or cost < best[0] - 1e-9:
+            best = (cost, list(zip(keys, pins)))
+    return best[0], x, y, best[1]
+
+
+def split(points, keys, size=4, pads=None, offset=default_offset):
+    """
+    The cheapest split of keys (already in order) into ceil(n / size) runs of
+    at most size, as [(x, y, [(key, pin), ...]), ...].
+    """
+    count = len(keys)
+    packages = -(-count // size)
+    infinity = float("inf")
+    # best[p][n]: cheapest way to serve the first n keys with p packages
+    best = [[infinity] * (count + 1) for _ in range(packages + 1)]
+    choice = [[None] * (count + 1) for _ in range(packages + 1)]
+    best[0][0] = 0.0
+    placed = {}
+    for used in range(1, packages + 1):
+        for end in range(1, count + 1):
+            for start in range(max(0, end - size), end):
+                if best[used - 1][start] == infinity:
+                    continue
+                if (start, end) not in placed:
+                    placed[start, end] = place(points, keys[start:end], pads, offset)
+                cost = best[used - 1][start] + placed[start, end][0]
+                if cost < best[used][end]:
+                    best[used][end] = cost
+                    choice[used][end] = start
+    runs = []
+    end = count
+    for used in range(packages, 0, -1):
+        start = choice[used][end]
+        runs.append(placed[start, end][1:])
+        end = start
+    return list(reversed(runs))
+
+
+def pack(points, rows, size=4, pads=None, offset=default_offset):
+    """
+    Packages for keys with positions points and matrix rows rows, ordered by
+    row and then along the row.
+    """
+    by_row = OrderedDict()
+    for key in sorted(range(len(points)), key=lambda key: rows[key]):
+        by_row.setdefault(rows[key], []).append(key)
+    packages = []
+    for row, keys in by_row.items():
+        for x, y, pins in split(points, along(points, keys), size, pads, offset):
+            packages.append(Package(row, x, y, pins))
+    return packages
+
+
+def anode_length(points, packages, pads=None):
+    pads = default_pads if pads is None else pads
+    return sum(_distance(points[key], (package.x + pads[pin][0], package.y + pads[pin][1]))
+               for package in packages for key, pin in package.pins)
+
+
+def apply(matrix, refs, packages):
+    """A copy of matrix with the switches in refs (indexed by key) on packages, D1, D2, ..."""
+    switches = OrderedDict((ref, dict(switch)) for ref, switch in matrix.switches.items())
+    diodes = OrderedDict()
+    for package in packages:
+        d_ref = "D{}".format(len(diodes) + 1)
+        diodes[d_ref] = package.row
+        for key, pin in package.pins:
+            switches[refs[key]].update(d_ref=d_ref, d_pin=pin)
+    return matrix._replace(switches=switches, diodes=diodes)
+
+
+def matrix_packages(matrix, refs, positions):
+    """The packages the matrix has now, at the diode positions, for comparison."""
+    by_diode = OrderedDict()
+    for key, ref in enumerate(refs):
+        by_diode.setdefault(matrix.switches[ref]["d_ref"], []).append((key, matrix.switches[ref]["d_pin"]))
+    return [Package(matrix.diodes[d_ref], positions[d_ref][0], positions[d_ref][1], pins)
+            for d_ref, pins in by_diode.items() if d_ref in positions]
+
+
+def main(matrix_name, board_name, output_name=None, placements_name=None, offset=default_offset):
+    matrix = matrix_netlist.load_matrix(matrix_name)
+    refs = [ref for ref, switch in matrix.switches.items() if not switch["clone"]]
+    positions = board_positions(board_name, refs)
+    try:
+        diode_positions = board_positions(board_name, list(matrix.diodes))
+        pads = board_pads(board_name, next(iter(matrix.diodes)))
+    except (ValueError, KeyError, StopIteration):
+        diode_positions, pads = {}, {}
+    if len(pads) != len(ANODE_PINS):
+        pads = default_pads
+    points = [positions[ref] for ref in refs]
+    packages = pack(points, [matrix.switches[ref]["row"] for ref in refs], len(ANODE_PINS), pads, offset)
+    if diode_positions:
+        now = matrix_packages(matrix, refs, dict(positions, **diode_positions))
+        print("Now {} packages, {:.0f}mm from anodes to switches".format(len(now), anode_length(points, now, pads)))
+    print("Packed {} packages, {:.0f}mm from anodes to switches".format(
+        len(packages), anode_length(points, packages, pads)))
+    packed = apply(matrix, refs, packages)
+    placements = OrderedDict()
+    for d_ref, package in zip(packed.diodes, packages):
+        placements[d_ref] = [round(package.x, 4), round(package.y, 4)]
+        print("  {:<4} R{} at ({:8.3f}, {:8.3f}): {}".format(d_ref, package.row, package.x, package.y, ", ".join(
+            "{} pin {}".format(refs[key], pin) for key, pin in package.pins)))
+    if output_name:
+        matrix_netlist.save_matrix(output_name, packed)
+    if placements_name:
+        with open(placements_name, mode="w") as placements_file:
+            json.dump(placements, placements_file, indent=2)
+            placements_file.write("\n")
+    return packed, placements
+
+
+if __name__ == "__main__":
+    directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matrix", default=os.path.join(directory, "smk65_matrix.json"),
+                        help="matrix definition (default: smk65_matrix.json)")
+    parser.add_argument("--board", default=os.path.join(directory, "smk65.kicad_pcb"),
+                        help="board to take the switch positions from (default: smk65.kicad_pcb)")
+    parser.add_argument("-o", "--output", help="write the matrix with the new diodes here")
+    parser.add_argument("--placements", help="write the diode positions here, as json")
+    parser.add_argument("--offset", type=float, nargs=2, default=default_offset, metavar=("DX", "DY"),
+                        help="diode position relative to the middle of its switches, mm (default: 0 6.35)")
+    args = parser.parse_args()
+    try:
+        main(args.matrix, args.board, args.output, args.placements, tuple(args.offset))
+    except ValueError as error:
+        parser.error(str(error))
@@ -0,0 +1,265 @@
+"""
+Switch matrix validation for smk65.py.
+
+The connectivity is indexed once (net -> kind and pins, pin -> nets, diode
+-> cathode rows) and every switch, clone and LED is then checked in a single
+pass, so the cost grows linearly with the number of parts. Problems are
+returned as Findings rather than printed.
+
+Nets are recognised by name, like set_name_names() in smk65.py: R<n> is a
+row, C<n> a column and Matrix-... joins a switch to a diode anode.
+
+Run it directly to time a synthetic matrix:
+
+    python3 matrix_check.py 2000
+"""
+
+import re
+import sys
+from collections import defaultdict, namedtuple
+from timeit import default_timer
+
+ERROR = "error"
+WARNING = "warning"
+
+Finding = namedtuple("Finding", ("level", "ref", "message"))
+
+SWITCH_PINS = ("SW1", "SW2")
+LED_PINS = ("K", "A")
+# The 1SS309 has its common cathode on pin 2, named K
+CATHODE_PINS = ("2", "K")
+
+_kinds = (
+    ("row", re.compile(r"^R(\d+)$")),
+    ("column", re.compile(r"^C(\d+)$")),
+    ("diode", re.compile(r"^Matrix-")),
+)
+
+
+def net_kind(name):
+    """("row", 3) for R3, ("column", 1) for C1, ("diode", None) or (None, None)."""
+    for kind, pattern in _kinds:
+        match = pattern.match(name)
+        if match:
+            return kind, int(match.group(1)) if match.groups() else None
+    return None, None
+
+
+class MatrixIndex(object):
+    """
+    Hash indexes over the connections of a board.
+
+    connections is an iterable of (ref, pin, net) with pin the pin number
+    (or name) and net the net name.
+    """
+
+    def __init__(self, connections, diode_prefix="D"):
+        self.pin_nets = defaultdict(list)
+        self.net_pins = defaultdict(list)
+        for ref, pin, net in connections:
+            ref, pin = str(ref), str(pin)
+            if net not in self.pin_nets[ref, pin]:
+                self.pin_nets[ref, pin].append(net)
+                self.net_pins[net].append((ref, pin))
+        self.kinds = dict((net, net_kind(net)) for net in self.net_pins)
+        # The diodes on every net and the rows on the cathodes of every diode
+        self.net_diodes = defaultdict(set)
+        self.cathode_rows = defaultdict(set)
+        for (ref, pin), nets in self.pin_nets.items():
+            if not ref.startswith(diode_prefix):
+                continue
+            for net in nets:
+                self.net_diodes[net].add(ref)
+                if pin in CATHODE_PINS:
+                    self.cathode_rows[ref].add(net)
+
+    def nets(self, ref, pin, kind=None):
+        nets = self.pin_nets.get((ref, pin), [])
+        if kind is None:
+            return nets
+        return [net for net in nets if self.kinds[net][0] == kind]
+
+
+def _diode_row(index, ref, net, findings, diode_rows):
+    """
+    The row a diode net leads to, None (and a finding) if there isn't exactly
+    one. diode_rows remembers the diodes already checked so that a diode with
+    four switches is only reported once.
+    """
+    diodes = index.net_diodes.get(net, ())
+    if len(diodes) != 1:
+        findings.append(Finding(ERROR, ref, "{} is connected to {} diodes{}".format(
+            net, len(diodes), ": " + ", ".join(sorted(diodes)) if diodes else "")))
+        return None
+    diode = next(iter(diodes))
+    if diode not in diode_rows:
+        diode_rows[diode] = _cathode_row(index, diode, findings)
+    return diode_rows[diode]
+
+
+def _cathode_row(index, diode, findings):
+    rows = index.cathode_rows.get(diode, set())
+    if not rows:
+        findings.append(Finding(ERROR, diode, "Diode cathode is not connected to a row"))
+        return None
+    if len(rows) > 1:
+        findings.append(Finding(ERROR, diode, "Diode cathode is connected to more than one net: {}".format(
+            ", ".join(sorted(rows)))))
+        return None
+    row = next(iter(rows))
+    if index.kinds[row][0] != "row":
+        findings.append(Finding(ERROR, diode, "Diode cathode is on {}, not a row".format(row)))
+        return None
+    return row
+
+
+def _check_switch(index, ref, switch, groups, findings, diode_rows):
+    """Check the matrix pins of one switch, returns True if it passed."""
+    valid = True
+    for pin in SWITCH_PINS:
+        columns = index.nets(ref, pin, "column")
+        diode_nets = index.nets(ref, pin, "diode")
+        row = None
+        if len(columns) > 1:
+            findings.append(Finding(ERROR, ref, "{} is connected to columns {}".format(pin, ", ".join(columns))))
+        elif columns and index.kinds[columns[0]][1] != switch["col"]:
+            findings.append(Finding(ERROR, ref, "Expected C{}, found {}".format(switch["col"], columns[0])))
+            valid = False
+        if len(diode_nets) > 1:
+            findings.append(Finding(ERROR, ref, "{} is connected to diode nets {}".format(
+                pin, ", ".join(diode_nets))))
+        elif diode_nets:
+            net = diode_nets[0]
+            switches = set(other for other, _ in index.net_pins[net] if other in groups)
+            if len(set(groups[other] for other in switches)) > 1:
+                findings.append(Finding(WARNING, ref, "Multiple switches connected to {}: {}".format(
+                    net, ", ".join(sorted(switches)))))
+            row = _diode_row(index, ref, net, findings, diode_rows)
+            if row is not None and index.kinds[row][1] != switch["row"]:
+                findings.append(Finding(ERROR, ref, "Expected R{}, found {}".format(switch["row"], row)))
+                valid = False
+        # A pin goes to a column or, through its diode, to a row but not both
+        if bool(columns) == bool(diode_nets):
+            valid = False
+    return valid
+
+
+def _check_led(index, ref, findings):
+    nets = {}
+    for pin, name in zip(LED_PINS, ("cathode", "anode")):
+        pin_nets = index.nets(ref, pin)
+        if not pin_nets:
+            findings.append(Finding(WARNING, ref, "LED {} is not connected".format(name)))
+            return
+        if len(pin_nets) > 1:
+            findings.append(Finding(WARNING, ref, "LED {} is connected to more than one net".format(name)))
+        nets[pin] = set(pin_nets)
+    shorted = nets["K"] & nets["A"]
+    if shorted:
+        findings.append(Finding(ERROR, ref, "LED anode and cathode are both on {}".format(
+            ", ".join(sorted(shorted)))))
+
+
+def validate(switches, connections, check_leds=True):
+    """
+    Check the switch matrix, returns a list of Findings.
+
+    switches maps every switch reference to a dict with its "row" and "col"
+    and, for clones, the "clone" it doubles (whose row and column it gets).
+    """
+    index = MatrixIndex(connections)
+    findings = []
+    # Clones of a key and the key itself form one group
+    groups = {}
+    for ref, switch in switches.items():
+        groups[ref] = switch.get("clone") or ref
+    positions = defaultdict(list)
+    diode_rows = {}
+    for ref in sorted(switches, key=_natural_key):
+        switch = dict(switches[ref])
+        parent = switch.get("clone")
+        if parent:
+            if parent not in switches:
+                findings.append(Finding(ERROR, ref, "Clone of unknown switch {}".format(parent)))
+                continue
+            switch["row"], switch["col"] = switches[parent]["row"], switches[parent]["col"]
+        if not _check_switch(index, ref, switch, groups, findings, diode_rows):
+            findings.append(Finding(ERROR, ref, "Did not pass validation"))
+        if not parent:
+            positions[switch["col"], switch["row"]].append(ref)
+        if check_leds:
+            _check_led(index, ref, findings)
+    for (col, row), refs in sorted(positions.items()):
+        if len(refs) > 1:
+            findings.append(Finding(WARNING, refs[0], "Multiple switches on C{} R{}: {}".format(
+                col, row, ", ".join(refs))))
+    return findings
+
+
+def _natural_key(ref):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", ref)]
+
+
+def skidl_connections(parts):
+    """(ref, pin, net) for every pin of the skidl parts in parts, keyed like smk65.parts."""
+    for ref, part in parts.items():
+        for pin in part.pins:
+            for net in pin.nets:
+                yield ref, pin.num, net.name
+
+
+def skidl_switches(parts, prefix="S"):
+    """The switch definitions of smk65.parts in the form validate() takes."""
+    switches = {}
+    for ref, part in parts.items():
+        if ref.startswith(prefix) and (hasattr(part, "row") or hasattr(part, "clone")):
+            switches[ref] = {
+                "row": getattr(part, "row", None),
+                "col": getattr(part, "col", None),
+                "clone": getattr(part, "clone", None),
+            }
+    return switches
+
+
+def synthetic_matrix(count, columns=16):
+    """
+    A matrix of count switches wired like smk65 (quad diodes, one per four
+    switches of a row), every tenth key with a clone. Returns (switches,
+    connections).
+    """
+    switches = {}
+    connections = []
+    diode = 0
+    for n in range(count):
+        row, col = n // columns + 1, n % columns + 1
+        if (col - 1) % 4 == 0:
+            diode += 1
+            connections.append(("D{}".format(diode), "2", "R{}".format(row)))
+        ref = "S{}".format(n + 1)
+        d_ref, d_pin = "D{}".format(diode), (1, 3, 4, 5)[(col - 1) % 4]
+        refs = [ref]
+        switches[ref] = {"row": row, "col": col}
+        if n % 10 == 0:
+            clone = "S{}".format(count + n + 1)
+            switches[clone] = {"row": None, "col": None, "clone": ref}
+            refs.append(clone)
+        for switch_ref in refs:
+            net = "Matrix-{}-{}-{}".format(switch_ref, d_ref, d_pin)
+            connections.append((switch_ref, "SW1", "C{}".format(col)))
+            connections.append((switch_ref, "SW2", net))
+            connections.append((d_ref, str(d_pin), net))
+            connections.append((switch_ref, "K", "LED-K{}".format(row)))
+            connections.append((switch_ref, "A", "LED-A{}".format(col)))
+    return switches, connections
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    switches, connections = synthetic_matrix(count)
+    start = default_timer()
+    findings = validate(switches, connections)
+    elapsed = default_timer() - start
+    for finding in findings[:10]:
+        print(finding)
+    print("{} switches, {} connections, {} findings in {:.3f}s".format(
+        len(switches), len(connections), len(findings), elapsed))
@@ -0,0 +1,202 @@
+"""
+The smk65 switch matrix as data, and a netlist writer for it.
+
+The switches, clones, quad diode pins and the matrix to MCU pin map live in
+smk65_matrix.json:
+
+    "switch_columns": ["ref", "d_ref", "d_pin", "row", "col", "clone", "reversed"],
+    "switches": [
+        ["S1", "D1", 5, 1, 1, null, false],
+        ["S115", null, null, null, null, "S15", false],
+        ...
+
+A clone is a second footprint for the same key (eg a 2u key that can also
+take two 1u switches), it shares the column and diode of the switch it
+clones. reversed swaps SW1 and SW2.
+
+The matrix is wired here directly instead of through skidl, only the
+controller is still built with skidl and its netlist is merged with the
+matrix one by net name.
+"""
+
+import os
+import sys
+import json
+import zlib
+from collections import OrderedDict, namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from kicad_sexpr import parse, quote  # noqa: E402
+
+Matrix = namedtuple("Matrix", ("switches", "diodes", "matrix_to_mcu", "parts"))
+
+# The 1SS309 has one common cathode, pin 2
+CATHODE_PIN = "2"
+
+default_parts = {
+    "switch": {"value": "MX_LED", "footprint": "Keyboard:MXALPS"},
+    "diode": {"value": "1SS309", "footprint": "Keyboard:SC-74A"},
+}
+
+
+def load_matrix(file_name):
+    """Read a matrix definition, raises ValueError if it doesn't add up."""
+    with open(file_name) as matrix_file:
+        data = json.load(matrix_file, object_pairs_hook=OrderedDict)
+    columns = data["switch_columns"]
+    switches = OrderedDict()
+    for values in data["switches"]:
+        switch = dict(zip(columns, values))
+        ref = switch.pop("ref")
+        if ref in switches:
+            raise ValueError("Switch {} is defined twice".format(ref))
+        switch.setdefault("clone", None)
+        switch["reversed"] = bool(switch.get("reversed"))
+        switches[ref] = switch
+    diodes = data["diodes"]
+    for ref, switch in switches.items():
+        if switch["clone"]:
+            if switch["clone"] not in switches or switches[switch["clone"]]["clone"]:
+                raise ValueError("{} clones {} which is not a switch".format(ref, switch["clone"]))
+            continue
+        missing = [name for name in ("d_ref", "d_pin", "row", "col") if switch.get(name) is None]
+        if missing:
+            raise ValueError("{} has no {}".format(ref, ", ".join(missing)))
+        if switch["d_ref"] not in diodes:
+            raise ValueError("{} uses unknown diode {}".format(ref, switch["d_ref"]))
+    parts = dict(default_parts)
+    parts.update(data.get("parts", {}))
+    return Matrix(switches, diodes, data.get("matrix_to_mcu", {}), parts)
+
+
+def save_matrix(file_name, matrix):
+    """Write a matrix definition in the layout of smk65_matrix.json, one switch per line."""
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False)
+
+    def block(name, items, last=False):
+        lines = ['  {}: {{'.format(dumps(name))]
+        lines.extend("    {}: {}{}".format(dumps(key), value, "," if n < len(items) - 1 else "")
+                     for n, (key, value) in enumerate(items))
+        lines.append("  }" + ("" if last else ","))
+        return lines
+
+    columns = ["ref", "d_ref", "d_pin", "row", "col", "clone", "reversed"]
+    lines = ["{"]
+    lines.extend(block("parts", [(name, dumps(part)) for name, part in matrix.parts.items()]))
+    lines.extend(block("matrix_to_mcu", [(net, dumps(pin)) for net, pin in matrix.matrix_to_mcu.items()]))
+    lines.extend(block("diodes", [(ref, dumps(row)) for ref, row in matrix.diodes.items()]))
+    lines.append('  "switch_columns": {},'.format(dumps(columns)))
+    lines.append('  "switches": [')
+    for n, (ref, switch) in enumerate(matrix.switches.items()):
+        values = [ref] + [switch.get(column) for column in columns[1:]]
+        lines.append("    {}{}".format(dumps(values), "," if n < len(matrix.switches) - 1 else ""))
+    lines.append("  ]")
+    lines.append("}")
+    with open(file_name, mode="w") as matrix_file:
+        matrix_file.write("\n".join(lines) + "\n")
+
+
+def matrix_nets(matrix):
+    """
+    net name -> [(ref, pin), ...] for the whole matrix.
+
+    Diode cathodes go to their row R<n>, one switch pin to its column C<n>
+    and the other to a diode anode through Matrix-<switch>-<diode>-<pin>.
+    Clones join the nets of the switch they clone, their LEDs are wired in
+    parallel with it on LED_K-<switch> and LED_A-<switch>.
+    """
+    nets = OrderedDict()
+
+    def add(name, ref, pin):
+        nets.setdefault(name, []).append((ref, str(pin)))
+
+    for ref, row in matrix.diodes.items():
+        add("R{}".format(row), ref, CATHODE_PIN)
+    anode_nets = {}
+    # Parents before clones, otherwise in file order
+    for ref, switch in sorted(matrix.switches.items(), key=lambda item: bool(item[1]["clone"])):
+        parent_ref = switch["clone"] or ref
+        parent = matrix.switches[parent_ref]
+        pins = ("SW2", "SW1") if switch["reversed"] else ("SW1", "SW2")
+        add("C{}".format(parent["col"]), ref, pins[0])
+        anode = (parent["d_ref"], str(parent["d_pin"]))
+        if anode not in anode_nets:
+            anode_nets[anode] = "Matrix-{}-{}-{}".format(ref, *anode)
+            add(anode_nets[anode], *anode)
+        add(anode_nets[anode], ref, pins[1])
+        if switch["clone"]:
+            for pin in ("K", "A"):
+                name = "LED_{}-{}".format(pin, parent_ref)
+                if name not in nets:
+                    add(name, parent_ref, pin)
+                add(name, ref, pin)
+    return nets
+
+
+def connections(matrix):
+    """(ref, pin, net) for every matrix pin, what matrix_check.validate() takes."""
+    for name, nodes in matrix_nets(matrix).items():
+        for ref, pin in nodes:
+            yield ref, pin, name
+
+
+def _format(node, indent=0):
+    """An s-expression from parse() as text, one line per node with children."""
+    if not isinstance(node, list):
+        return quote(node)
+    atoms = [item for item in node if not isinstance(item, list)]
+    children = [item for item in node if isinstance(item, list)]
+    head = "(" + " ".join(quote(atom) for atom in atoms)
+    if not children:
+        return head + ")"
+    if all(not any(isinstance(item, list) for item in child) for child in children) and len(children) <= 3:
+        return head + " " + " ".join(_format(child) for child in children) + ")"
+    pad = "\n" + "  " * (indent + 1)
+    return head + "".join(pad + _format(child, indent + 1) for child in children) + ")"
+
+
+def _component(reference, value, footprint):
+    timestamp = zlib.crc32(reference.encode("utf-8")) & 0xffffffff
+    return ["comp", ["ref", reference], ["value", value], ["footprint", footprint],
+            ["tstamp", "{:08X}".format(timestamp)]]
+
+
+def netlist(matrix, controller=None):
+    """
+    KiCad netlist text for the matrix, merged with controller, the text of
+    the netlist skidl made for the rest of the board. Nets with the same name
+    (rows and columns that go to the MCU) are joined and all nets numbered
+    again. Raises ValueError if a controller part has the reference of a
+    matrix switch or diode.
+    """
+    tree = parse(controller.encode("utf-8") if not isinstance(controller, bytes) else controller) \
+        if controller else ["export", ["version", "D"]]
+    sections = OrderedDict((child[0], child) for child in tree[1:] if isinstance(child, list))
+    components = sections.setdefault("components", ["components"])
+    taken = set(item[1] for component in components[1:] for item in component[1:]
+                if isinstance(item, list) and item[0] == "ref")
+    clashes = [ref for ref in list(matrix.switches) + list(matrix.diodes) if ref in taken]
+    if clashes:
+        raise ValueError("The controller netlist already has {}".format(", ".join(clashes)))
+    for ref, switch in matrix.switches.items():
+        components.append(_component(ref, matrix.parts["switch"]["value"], matrix.parts["switch"]["footprint"]))
+    for ref in matrix.diodes:
+        components.append(_component(ref, matrix.parts["diode"]["value"], matrix.parts["diode"]["footprint"]))
+
+    nets = OrderedDict()
+    for net in sections.get("nets", ["nets"])[1:]:
+        name = next(item[1] for item in net[1:] if isinstance(item, list) and item[0] == "name")
+        nets[name] = [item for item in net[1:] if isinstance(item, list) and item[0] == "node"]
+    for name, nodes in matrix_nets(matrix).items():
+        nets.setdefault(name, []).extend(["node", ["ref", ref], ["pin", pin]] for ref, pin in nodes)
+    sections["nets"] = ["nets"] + [
+        ["net", ["code", str(code)], ["name", name]] + nodes
+        for code, (name, nodes) in enumerate(nets.items(), 1)]
+    version = sections.pop("version", ["version", "D"])
+    return _format([tree[0], version] + list(sections.values())) + "\n"
+
+
+def write_netlist(file_name, matrix, controller=None):
+    with open(file_name, mode="w") as net_file:
+        net_file.write(netlist(matrix, controller))
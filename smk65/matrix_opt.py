@@ -0,0 +1,272 @@
+"""
+Search for a switch matrix that needs fewer MCU pins and less trace.
+
+A matrix of rows x columns serves rows * columns keys on rows + columns pins,
+a duplex ("Japanese") matrix puts two keys with opposite diodes on every
+crossing and serves twice as many. Every shape within slack pins of the
+fewest possible is tried, as is, and transposed so the rows run across the
+board instead of along it.
+
+For every shape a simulated annealing run moves keys between the crossings
+to shorten the nets, the length of a net is estimated as the half perimeter
+of the box around its keys. The runs (shapes times seeds) are spread over a
+process pool, the result with the fewest pins and then the shortest nets
+wins. Key positions are taken from the board:
+
+    python3 matrix_opt.py --board smk65.kicad_pcb -o smk65_matrix-new.json
+
+writes a copy of smk65_matrix.json with the new rows and columns, a new
+matrix_to_mcu on the same MCU pins and the switches of every row put on
+quad diodes by diode_pack.py.
+"""
+
+import os
+import sys
+import math
+import random
+import argparse
+from collections import OrderedDict, namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import batch  # noqa: E402
+
+import diode_pack  # noqa: E402
+import matrix_netlist  # noqa: E402
+from diode_pack import board_positions  # noqa: E402
+
+Shape = namedtuple("Shape", ("rows", "columns", "duplex", "transposed"))
+Result = namedtuple("Result", ("shape", "seed", "pins", "length", "slots"))
+
+
+def shapes(count, slack=0, duplex=False):
+    """
+    The shapes for count keys with at most slack pins more than the fewest,
+    for plain and, with duplex, for duplex matrices.
+    """
+    found = []
+    for per_crossing in ((1, 2) if duplex else (1,)):
+        pins = {}
+        for rows in range(1, count + 1):
+            pins[Shape(rows, -(-count // (rows * per_crossing)), per_crossing == 2, False)] = None
+        pins = dict((shape, shape.rows + shape.columns) for shape in pins)
+        fewest = min(pins.values())
+        found.extend(shape._replace(transposed=transposed) for shape, total in pins.items()
+                     if total <= fewest + slack for transposed in (False, True))
+    return sorted(found, key=lambda shape: (shape.rows + shape.columns, shape))
+
+
+def _hpwl(points, members):
+    if not members:
+        return 0.0
+    xs = [points[key][0] for key in members]
+    ys = [points[key][1] for key in members]
+    return max(xs) - min(xs) + max(ys) - min(ys)
+
+
+def net_length(points, slots):
+    """Half perimeter estimate of all row and column nets, slots holds (row, column, side) per key."""
+    rows, columns = {}, {}
+    for key, (row, column, _) in enumerate(slots):
+        rows.setdefault(row, []).append(key)
+        columns.setdefault(column, []).append(key)
+    return sum(_hpwl(points, members) for members in list(rows.values()) + list(columns.values()))
+
+
+def pin_count(slots):
+    return len(set(slot[0] for slot in slots)) + len(set(slot[1] for slot in slots))
+
+
+def initial_slots(points, shape):
+    """Bands along y (along x when transposed) for the rows, then left to right."""
+    primary, secondary = (0, 1) if shape.transposed else (1, 0)
+    sides = 2 if shape.duplex else 1
+    order = sorted(range(len(points)), key=lambda key: (points[key][primary], points[key][secondary]))
+    band_size = -(-len(points) // shape.rows)
+    slots = [None] * len(points)
+    for row in range(shape.rows):
+        band = sorted(order[row * band_size:(row + 1) * band_size], key=lambda key: points[key][secondary])
+        for n, key in enumerate(band):
+            slot = n * shape.columns * sides // len(band)
+            slots[key] = (row, slot // sides, slot % sides)
+    return slots
+
+
+def anneal(points, shape, seed=0, iterations=10000):
+    """Simulated annealing from initial_slots(), returns a Result."""
+    rng = random.Random(seed)
+    sides = 2 if shape.duplex else 1
+    slots = initial_slots(points, shape)
+    occupant = dict((slot, key) for key, slot in enumerate(slots))
+    members = {"row": [set() for _ in range(shape.rows)], "column": [set() for _ in range(shape.columns)]}
+    for key, (row, column, _) in enumerate(slots):
+        members["row"][row].add(key)
+        members["column"][column].add(key)
+    costs = {"row": [_hpwl(points, keys) for keys in members["row"]],
+             "column": [_hpwl(points, keys) for keys in members["column"]]}
+    length = sum(costs["row"]) + sum(costs["column"])
+
+    def move(key, slot):
+        old = slots[key]
+        members["row"][old[0]].discard(key)
+        members["column"][old[1]].discard(key)
+        members["row"][slot[0]].add(key)
+        members["column"][slot[1]].add(key)
+        slots[key] = slot
+
+    def swap(key, slot):
+        """Move key to slot and whatever is there to where key was, returns the change in length."""
+        old = slots[key]
+        other = occupant.get(slot)
+        nets = set([("row", old[0]), ("row", slot[0]), ("column", old[1]), ("column", slot[1])])
+        before = sum(costs[kind][n] for kind, n in nets)
+        move(key, slot)
+        occupant[slot] = key
+        if other is None:
+            del occupant[old]
+        else:
+            move(other, old)
+            occupant[old] = other
+        after = 0.0
+        for kind, n in nets:
+            costs[kind][n] = _hpwl(points, members[kind][n])
+            after += costs[kind][n]
+        return after - before
+
+    def random_slot():
+        return (rng.randrange(shape.rows), rng.randrange(shape.columns), rng.randrange(sides))
+
+    # Start hot enough to take an average uphill move half of the time
+    deltas = []
+    for _ in range(min(200, iterations)):
+        key = rng.randrange(len(points))
+        old, delta = slots[key], swap(key, random_slot())
+        deltas.append(abs(delta))
+        swap(key, old)
+    start = max(sum(deltas) / len(deltas), 1e-9) / math.log(2) if deltas else 1.0
+    cooling = (1e-3) ** (1.0 / max(iterations, 1))
+    temperature = start
+    best_length, best_slots = length, list(slots)
+    for _ in range(iterations):
+        key = rng.randrange(len(points))
+        slot = random_slot()
+        if slot == slots[key]:
+            continue
+        old = slots[key]
+        delta = swap(key, slot)
+        if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+            length += delta
+            if length < best_length - 1e-9:
+                best_length, best_slots = length, list(slots)
+        else:
+            swap(key, old)
+        temperature *= cooling
+    return Result(shape, seed, pin_count(best_slots), net_length(points, best_slots), best_slots)
+
+
+def optimize(points, slack=0, duplex=False, seeds=2, iterations=10000, processes=None):
+    """
+    Every Result for the shapes of points, a list of (x, y), best first, and
+    the batch.JobResults of any runs that failed.
+    """
+    jobs = [("{}x{}{}{} seed {}".format(shape.rows, shape.columns, " duplex" if shape.duplex else "",
+                                        " transposed" if shape.transposed else "", seed),
+             (points, shape, seed, iterations))
+            for shape in shapes(len(points), slack, duplex) for seed in range(seeds)]
+    runs = batch.run(anneal, jobs, processes)
+    results = sorted((run.result for run in runs if run.ok), key=lambda result: (result.pins, result.length))
+    return results, [run for run in runs if not run.ok]
+
+
+def numbered(points, slots):
+    """slots with rows numbered top to bottom and columns left to right, from 1."""
+    def order(index):
+        centres = {}
+        for key, slot in enumerate(slots):
+            centres.setdefault(slot[index], []).append(points[key][1 - index])
+        return dict((value, n + 1) for n, value in enumerate(
+            sorted(centres, key=lambda value: sum(centres[value]) / len(centres[value]))))
+    rows, columns = order(0), order(1)
+    return [(rows[row], columns[column], side) for row, column, side in slots]
+
+
+def apply(matrix, refs, points, slots):
+    """
+    A copy of matrix (see matrix_netlist.Matrix) with the switches in refs
+    moved to slots. The switches of every row go on quad diodes (see
+    diode_pack.py), the matrix nets keep the MCU pins they had, rows first.
+    """
+    if any(side for _, _, side in slots):
+        raise ValueError("A duplex matrix can not be written as a matrix definition, the diodes only go to rows")
+    slots = numbered(points, slots)
+    switches = OrderedDict((ref, dict(switch)) for ref, switch in matrix.switches.items())
+    for key, (row, column, _) in enumerate(slots):
+        switches[refs[key]].update(row=row, col=column)
+    packed = diode_pack.apply(matrix._replace(switches=switches), refs, diode_pack.pack(
+        points, [row for row, _, _ in slots], len(diode_pack.ANODE_PINS)))
+    pins = [pin for net, pin in sorted(matrix.matrix_to_mcu.items(), key=lambda item: (
+        item[0][0] != "R", int(item[0][1:]) if item[0][1:].isdigit() else 0))]
+    rows = max(row for row, _, _ in slots)
+    columns = max(column for _, column, _ in slots)
+    if rows + columns > len(pins):
+        raise ValueError("{} pins needed, matrix_to_mcu only has {}".format(rows + columns, len(pins)))
+    names = ["R{}".format(n) for n in range(1, rows + 1)] + ["C{}".format(n) for n in range(1, columns + 1)]
+    matrix_to_mcu = OrderedDict(zip(names, pins))
+    return packed._replace(matrix_to_mcu=matrix_to_mcu)
+
+
+def current_slots(matrix, refs):
+    return [(matrix.switches[ref]["row"], matrix.switches[ref]["col"], 0) for ref in refs]
+
+
+def main(matrix_name, board_name, output_name=None, slack=0, duplex=False, seeds=2, iterations=10000,
+         processes=None):
+    matrix = matrix_netlist.load_matrix(matrix_name)
+    refs = [ref for ref, switch in matrix.switches.items() if not switch["clone"]]
+    positions = board_positions(board_name, refs)
+    points = [positions[ref] for ref in refs]
+    current = current_slots(matrix, refs)
+    print("{} keys, now {} pins and {:.0f}mm of row and column nets".format(
+        len(refs), pin_count(current), net_length(points, current)))
+    results, failed = optimize(points, slack, duplex, seeds, iterations, processes)
+    if failed:
+        batch.summary(failed)
+    seen = set()
+    for result in results:
+        if result.shape in seen:
+            continue
+        seen.add(result.shape)
+        print("  {:2}x{:<2} {:<7} {:<10} {:2} pins {:6.0f}mm".format(
+            result.shape.rows, result.shape.columns, "duplex" if result.shape.duplex else "",
+            "transposed" if result.shape.transposed else "", result.pins, result.length))
+    best = results[0]
+    if output_name:
+        # Duplex needs diodes on the columns as well, which the definition can't describe
+        writable = [result for result in results if not result.shape.duplex]
+        if not writable:
+            raise ValueError("Only duplex matrices were tried, nothing to write")
+        if writable[0] is not best:
+            print("Writing the best matrix without duplex, {}x{}".format(
+                writable[0].shape.rows, writable[0].shape.columns))
+        matrix_netlist.save_matrix(output_name, apply(matrix, refs, points, writable[0].slots))
+        print("Wrote {}".format(output_name))
+    return best
+
+
+if __name__ == "__main__":
+    directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matrix", default=os.path.join(directory, "smk65_matrix.json"),
+                        help="matrix definition (default: smk65_matrix.json)")
+    parser.add_argument("--board", default=os.path.join(directory, "smk65.kicad_pcb"),
+                        help="board to take the switch positions from (default: smk65.kicad_pcb)")
+    parser.add_argument("-o", "--output", help="write the best matrix here")
+    parser.add_argument("--slack", type=int, default=0, help="also try shapes with up to this many more pins")
+    parser.add_argument("--duplex", action="store_true", help="also try duplex matrices")
+    parser.add_argument("--seeds", type=int, default=2, help="annealing runs per shape")
+    parser.add_argument("--iterations", type=int, default=10000, help="moves per annealing run")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+    try:
+        main(args.matrix, args.board, args.output, args.slack, args.duplex, args.seeds, args.iterations, args.jobs)
+    except ValueError as error:
+        parser.error(str(error))
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+"""
+Lazy, cached reader for KiCad symbol libraries (.lib with its .dcm).
+
+A library is only scanned for the byte offsets of its DEF ... ENDDEF blocks,
+a symbol is parsed when it is first asked for:
+
+    {
+        "name": "C", "reference": "C", "units": 1, "aliases": ["..."],
+        "fields": {"value": "C", "footprint": "", "datasheet": ""},
+        "fplist": ["C?", "C_????_*", ...],
+        "description": "Unpolarized capacitor", "keywords": "cap capacitor",
+        "pins": [{"num": "1", "name": "~", "type": "P", "unit": 1}, ...],
+    }
+
+The offsets and every symbol parsed so far are kept in a json cache
+(~/.cache/mechkeys/symbols) keyed by the sha1 of the .lib and .dcm. While
+their mtime and size don't change the library isn't even read, so asking for
+a handful of symbols from device.lib costs a json load.
+
+It can also write a precompiled skidl library like smk65/smk65_lib_sklib.py,
+which skidl imports without reading any .lib at all:
+
+    symlib.py -o parts_sklib.py --name parts_lib \\
+        kicad-libs/device.lib:C=Capacitors_SMD:C_0805 kicad-libs/cherrymx.lib:MX_LED=Keyboard:MXALPS
+
+smk65/smk65_lib_sklib.py also holds parts from KiCad's atmel.lib and
+conn.lib, which aren't in the repo, so it is kept as it is.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import json
+import hashlib
+import argparse
+from collections import OrderedDict
+
+import output_cache
+
+# Bump when the parsed form changes so old caches are thrown away
+CACHE_VERSION = 1
+
+default_cache_directory = os.path.join(os.path.expanduser("~"), ".cache", "mechkeys", "symbols")
+
+_def = re.compile(br"^DEF\s+(\S+)", re.MULTILINE)
+_enddef = re.compile(br"^ENDDEF[ \t]*\r?$", re.MULTILINE)
+_alias = re.compile(br"^ALIAS\s+(.*?)\s*$", re.MULTILINE)
+_cmp = re.compile(br"^\$CMP\s+(.*?)\s*$", re.MULTILINE)
+_field_name = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+# Electrical pin types of the X lines and their skidl names
+pin_types = {
+    "I": "INPUT",
+    "O": "OUTPUT",
+    "B": "BIDIR",
+    "T": "TRISTATE",
+    "P": "PASSIVE",
+    "U": "UNSPEC",
+    "W": "PWRIN",
+    "w": "PWROUT",
+    "C": "OPENCOLL",
+    "E": "OPENEMIT",
+    "N": "NOCONNECT",
+}
+
+_standard_fields = ("reference", "value", "footprint", "datasheet")
+
+
+def index_library(data):
+    """
+    name -> [start, end] of the DEF ... ENDDEF block of every symbol in the
+    text of a .lib, aliases map to the block of the symbol they belong to.
+    """
+    index = OrderedDict()
+    position = 0
+    while True:
+        match = _def.search(data, position)
+        if match is None:
+            return index
+        end = _enddef.search(data, match.end())
+        if end is None:
+            raise ValueError("DEF {} has no ENDDEF".format(match.group(1).decode("utf-8")))
+        span = [match.start(), end.end()]
+        index[match.group(1).decode("utf-8").lstrip("~")] = span
+        for aliases in _alias.finditer(data, match.end(), end.start()):
+            for alias in aliases.group(1).split():
+                index.setdefault(alias.decode("utf-8"), span)
+        position = end.end()
+
+
+def index_docs(data):
+    """name -> [start, end] of every $CMP ... $ENDCMP block of a .dcm."""
+    index = {}
+    for match in _cmp.finditer(data):
+        end = data.find(b"$ENDCMP", match.end())
+        index[match.group(1).decode("utf-8")] = [match.end(), end if end >= 0 else len(data)]
+    return index
+
+
+def _unquote(text):
+    match = _field_name.match(text)
+    return match.group(1) if match else text
+
+
+def parse_symbol(text):
+    """Parse one DEF ... ENDDEF block (text) into its normalized form."""
+    symbol = {"fields": {}, "fplist": [], "pins": [], "aliases": []}
+    in_fplist = False
+    for line in text.splitlines():
+        line = line.strip()
+        if in_fplist:
+            if line == "$ENDFPLIST":
+                in_fplist = False
+            elif line:
+                symbol["fplist"].append(line)
+            continue
+        if line.startswith("DEF "):
+            values = line.split()
+            symbol["name"] = values[1].lstrip("~")
+            symbol["reference"] = values[2].lstrip("~")
+            symbol["units"] = int(values[7]) if len(values) > 7 else 1
+        elif line.startswith("F") and line[1:2].isdigit():
+            number, _, rest = line.partition(" ")
+            number = int(number[1:])
+            value = _unquote(rest)
+            if number < len(_standard_fields):
+                symbol["fields"][_standard_fields[number]] = value
+            else:
+                # User fields end with their quoted name
+                names = _field_name.findall(rest)
+                symbol["fields"][names[-1] if len(names) > 1 else "F{}".format(number)] = value
+        elif line.startswith("ALIAS "):
+            symbol["aliases"].extend(line.split()[1:])
+        elif line == "$FPLIST":
+            in_fplist = True
+        elif line.startswith("X "):
+            values = line.split()
+            symbol["pins"].append({
+                "name": values[1],
+                "num": values[2],
+                "unit": int(values[9]),
+                "type": values[11],
+            })
+    return symbol
+
+
+def parse_doc(text):
+    """description, keywords and datasheet of one $CMP block (without the $CMP line)."""
+    doc = {}
+    for line in text.splitlines():
+        kind, _, value = line.strip().partition(" ")
+        name = {"D": "description", "K": "keywords", "F": "datasheet"}.get(kind)
+        if name:
+            doc[name] = value.strip()
+    return doc
+
+
+class SymbolLibrary(object):
+    """
+    One .lib (and the .dcm next to it), symbols are parsed on first use.
+
+    Loading only stats the files while they match the cache, the index and
+    the symbols parsed on earlier runs are taken from it as is.
+    """
+
+    def __init__(self, path, cache_directory=default_cache_directory):
+        self.path = os.path.abspath(path)
+        self.doc_path = os.path.splitext(self.path)[0] + ".dcm"
+        self.nickname = os.path.splitext(os.path.basename(self.path))[0]
+        self.cache_name = None
+        if cache_directory:
+            key = hashlib.sha1(self.path.encode("utf-8")).hexdigest()[:12]
+            self.cache_name = os.path.join(cache_directory, "{}-{}.json".format(self.nickname, key))
+        self.parsed = 0
+        self.dirty = False
+        self._load()
+
+    def _stats(self):
+        stats = []
+        for name in (self.path, self.doc_path):
+            stat = os.stat(name) if os.path.exists(name) else None
+            stats.append([stat.st_mtime, stat.st_size] if stat else None)
+        return stats
+
+    def _read(self, name):
+        if not os.path.exists(name):
+            return b""
+        with open(name, mode="rb") as lib_file:
+            return lib_file.read()
+
+    def _read_cache(self):
+        if self.cache_name is None or not os.path.exists(self.cache_name):
+            return {}
+        try:
+            with open(self.cache_name) as cache_file:
+                cache = json.load(cache_file)
+        except ValueError:
+            return {}
+        return cache if cache.get("version") == CACHE_VERSION else {}
+
+    def _load(self):
+        cache = self._read_cache()
+        stats = self._stats()
+        if cache and cache["stats"] == stats:
+            self.cache = cache
+            return
+        data, docs = self._read(self.path), self._read(self.doc_path)
+        digest = hashlib.sha1(data + b"\0" + docs).hexdigest()
+        if not cache or cache["sha1"] != digest:
+            cache = {
+                "version": CACHE_VERSION,
+                "path": self.path,
+                "sha1": digest,
+                "index": index_library(data),
+                "docs": index_docs(docs),
+                "symbols": {},
+            }
+        cache["stats"] = stats
+        self.cache = cache
+        self.dirty = True
+
+    def save(self):
+        """Write the cache if anything was added to it."""
+        if not self.dirty or self.cache_name is None:
+            return
+        directory = os.path.dirname(self.cache_name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_name = self.cache_name + ".tmp"
+        with open(temp_name, mode="w") as cache_file:
+            json.dump(self.cache, cache_file)
+        if hasattr(os, "replace"):
+            os.replace(temp_name, self.cache_name)
+        else:
+            if os.path.exists(self.cache_name):
+                os.remove(self.cache_name)
+            os.rename(temp_name, self.cache_name)
+        self.dirty = False
+
+    def _slice(self, name, start, end):
+        with open(name, mode="rb") as lib_file:
+            lib_file.seek(start)
+            return lib_file.read(end - start).decode("utf-8")
+
+    def names(self):
+        return list(self.cache["index"])
+
+    def __contains__(self, name):
+        return name in self.cache["index"]
+
+    def __getitem__(self, name):
+        symbols = self.cache["symbols"]
+        if name not in symbols:
+            if name not in self.cache["index"]:
+                raise KeyError("Symbol {} not found in {}".format(name, self.path))
+            symbol = parse_symbol(self._slice(self.path, *self.cache["index"][name]))
+            # An alias is the same drawing under another name, with its own docs
+            symbol["name"] = name
+            if name in self.cache["docs"]:
+                symbol.update(parse_doc(self._slice(self.doc_path, *self.cache["docs"][name])))
+            symbols[name] = symbol
+            self.parsed += 1
+            self.dirty = True
+        return symbols[name]
+
+
+class SymbolLibraries(object):
+    """
+    Several libraries searched in order.
+
+    Symbols are named "nickname:Symbol" like in KiCad, eg "device:C", or
+    just "C" to take the first match.
+    """
+
+    def __init__(self, paths, cache_directory=default_cache_directory):
+        self.libraries = [SymbolLibrary(path, cache_directory) for path in paths]
+
+    def __getitem__(self, name):
+        nickname, _, symbol = name.rpartition(":")
+        for library in self.libraries:
+            if nickname and library.nickname != nickname:
+                continue
+            if symbol in library:
+                return library[symbol]
+        raise KeyError("Symbol {} not found in {}".format(
+            name, ", ".join(library.path for library in self.libraries)))
+
+    def save(self):
+        for library in self.libraries:
+            library.save()
+
+
+def _sklib_part(symbol, footprint=None):
+    attributes = [("name", repr(symbol["name"])), ("dest", "TEMPLATE"), ("tool", "SKIDL")]
+    for key in ("keywords", "description"):
+        if symbol.get(key):
+            attributes.append((key, repr(symbol[key])))
+    attributes.append(("ref_prefix", repr(symbol["reference"])))
+    attributes.append(("num_units", str(symbol["units"])))
+    if symbol["fplist"]:
+        attributes.append(("fplist", repr(symbol["fplist"])))
+    attributes.append(("do_erc", "True"))
+    footprint = footprint or symbol["fields"].get("footprint")
+    if footprint:
+        attributes.append(("footprint", repr(footprint)))
+    pins = []
+    for pin in symbol["pins"]:
+        func = pin_types.get(pin["type"])
+        pins.append("            Pin(num={!r},name={!r},{}do_erc=True)".format(
+            pin["num"], pin["name"], "func=Pin.{},".format(func) if func else ""))
+    return "        Part({},pins=[\n{}])".format(
+        ",".join("{}={}".format(key, value) for key, value in attributes), ",\n".join(pins))
+
+
+def sklib_module(symbols, lib_name="symbols_lib"):
+    """
+    Text of a skidl library module holding symbols, a list of (symbol,
+    footprint) with footprint None to keep the symbol's own.
+    """
+    lines = [
+        "from skidl import Pin, Part, SchLib, SKIDL, TEMPLATE",
+        "",
+        "SKIDL_lib_version = '0.0.1'",
+        "",
+        "{} = SchLib(tool=SKIDL).add_parts(*[".format(lib_name),
+        ",\n".join(_sklib_part(symbol, footprint) for symbol, footprint in symbols) + "])",
+    ]
+    return "\n".join(lines)
+
+
+def main(specs, output_name=None, lib_name="symbols_lib", cache_directory=default_cache_directory):
+    """
+    Look up every LIB:SYMBOL[=FOOTPRINT] in specs, write them as a skidl
+    library to output_name or list them.
+    """
+    libraries = {}
+    symbols = []
+    for spec in specs:
+        spec, _, footprint = spec.partition("=")
+        path, _, name = spec.rpartition(":")
+        if path not in libraries:
+            libraries[path] = SymbolLibrary(path, cache_directory)
+        symbols.append((libraries[path][name], footprint or None))
+    for library in libraries.values():
+        library.save()
+    if output_name:
+        written = output_cache.write_if_changed(output_name, sklib_module(symbols, lib_name).encode("utf-8"))
+        print("{} {}".format(output_name, "written" if written else "unchanged"))
+    else:
+        for symbol, footprint in symbols:
+            print("{} ({}): {} pins, {}".format(
+                symbol["name"], symbol["reference"], len(symbol["pins"]), symbol.get("description", "")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("symbols", nargs="+", metavar="LIB:SYMBOL[=FOOTPRINT]",
+                        help="library file and symbol, optionally with the footprint to give it")
+    parser.add_argument("-o", "--output", help="write a skidl library module instead of listing the symbols")
+    parser.add_argument("--name", default="symbols_lib", help="variable name of the skidl library")
+    args = parser.parse_args()
+    main(args.symbols, args.output, args.name)
@@ -0,0 +1,19 @@
+"""
+Behaviour tests for the checkers and readers, run with
+
+    python3 -m pytest tests
+
+from the top of the repo. They work on the boards, Gerbers, drill files and
+plates checked in here, so a change that moves a count shows up.
+"""
+
+import os
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.abspath(root))
+sys.path.insert(0, os.path.abspath(os.path.join(root, "smk65")))
+
+
+def repo_file(*parts):
+    return os.path.abspath(os.path.join(root, *parts))
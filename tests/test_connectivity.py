@@ -0,0 +1,58 @@
+from conftest import repo_file
+
+import connectivity
+from connectivity import ERROR, WARNING
+
+
+def key(switch, diode, row, column):
+    """The pins of one matrix key the way layout.py wires it."""
+    anode = "Net-({}-Pad2)".format(diode)
+    return [(switch, "SW1", column), (switch, "SW2", anode), (diode, "1", row), (diode, "2", anode)]
+
+
+def test_repo_boards_are_clean():
+    for name in ("103key-project/103key.kicad_pcb", "smk65/smk65.kicad_pcb",
+                 "text-test-project/text-test.kicad_pcb", "isp/isp.kicad_pcb"):
+        assert connectivity.check_file(repo_file(name)) == [], name
+
+
+def test_matrix_without_problems():
+    pins = key("SW1", "D1", "R1", "C1") + key("SW2", "D2", "R1", "C2") + key("SW3", "D3", "R2", "C1")
+    assert connectivity.check(pins) == []
+
+
+def test_shorted_rows():
+    pins = key("SW1", "D1", "R1", "C1") + key("SW2", "D2", "R2", "C2") + [("J1", "1", "R1"), ("J1", "1", "R2")]
+    findings = connectivity.check(pins)
+    assert [(finding.level, finding.ref) for finding in findings] == [(ERROR, "J1")]
+    assert "R1, R2" in findings[0].message
+
+
+def test_short_between_other_nets_is_a_warning():
+    pins = key("SW1", "D1", "R1", "C1") + [("J1", "1", "GND"), ("J1", "1", "VCC")]
+    assert [finding.level for finding in connectivity.check(pins)] == [WARNING]
+
+
+def test_diode_on_two_rows():
+    pins = key("SW1", "D1", "R1", "C1") + [("D1", "3", "R2")]
+    findings = connectivity.check(pins)
+    assert [(finding.level, finding.ref) for finding in findings] == [(ERROR, "D1"), (ERROR, "SW1")]
+    assert findings[0].message == "Diode is on rows R1, R2"
+
+
+def test_two_switches_on_one_position():
+    pins = key("SW1", "D1", "R1", "C1") + key("SW2", "D2", "R1", "C1")
+    findings = connectivity.check(pins)
+    assert [finding.ref for finding in findings] == ["SW1"]
+    assert "SW1, SW2" in findings[0].message
+
+
+def test_parallel_footprints_are_one_key():
+    pins = key("SW1", "D1", "R1", "C1") + [("SW101", "SW1", "C1"), ("SW101", "SW2", "Net-(D1-Pad2)")]
+    assert connectivity.check(pins) == []
+
+
+def test_floating_led_pin():
+    pins = key("SW1", "D1", "R1", "C1") + key("SW2", "D2", "R1", "C2")
+    pins += [("SW1", "K", "LED_K"), ("SW1", "A", "LED_A"), ("SW2", "K", "LED_K"), ("U1", "1", "LED_A")]
+    assert [(finding.level, finding.ref) for finding in connectivity.check(pins)] == [(WARNING, "SW2")]
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from conftest import repo_file
+
+numpy = pytest.importorskip("numpy")
+
+import consistency  # noqa: E402
+import drc  # noqa: E402
+
+drill_name = repo_file("103key-project/gerbers/103key.DRD.drl")
+
+
+def board():
+    modules = drc.read_board(repo_file("103key-project/103key.kicad_pcb"))
+    return modules, consistency.board_switches(modules)
+
+
+def on_board(name, points, switches):
+    reference = [(x, y) for _, x, y in switches]
+    offset = consistency.align(reference, points)
+    return consistency.Centres(name, [(x + offset[0], y + offset[1]) for x, y in points], offset)
+
+
+def nearest(points, x, y):
+    return min(range(len(points)), key=lambda n: (points[n][0] - x) ** 2 + (points[n][1] - y) ** 2)
+
+
+def test_103key_agrees():
+    project = consistency.find_projects([repo_file("103key-project")])
+    assert len(project) == 1
+    findings, summary = consistency.check_project(*project[0])
+    assert findings == []
+    assert summary == ("103 switches: 103key-layout.json (moved +38.100, +28.575) ok, 103key.DRD.drl ok, "
+                       "switch.dxf (moved +18.481, +152.988) ok")
+
+
+def test_smk65_drill_is_not_checked():
+    findings, summary = consistency.check_project(*consistency.find_projects([repo_file("smk65")])[0])
+    assert summary == "88 switches: nothing to compare"
+    assert findings == [consistency.Finding(consistency.WARNING, "smk65.drl", None,
+                                            "not checked, the switches have no centre hole")]
+
+
+def test_drill_errors_are_found():
+    modules, switches = board()
+    hole = consistency.centre_hole(modules)
+    assert hole == pytest.approx(3.9878)
+    expected = consistency.other_holes(modules, hole)
+    assert len(expected) == 16
+    centres = on_board("DRD.drl", consistency.drill_centres(drill_name, hole), switches)
+    assert len(centres.points) == 103 + 16
+    assert consistency.compare(switches, centres, expected=expected) == []
+
+    points = list(centres.points)
+    shifted = nearest(points, *switches[0][1:])
+    points[shifted] = (points[shifted][0] + 0.5, points[shifted][1])
+    stabilizer = nearest(points, *expected[0])
+    points[stabilizer] = (points[stabilizer][0], points[stabilizer][1] + 3.0)
+    del points[nearest(points, *switches[1][1:])]
+    findings = consistency.compare(switches, centres._replace(points=points), expected=expected)
+    assert [(finding.level, finding.ref, finding.message) for finding in findings] == [
+        (consistency.ERROR, switches[0][0], "is 0.500mm off (+0.500, +0.000)"),
+        (consistency.ERROR, switches[1][0], "is missing (board at {:.3f}, {:.3f})".format(*switches[1][1:])),
+        (consistency.ERROR, None, "has a switch at {:.3f}, {:.3f} that the board hasn't".format(
+            expected[0][0], expected[0][1] + 3.0)),
+    ]
+
+
+def test_missing_layout_key(tmpdir):
+    modules, switches = board()
+    with open(repo_file("103key-project/103key-layout.json")) as layout_file:
+        rows = json.load(layout_file)
+    # The last key of the last row, so the keys before it stay where they are
+    rows[-1] = rows[-1][:-1]
+    while not isinstance(rows[-1][-1], str):
+        rows[-1] = rows[-1][:-1]
+    layout = tmpdir.join("layout.json")
+    layout.write(json.dumps(rows))
+    findings, summary = consistency.check_project(repo_file("103key-project/103key.kicad_pcb"), [str(layout)])
+    assert summary == "103 switches: layout.json (moved +38.100, +28.575) 1 errors"
+    assert len(findings) == 1 and findings[0].message.startswith("is missing")
+
+
+def test_align_finds_the_offset():
+    _, switches = board()
+    reference = [(x, y) for _, x, y in switches]
+    points = [(x - 12.34, y + 56.78) for x, y in reference[10:]]
+    dx, dy = consistency.align(reference, points)
+    assert (dx, dy) == (pytest.approx(12.34), pytest.approx(-56.78))
+    assert consistency.align([], points) == (0.0, 0.0)
+
+
+def test_match_pairs_nearest_first():
+    reference = [(0.0, 0.0), (1.0, 0.0), (50.0, 0.0)]
+    points = [(0.9, 0.0), (0.2, 0.0), (100.0, 0.0)]
+    matched, missing, extra = consistency.match(reference, points, radius=5.0)
+    assert [(i, j) for i, j, _ in matched] == [(0, 1), (1, 0)]
+    assert (missing, extra) == ([2], [2])
+
+
+def square(x, y, size):
+    return numpy.array([(x, y), (x + size, y), (x + size, y + size), (x, y + size)])
+
+
+def test_cutout_centres():
+    notched = numpy.array([(0, 0), (14, 0), (14, 5), (14.8, 5), (14.8, 9), (14, 9), (14, 14), (0, 14)], dtype=float)
+    stabilized = numpy.array([(30, 0), (44, 0), (44, 4), (52, 4), (52, 10), (44, 10), (44, 14), (30, 14)],
+                             dtype=float)
+    loops = [square(-100, -100, 300), notched, square(60, 0, 14), square(80, 0, 10), stabilized]
+    assert consistency.cutout_centres(loops) == [(7.0, -7.0), (37.0, -7.0), (67.0, -7.0)]
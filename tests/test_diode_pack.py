@@ -0,0 +1,49 @@
+import math
+
+from conftest import repo_file
+
+import diode_pack
+import matrix_netlist
+
+
+def test_board_pads_match_the_default():
+    assert diode_pack.board_pads(repo_file("smk65/smk65.kicad_pcb"), "D1") == diode_pack.default_pads
+
+
+def test_along_follows_a_slanted_row():
+    points = [(2.0, 2.0), (0.0, 0.0), (3.0, 3.0), (1.0, 1.0)]
+    assert diode_pack.along(points, [0, 1, 2, 3]) == [1, 3, 0, 2]
+
+
+def test_split_uses_the_fewest_packages():
+    points = [(19.05 * n, 0.0) for n in range(9)]
+    runs = diode_pack.split(points, list(range(9)))
+    assert len(runs) == 3
+    assert sorted(key for _, _, pins in runs for key, _ in pins) == list(range(9))
+    assert all(len(pins) <= 4 for _, _, pins in runs)
+
+
+def test_place_matches_pads_to_the_nearest_keys():
+    # One key up and left, one down and right of the package
+    points = [(-5.0, -10.0), (5.0, 10.0)]
+    cost, x, y, pins = diode_pack.place(points, [0, 1], offset=(0.0, 0.0))
+    assert (x, y) == (0.0, 0.0)
+    assert dict(pins) == {0: 4, 1: 1}
+    assert math.isclose(cost, 2 * math.hypot(4.05, 8.8))
+
+
+def test_smk65_packing():
+    matrix = matrix_netlist.load_matrix(repo_file("smk65/smk65_matrix.json"))
+    packed, placements = diode_pack.main(repo_file("smk65/smk65_matrix.json"), repo_file("smk65/smk65.kicad_pcb"))
+    assert len(packed.diodes) == len(placements) == 18
+    refs = [ref for ref, switch in matrix.switches.items() if not switch["clone"]]
+    # Every switch on its own anode of a diode on its row
+    anodes = [(packed.switches[ref]["d_ref"], packed.switches[ref]["d_pin"]) for ref in refs]
+    assert len(set(anodes)) == len(refs)
+    assert all(packed.diodes[packed.switches[ref]["d_ref"]] == matrix.switches[ref]["row"] for ref in refs)
+    positions = diode_pack.board_positions(repo_file("smk65/smk65.kicad_pcb"), refs + list(matrix.diodes))
+    points = [positions[ref] for ref in refs]
+    now = diode_pack.matrix_packages(matrix, refs, positions)
+    packages = diode_pack.pack(points, [matrix.switches[ref]["row"] for ref in refs])
+    assert round(diode_pack.anode_length(points, now)) == 1801
+    assert round(diode_pack.anode_length(points, packages)) == 1459
@@ -0,0 +1,94 @@
+import shutil
+
+from conftest import repo_file
+
+import drc
+
+
+def board():
+    return drc.read_board(repo_file("103key-project/103key.kicad_pcb"))
+
+
+def levels(collisions):
+    return [collision.level for collision in collisions].count(drc.ERROR), \
+        [collision.level for collision in collisions].count(drc.WARNING)
+
+
+def test_103key_only_has_the_known_courtyard_warnings():
+    collisions = drc.check(board(), processes=1)
+    assert levels(collisions) == (0, 11)
+    assert set(collision.a for collision in collisions) == set(["SW_X20Y7_101", "SW_X4Y7_93", "D98"])
+
+
+def test_tiles_find_the_same_collisions():
+    modules = board()
+    assert drc.check(modules, tile=40.0, processes=1) == drc.check(modules, processes=1)
+
+
+def test_diode_on_the_next_diode():
+    modules = board()
+    d5 = next(n for n, module in enumerate(modules) if module.ref == "D5")
+    d6 = next(module for module in modules if module.ref == "D6")
+    modules[d5] = modules[d5]._replace(x=d6.x + 0.5, y=d6.y)
+    errors = [collision.message for collision in drc.check(modules, processes=1) if collision.level == drc.ERROR]
+    assert errors == ["D6 pad 1 overlaps D5 pad 1", "D6 pad 2 overlaps D5 pad 2"]
+
+
+def test_diode_offset_onto_the_switches():
+    # What a wrong diode_x_offset/diode_y_offset in layout.py does
+    modules = [module._replace(x=module.x + 2.54, y=module.y - 5.08) if module.ref.startswith("D") else module
+               for module in board()]
+    collisions = drc.check(modules, processes=1)
+    assert levels(collisions) == (102, 13)
+    assert collisions[0].message == "D2 pad 2 overlaps SW_Scroll_2 hole"
+
+
+def test_markers_come_out_again(tmp_path):
+    name = str(tmp_path / "103key.kicad_pcb")
+    shutil.copy(repo_file("103key-project/103key.kicad_pcb"), name)
+    with open(name, mode="rb") as board_file:
+        original = board_file.read()
+    collisions = drc.check(drc.read_board(name), processes=1)
+    assert drc.write_markers(name, collisions, "Eco2.User")
+    with open(name, mode="rb") as board_file:
+        assert board_file.read().count(b"DRC ") == 11
+    assert drc.write_markers(name, [], "Eco2.User")
+    with open(name, mode="rb") as board_file:
+        assert board_file.read() == original
+
+
+def smk65_with_c5_on(dx, dy):
+    modules = drc.read_board(repo_file("smk65/smk65.kicad_pcb"))
+    c5 = next(n for n, module in enumerate(modules) if module.ref == "C5")
+    c6 = next(module for module in modules if module.ref == "C6")
+    assert modules[c5].nets == c6.nets == ["+5v", "GND"]
+    modules[c5] = modules[c5]._replace(x=c6.x + dx, y=c6.y + dy, angle=c6.angle)
+    return modules
+
+
+def between(collisions, a, b):
+    return [collision.message for collision in collisions if set((collision.a, collision.b)) == set((a, b))]
+
+
+def test_bypass_caps_on_the_same_nets_collide():
+    modules = smk65_with_c5_on(0.0, 0.0)
+    assert between(drc.check(modules, processes=1), "C5", "C6") == ["C5 courtyard overlaps C6 courtyard"]
+    assert between(drc.check(modules, processes=1, clones=drc.stacked(modules)), "C5", "C6")
+    modules = smk65_with_c5_on(0.5, 0.0)
+    assert between(drc.check(modules, processes=1, clones=drc.stacked(modules)), "C5", "C6")
+
+
+def test_only_clones_may_overlap():
+    modules = smk65_with_c5_on(0.0, 0.0)
+    assert between(drc.check(modules, processes=1, clones=[("C6", "C5")]), "C5", "C6") == []
+    # A copy of a footprint at the same origin on the same nets is a clone on a board
+    c6 = next(module for module in modules if module.ref == "C6")
+    modules.append(c6._replace(ref="C6_1"))
+    assert drc.stacked(modules) == [("C6", "C6_1")]
+    assert between(drc.check(modules, processes=1, clones=drc.stacked(modules)), "C6", "C6_1") == []
+    modules[-1] = modules[-1]._replace(x=c6.x + 0.5)
+    assert drc.stacked(modules) == []
+    # The smk65 alternatives for 1.25u and 2u keys sit at other origins and are on different nets pad for pad
+    errors = [collision.message for collision in drc.check(drc.read_board(repo_file("smk65/smk65.kicad_pcb")),
+                                                           processes=1) if collision.level == drc.ERROR]
+    assert "S32 pad SW2 overlaps S132 pad SW1" in errors
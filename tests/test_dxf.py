@@ -0,0 +1,82 @@
+import math
+
+import pytest
+
+from conftest import repo_file
+
+numpy = pytest.importorskip("numpy")
+
+import dxf  # noqa: E402
+
+
+def plate(name):
+    return dxf.read(repo_file("103key-project/plates", name + ".dxf"))
+
+
+@pytest.mark.parametrize("name, lines, loops, cutouts, area", [
+    ("switch", 1800, 112, 111, 37444.4),
+    ("bottom", 244, 9, 8, 61663.2),
+    ("closed", 248, 10, 9, 10947.8),
+    ("open", 252, 9, 8, 10847.8),
+])
+def test_plates(name, lines, loops, cutouts, area):
+    drawing = plate(name)
+    assert len(drawing) == len(drawing.select(dxf.LINE)) == lines
+    assert drawing.layers == ["0"] and not drawing.skipped
+    x0, y0, x1, y1 = drawing.bounds()
+    assert (round(x1 - x0, 2), round(y1 - y0, 2)) == (429.58, 143.83)
+    assert (len(drawing.loops()), len(drawing.cutouts())) == (loops, cutouts)
+    assert drawing.area() == pytest.approx(area, abs=0.05)
+
+
+def test_query_matches_every_box():
+    drawing = plate("switch")
+    box = (100, 60, 120, 80)
+    found = drawing.query(box)
+    assert len(found) == 10
+    touching = (drawing.box[:, 0] <= box[2]) & (drawing.box[:, 2] >= box[0]) & \
+        (drawing.box[:, 1] <= box[3]) & (drawing.box[:, 3] >= box[1])
+    assert found == numpy.flatnonzero(touching).tolist()
+
+
+def entity(kind, layer, *pairs):
+    return [0, kind, 8, layer] + list(pairs)
+
+
+def dxf_data(*entities):
+    pairs = [0, "SECTION", 2, "HEADER", 0, "ENDSEC", 0, "SECTION", 2, "ENTITIES"]
+    for item in entities:
+        pairs += item
+    pairs += [0, "ENDSEC", 0, "EOF"]
+    # Group codes are right aligned, values can come with \r\n like from AutoCAD
+    return "".join("{:>3}\r\n{}\r\n".format(code, value) for code, value in zip(pairs[::2], pairs[1::2])).encode()
+
+
+def test_entities():
+    drawing = dxf.parse(dxf_data(
+        # 20 x 10 with a half circle out of the right side
+        entity("LWPOLYLINE", "Outline", 90, 4, 70, 1, 10, 0.0, 20, 0.0, 10, 20.0, 20, 0.0, 42, 1.0,
+               10, 20.0, 20, 10.0, 10, 0.0, 20, 10.0),
+        entity("CIRCLE", "Holes", 10, 5.0, 20, 5.0, 40, 2.0),
+        # A half disc from a line and an arc
+        entity("LINE", "Holes", 10, 12.0, 20, 3.0, 11, 16.0, 21, 3.0),
+        entity("ARC", "Holes", 10, 14.0, 20, 3.0, 40, 2.0, 50, 0.0, 51, 180.0),
+        entity("TEXT", "Holes", 10, 1.0, 20, 1.0, 1, "plate"),
+    ), "test.dxf")
+    assert [dxf.KINDS[kind] for kind in drawing.kind] == ["LWPOLYLINE", "CIRCLE", "LINE", "ARC"]
+    assert drawing.layers == ["Outline", "Holes"]
+    assert drawing.skipped == {"TEXT": 1}
+    assert drawing.select(layer="Holes").tolist() == [1, 2, 3]
+    assert drawing.select(dxf.LINE, "Outline").tolist() == []
+    assert numpy.allclose(drawing.box, [[0, 0, 25, 10], [3, 3, 7, 7], [12, 3, 16, 3], [12, 3, 16, 5]])
+    assert drawing.closed.tolist() == [True, False, False, False]
+    assert (len(drawing.loops()), len(drawing.cutouts())) == (3, 2)
+    assert drawing.area() == pytest.approx(200 + 12.5 * math.pi - 6 * math.pi, rel=1e-2)
+
+
+def test_empty_file(tmpdir):
+    empty = tmpdir.join("empty.dxf")
+    empty.write("")
+    drawing = dxf.read(str(empty))
+    assert len(drawing) == 0 and drawing.bounds() is None and drawing.area() == 0.0
+    assert dxf.describe(drawing) == "empty"
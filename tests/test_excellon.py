@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from conftest import repo_file
+
+numpy = pytest.importorskip("numpy")
+import excellon  # noqa: E402
+
+drills = ["103key-project/gerbers/103key.DRD.drl", "smk65/SMK65-gerbers/smk65.drl"]
+
+
+def hit_set(drill):
+    return dict((tool, sorted(map(tuple, drill.hits[tool].round(4).tolist()))) for tool in drill.tools)
+
+
+def test_round_trip_is_byte_identical():
+    for name in drills:
+        with open(repo_file(name)) as drill_file:
+            text = drill_file.read()
+        assert excellon.dumps(excellon.parse(text)) == text, name
+
+
+def test_counts():
+    drill = excellon.read(repo_file("103key-project/gerbers/103key.DRD.drl"))
+    assert (len(drill.tools), drill.hit_count()) == (10, 821)
+    assert dict((tool, len(slots)) for tool, slots in drill.slots.items() if len(slots)) == {5: 206}
+    smk65 = excellon.read(repo_file("smk65/SMK65-gerbers/smk65.drl"))
+    assert smk65.hit_count() == 323
+    assert dict((tool, len(slots)) for tool, slots in smk65.slots.items() if len(slots)) == {3: 2, 4: 2, 6: 88, 7: 5}
+
+
+def test_optimized_file_keeps_every_hit(tmp_path):
+    for name in drills:
+        drill = excellon.read(repo_file(name))
+        optimized, report = excellon.optimize_drill(drill)
+        output = str(tmp_path / "out.drl")
+        excellon.write(output, optimized)
+        again = excellon.read(output)
+        assert hit_set(again) == hit_set(drill), name
+        assert dict((tool, slots.tolist()) for tool, slots in again.slots.items()) == \
+            dict((tool, slots.tolist()) for tool, slots in drill.slots.items())
+        assert all(after <= before + 1e-6 for _, _, before, after in report)
+
+
+def test_travel_is_cut():
+    drill = excellon.read(repo_file("103key-project/gerbers/103key.DRD.drl"))
+    _, report = excellon.optimize_drill(drill)
+    before = sum(before for _, _, before, _ in report)
+    after = sum(after for _, _, _, after in report)
+    assert round(before / 1000, 1) == 41.4
+    assert after < 0.55 * before
+
+
+def test_kd_tree_nearest_matches_brute_force():
+    rng = random.Random(1)
+    xs = [rng.uniform(0, 100) for _ in range(500)]
+    ys = [rng.uniform(0, 100) for _ in range(500)]
+    tree = excellon.KDTree(xs, ys)
+    for i in range(0, 500, 3):
+        tree.remove(i)
+    left = [i for i in range(500) if i % 3]
+    for _ in range(50):
+        x, y = rng.uniform(-10, 110), rng.uniform(-10, 110)
+        expected = sorted(left, key=lambda i: ((xs[i] - x) ** 2 + (ys[i] - y) ** 2, i))[:5]
+        assert tree.nearest(x, y, 5) == expected
+
+
+def test_optimize_is_a_permutation_and_beats_nearest_neighbour():
+    rng = numpy.random.RandomState(0)
+    points = rng.uniform(0, 200, size=(2000, 2))
+    order = excellon.optimize(points)
+    assert sorted(order) == list(range(2000))
+    nearest = excellon.nearest_neighbour(points[:, 0].tolist(), points[:, 1].tolist(), (0.0, 0.0))
+    assert excellon.travel(points[order]) < excellon.travel(points[nearest])
@@ -0,0 +1,81 @@
+import shutil
+
+import pytest
+
+from conftest import repo_file
+
+import fixvias
+from kicad_sexpr import Index, module_value
+
+
+def test_parse_rule():
+    assert fixvias.parse_rule("value:GND Via=VBUS") == ("value", "GND Via", "VBUS")
+    assert fixvias.parse_rule("reference:H*=GND") == ("reference", "H*", "GND")
+    # The net is after the last =
+    assert fixvias.parse_rule("value:A=B=GND") == ("value", "A=B", "GND")
+    for bad in ("GND Via=GND", "footprint:GND Via=GND", "value:=GND", "value:GND Via=", "value:GND Via"):
+        with pytest.raises(ValueError):
+            fixvias.parse_rule(bad)
+
+
+def test_pad_edits():
+    module = (b'(module X (at 0 0)\n'
+              b'  (pad 1 smd rect (at 0 0) (size 1 1) (layers F.Cu F.Paste))\n'
+              b'  (pad "" np_thru_hole circle (at 1 0) (size 1 1) (drill 1) (layers *.Cu))\n'
+              b'  (pad 2 smd rect (at 2 0) (size 1 1) (layers F.Cu) (net 3 X))\n'
+              b'  (pad 3 smd rect (at 3 0) (size 1 1) (layers F.Cu) (net 1 GND))\n'
+              b')')
+    layers = module.index(b"(layers F.Cu F.Paste)") + len(b"(layers F.Cu F.Paste)")
+    old = module.index(b"(net 3 X)")
+    # Pad 1 gets a net after its layers, the hole and pad 3 stay as they are
+    assert fixvias.pad_edits(module, 0, len(module), b"(net 1 GND)") == [
+        (layers, layers, b" (net 1 GND)"), (old, old + len(b"(net 3 X)"), b"(net 1 GND)")]
+
+
+def test_smk65_vias_onto_vbus(tmp_path):
+    name = str(tmp_path / "smk65.kicad_pcb")
+    shutil.copy(repo_file("smk65/smk65.kicad_pcb"), name)
+    with open(name, mode="rb") as board_file:
+        original = board_file.read()
+    # What the rule should do: the net of every pad of the GND Via modules and nothing else
+    index = Index(original)
+    vias = [node for node in index.nodes(b"module") if module_value(original, node.start, node.end) == "GND Via"]
+    assert len(vias) == 74 and index.nets()[18] == "VBUS"
+    expected = []
+    position = 0
+    for node in vias:
+        expected.append(original[position:node.start])
+        text = original[node.start:node.end]
+        assert text.count(b"(net 1 GND)") == 1
+        expected.append(text.replace(b"(net 1 GND)", b"(net 18 VBUS)"))
+        position = node.end
+    expected.append(original[position:])
+
+    output = str(tmp_path / "out.kicad_pcb")
+    rules = [fixvias.parse_rule("value:GND Via=VBUS")]
+    assert fixvias.fix_board(name, rules, output) == "74 pads on 74 modules changed"
+    with open(output, mode="rb") as board_file:
+        assert board_file.read() == b"".join(expected)
+    with open(name, mode="rb") as board_file:
+        assert board_file.read() == original
+    # Nothing left to do the second time
+    assert fixvias.fix_board(output, rules, output) == "0 pads on 0 modules changed"
+
+
+def test_unknown_net(tmp_path):
+    with pytest.raises(ValueError, match="has no net called VCC"):
+        fixvias.fix_board(repo_file("smk65/smk65.kicad_pcb"), [("value", "GND Via", "VCC")],
+                          str(tmp_path / "out.kicad_pcb"))
+
+
+def test_in_place(tmp_path):
+    name = str(tmp_path / "smk65.kicad_pcb")
+    shutil.copy(repo_file("smk65/smk65.kicad_pcb"), name)
+    assert fixvias.output_file_name(name, False) == str(tmp_path / "smk65-out.kicad_pcb")
+    assert fixvias.main([name], ["reference:C[5-9]=VBUS"], in_place=True, processes=1) == 0
+    with open(name, mode="rb") as board_file:
+        data = board_file.read()
+    index = Index(data)
+    for node in index.nodes(b"module"):
+        if node.reference() in ("C5", "C6", "C7", "C8", "C9"):
+            assert node.text().count(b"(net 18 VBUS)") == 2
@@ -0,0 +1,94 @@
+import pytest
+
+from conftest import repo_file
+
+numpy = pytest.importorskip("numpy")
+import gerber  # noqa: E402
+
+# name: (apertures, flashes, draws, arcs, regions)
+counts = {
+    "103key-B.Cu.GBL": (13, 788, 647, 0, 0),
+    "103key-B.Mask.GBS": (11, 758, 206, 0, 0),
+    "103key-B.SilkS.GBO": (2, 0, 8449, 0, 0),
+    "103key-Edge.Cuts.GKO": (1, 0, 4, 0, 0),
+    "103key-F.Cu.GTL": (12, 788, 1036, 0, 0),
+    "103key-F.Mask.GTS": (11, 758, 206, 0, 0),
+    "103key-F.SilkS.GTO": (2, 0, 6353, 0, 0),
+    "103key-drl_map.gbr": (4, 0, 6712, 828, 0),
+}
+
+# A 10 x 5 inch box of 0.01 inch lines, a flash, a clear flash on top and a region
+sample = b"""%FSLAX24Y24*%
+%MOIN*%
+%ADD10C,0.0100*%
+%ADD11R,0.0500X0.0200*%
+G01*
+D10*
+X0Y0D02*
+X100000Y0D01*
+X100000Y50000D01*
+G75*
+G03X0Y50000I-50000J0D01*
+D11*
+X20000Y20000D03*
+%LPC%
+X20000Y20000D03*
+%LPD%
+G01*
+G36*
+X30000Y30000D02*
+X40000Y30000D01*
+X40000Y40000D01*
+G37*
+M02*
+"""
+
+
+def test_103key_counts():
+    layers = dict((layer.name, layer) for layer in gerber.read_set([repo_file("103key-project/gerbers")], 1).values())
+    assert sorted(layers) == sorted(counts)
+    for name, (apertures, flashes, draws, arcs, regions) in counts.items():
+        layer = layers[name]
+        assert (len(layer.apertures), layer.count("flashes"), layer.count("draws"), layer.count("arcs"),
+                layer.region_count()) == (apertures, flashes, draws, arcs, regions), name
+
+
+def test_edge_cuts_bounds():
+    layer = gerber.read(repo_file("103key-project/gerbers/103key-Edge.Cuts.GKO"))
+    x0, y0, x1, y1 = layer.bounds()
+    assert (round(x1 - x0, 2), round(y1 - y0, 2)) == (409.65, 124.15)
+
+
+def test_smk65_regions_and_arcs():
+    layer = gerber.read(repo_file("smk65/SMK65-gerbers/smk65-F.Mask.gts"))
+    assert layer.region_count() == 213
+    assert all(len(contour) >= 3 for contour in layer.levels[0].contours())
+    edge = gerber.read(repo_file("smk65/SMK65-gerbers/smk65-Edge.Cuts.gm1"))
+    assert (edge.count("draws"), edge.count("arcs")) == (4, 4)
+
+
+def test_units_arcs_and_polarity():
+    layer = gerber.parse(sample, "sample")
+    assert layer.apertures[10].shape == "C" and tuple(layer.apertures[10].params) == pytest.approx((0.254,))
+    assert [level.dark for level in layer.levels] == [True, False, True]
+    dark = layer.levels[0]
+    assert dark.draws[10] == pytest.approx(numpy.array([[0, 0, 254, 0], [254, 0, 254, 127]]))
+    # Counter clockwise half circle around the middle of the top edge
+    assert dark.arcs[10] == pytest.approx(numpy.array([[254, 127, 0, 127, 127, 127, 0]]))
+    assert dark.flashes[11] == pytest.approx(numpy.array([[50.8, 50.8]]))
+    assert layer.levels[1].flashes[11] == pytest.approx(numpy.array([[50.8, 50.8]]))
+    contours = layer.levels[2].contours()
+    assert len(contours) == 1
+    assert contours[0] == pytest.approx(numpy.array([[76.2, 76.2], [101.6, 76.2], [101.6, 101.6]]))
+    x0, y0, x1, y1 = layer.bounds()
+    assert (x0, y0, x1, y1) == pytest.approx((-0.127, -0.127, 254.127, 127 + 127 + 0.127))
+
+
+def test_inch_polygon_aperture():
+    layer = gerber.parse(b"%FSLAX24Y24*%\n%MOIN*%\n%ADD12P,0.1X6X0X0.02*%\n%ADD13C,0.05X0.01*%\n"
+                         b"D12*\nX10000Y0D03*\nM02*\n", "polygon")
+    # Diameter and hole in mm, six vertices and no rotation as written
+    assert layer.apertures[12].params == pytest.approx((2.54, 6.0, 0.0, 0.508))
+    assert layer.apertures[13].params == pytest.approx((1.27, 0.254))
+    assert gerber.aperture_radius(layer.apertures[12]) == pytest.approx(1.27)
+    assert layer.levels[0].flashes[12] == pytest.approx(numpy.array([[25.4, 0.0]]))
@@ -0,0 +1,61 @@
+import copy
+import math
+import struct
+
+import pytest
+
+from conftest import repo_file
+
+numpy = pytest.importorskip("numpy")
+import gerber  # noqa: E402
+import gerber_diff  # noqa: E402
+
+
+def front_copper():
+    return gerber.read(repo_file("103key-project/gerbers/103key-F.Cu.GTL"))
+
+
+def test_same_layer_has_no_changes():
+    layer = front_copper()
+    assert gerber_diff.diff(layer, layer, dpi=500, processes=1) == []
+
+
+def test_removed_flash_is_one_region(tmp_path):
+    old = front_copper()
+    new = copy.deepcopy(old)
+    flashes = new.levels[0].flashes
+    assert old.apertures[11] == gerber.Aperture(11, "C", (5.0,))
+    x, y = flashes[11][5]
+    flashes[11] = numpy.delete(flashes[11], 5, axis=0)
+    image = str(tmp_path / "diff.png")
+    changes = gerber_diff.diff(old, new, dpi=500, image_name=image, processes=1)
+    assert len(changes) == 1
+    (x0, y0, x1, y1), removed, added = changes[0]
+    assert x0 < x < x1 and y0 < y < y1
+    assert removed == pytest.approx(math.pi * 2.5 ** 2, rel=0.01)
+    assert added == 0
+    with open(image, mode="rb") as png:
+        header = png.read(24)
+    assert header[:8] == b"\x89PNG\r\n\x1a\n"
+    width, height = struct.unpack(">II", header[16:24])
+    assert width > 0 and height > 0
+
+
+def test_moved_flash_is_removed_and_added():
+    old = gerber.parse(b"%FSLAX46Y46*%\n%MOMM*%\n%ADD10R,1.000000X1.000000*%\nD10*\nX0Y0D03*\nM02*\n", "old")
+    new = gerber.parse(b"%FSLAX46Y46*%\n%MOMM*%\n%ADD10R,1.000000X1.000000*%\nD10*\nX30000000Y0D03*\nM02*\n", "new")
+    changes = sorted(gerber_diff.diff(old, new, dpi=1000, processes=1))
+    assert len(changes) == 2
+    # Both 1mm squares, give or take a row and a column of pixels
+    assert [(removed, added) for _, removed, added in changes] == [
+        (pytest.approx(1.0, abs=0.05), 0.0), (0.0, pytest.approx(1.0, abs=0.05))]
+
+
+def test_rasterized_area():
+    layer = gerber.parse(b"%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,2.000000*%\nD10*\n"
+                         b"X0Y0D02*\nX10000000Y0D01*\nM02*\n", "line")
+    ppmm = 1000 / 25.4
+    window = gerber_diff.board_window([layer], ppmm)
+    pixels = gerber_diff.rasterize(layer, window, ppmm)
+    # A 10mm line 2mm wide with round ends
+    assert pixels.sum() / ppmm ** 2 == pytest.approx(20 + math.pi, rel=0.01)
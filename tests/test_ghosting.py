@@ -0,0 +1,74 @@
+from itertools import combinations
+
+from conftest import repo_file
+
+import connectivity
+import ghosting
+
+
+def grid(rows, columns, diodes=True, skip=()):
+    """Pins of a rows x columns matrix, keys S<row><column>, the keys in skip have no diode."""
+    pins = []
+    for row in range(1, rows + 1):
+        for column in range(1, columns + 1):
+            switch = "S{}{}".format(row, column)
+            if diodes and switch not in skip:
+                anode = "A{}{}".format(row, column)
+                pins += [(switch, "SW1", "C{}".format(column)), (switch, "SW2", anode),
+                         ("D{}{}".format(row, column), "1", "R{}".format(row)),
+                         ("D{}{}".format(row, column), "2", anode)]
+            else:
+                pins += [(switch, "SW1", "C{}".format(column)), (switch, "SW2", "R{}".format(row))]
+    return pins
+
+
+def brute_force(matrix):
+    """key -> size of the smallest set of other keys that ghosts it, trying every combination."""
+    smallest = {}
+    for size in range(1, len(matrix.keys)):
+        for keys in combinations(matrix.keys, size):
+            for key in matrix.names(matrix.ghosts(matrix.mask(keys))):
+                smallest.setdefault(key, size)
+    return smallest
+
+
+def test_repo_boards_have_full_nkro():
+    for name in ("103key-project/103key.kicad_pcb", "smk65/smk65.kicad_pcb"):
+        matrix = ghosting.Matrix(connectivity.read_pins(repo_file(name)))
+        assert matrix.unplaced == []
+        assert matrix.rollover() is None
+
+
+def test_repo_board_size():
+    matrix = ghosting.Matrix(connectivity.read_pins(repo_file("smk65/smk65.kicad_pcb")))
+    assert (len(matrix.positions), len(matrix.rows), len(matrix.columns)) == (71, 5, 16)
+
+
+def test_matrix_without_diodes_has_two_key_rollover():
+    matrix = ghosting.Matrix(grid(2, 2, diodes=False))
+    assert matrix.rollover() == 2
+    assert matrix.smallest_ghost_set("S22") == ["S11", "S12", "S21"]
+    assert matrix.ghosts(matrix.mask(["S11", "S12", "S21"])) == matrix.mask(["S22"])
+
+
+def test_smallest_ghost_sets_agree_with_brute_force():
+    for pins in (grid(3, 3, diodes=False), grid(3, 3, skip=("S11", "S22", "S23")), grid(2, 4, skip=("S13",))):
+        matrix = ghosting.Matrix(pins)
+        expected = brute_force(matrix)
+        found = dict((key, len(keys)) for key, keys in matrix.ghost_sets())
+        assert found == expected
+        for key, keys in matrix.ghost_sets():
+            assert matrix.ghosts(matrix.mask(keys)) >> matrix.bit[key] & 1
+
+
+def test_group_ghost_sets():
+    matrix = ghosting.Matrix(grid(2, 2, diodes=False))
+    assert matrix.group_ghost_sets(["S11", "S12"]) == []
+    assert matrix.group_ghost_sets(["S11", "S12", "S21"]) == [("S22", ["S11", "S12", "S21"])]
+
+
+def test_parallel_switches_are_one_key():
+    pins = grid(1, 2) + [("S111", "SW1", "C1"), ("S111", "SW2", "A11")]
+    matrix = ghosting.Matrix(pins)
+    assert matrix.keys == ["S11", "S12"]
+    assert matrix.refs["S11"] == ["S11", "S111"]
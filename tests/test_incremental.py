@@ -0,0 +1,32 @@
+import incremental
+
+
+class Emitter(object):
+    def __init__(self, modules):
+        self._modules = modules
+
+    def modules(self):
+        return self._modules
+
+
+def module(reference, net):
+    return "(module key (fp_text reference {}) (pad 1 smd rect (net {})))".format(reference, net).encode("utf-8")
+
+
+def test_update_keeps_tracks_and_replaces_the_net_table(tmp_path):
+    pcb = tmp_path / "board.kicad_pcb"
+    pcb.write_bytes(b"(kicad_pcb (version 4)\n"
+                    b"  (general\n    (nets 2)\n  )\n"
+                    b'  (net 0 "")\n  (net 1 C1)\n'
+                    b"  " + module("SW1", "1 C1") + b"\n"
+                    b"  (segment (start 0 0) (end 1 1) (net 1))\n)\n")
+    incremental.save_fingerprints(incremental.fingerprints_file_name(str(pcb)), {"SW1": "a"})
+    emitter = Emitter([("SW1", "b", module("SW1", "2 R1")), ("SW2", "c", module("SW2", "1 C1"))])
+    table = b'  (net 0 "")\n  (net 1 C1)\n  (net 2 R1)'
+    assert incremental.update_pcb(str(pcb), emitter, table) == (1, 1, 0)
+    data = pcb.read_bytes()
+    assert b"(nets 3)" in data
+    assert data.count(b"(net 2 R1)") == 2
+    assert b"(segment (start 0 0) (end 1 1) (net 1))" in data
+    assert b"reference SW2" in data
+    assert incremental.load_fingerprints(incremental.fingerprints_file_name(str(pcb))) == {"SW1": "b", "SW2": "c"}
@@ -0,0 +1,111 @@
+import json
+import math
+
+import pytest
+
+from conftest import repo_file
+
+import kle
+
+# A cluster turned 15 degrees around (1, 2), one row further down it, a new
+# rotation origin on y only and a reset back to no rotation
+rotated = [
+    {"name": "rotated"},
+    [{"r": 15, "rx": 1, "ry": 2, "x": -1}, "A", "B"],
+    [{"x": -1}, "C"],
+    [{"ry": 5}, "D"],
+    [{"r": 0, "rx": 0, "ry": 0, "y": 7}, "E"],
+]
+
+# Stepped caps, an ISO enter and the key after it, then a decal and two ghosts
+iso = [
+    [{"w": 1.75, "w2": 1.25, "l": True}, "Caps", "A",
+     {"x": 0.25, "w": 1.25, "h": 2, "w2": 1.5, "h2": 1, "x2": -0.25}, "Enter", "B"],
+    [{"d": True}, "decal", {"g": True}, "G1", "G2", {"g": False}, "K"],
+]
+
+
+def columns(table, *names):
+    return [list(getattr(table, name)) for name in names]
+
+
+def test_rotation_origin_and_angle_carry_on():
+    # What kle-serial gives for the same json
+    table = kle.parse(rotated)
+    assert table.legends == ["A", "B", "C", "D", "E"]
+    assert columns(table, "x", "y", "r", "rx", "ry") == [
+        [0, 1, 0, 1, 0],
+        [2, 2, 3, 5, 7],
+        [15, 15, 15, 15, 0],
+        [1, 1, 1, 1, 0],
+        [2, 2, 2, 5, 0],
+    ]
+    assert list(table.row) == [0, 0, 1, 2, 3]
+
+
+def test_rotated_placements():
+    table = kle.parse(rotated)
+    rotations, ((xs, ys), (dxs, dys)) = table.placements([(0.0, 0.0), (1.0, 0.0)])
+    assert list(rotations) == [15, 15, 15, 15, 0]
+    cos, sin = math.cos(math.radians(15)), math.sin(math.radians(15))
+    # Key centres relative to their rotation origin, turned clockwise on screen
+    for n, (cx, cy, rx, ry) in enumerate([(-0.5, 0.5, 1, 2), (0.5, 0.5, 1, 2), (-0.5, 1.5, 1, 2),
+                                          (0.5, 0.5, 1, 5)]):
+        assert (xs[n], ys[n]) == pytest.approx((rx + cx * cos - cy * sin - 0.5, ry + cx * sin + cy * cos - 0.5))
+        assert (dxs[n] - xs[n], dys[n] - ys[n]) == pytest.approx((cos, sin))
+    assert (xs[4], ys[4], dxs[4], dys[4]) == (0, 7, 1, 7)
+
+
+def test_secondary_sizes_and_flags():
+    table = kle.parse(iso)
+    assert table.legends == ["Caps", "A", "Enter", "B", "decal", "G1", "G2", "K"]
+    assert columns(table, "x", "y", "w", "h", "x2", "y2", "w2", "h2") == [
+        [0, 1.75, 3, 4.25, 0, 1, 2, 3],
+        [0, 0, 0, 0, 1, 1, 1, 1],
+        [1.75, 1, 1.25, 1, 1, 1, 1, 1],
+        [1, 1, 2, 1, 1, 1, 1, 1],
+        [0, 0, -0.25, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        # w2 and h2 default to the key's own size
+        [1.25, 1, 1.5, 1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1, 1, 1, 1],
+    ]
+    # Stepped goes after its key, ghost stays until it is turned off
+    assert list(table.flags) == [kle.STEPPED, 0, 0, 0, kle.DECAL, kle.GHOST, kle.GHOST, 0]
+    assert table.switches() == [0, 1, 2, 3, 7]
+    _, ((xs, ys),) = table.placements([(0.0, 0.0)])
+    assert list(zip(xs, ys)) == [(0.375, 0), (1.75, 0), (3.125, 0.5), (4.25, 0), (3, 1)]
+
+
+def old_generator(layout):
+    """Switch centres the way layout.py placed them before rotations were read."""
+    centres = []
+    y = 0.0
+    for row in layout:
+        if not isinstance(row, list):
+            continue
+        x, y_offset, width = 0.0, 0.0, 1.0
+        for item in row:
+            if isinstance(item, dict):
+                y_offset = (float(item.get("h", 1)) - 1) / 2
+                width = float(item.get("w", 1))
+                x += float(item.get("x", 0))
+                y += float(item.get("y", 0))
+            else:
+                centres.append((x + (width - 1.0) / 2, y + y_offset))
+                x += width
+                width = 1.0
+        y += 1
+    return centres
+
+
+def test_103key_matches_the_old_generator():
+    with open(repo_file("103key-project/103key-layout.json")) as layout_file:
+        layout = json.load(layout_file)
+    table = kle.parse(layout)
+    assert len(table) == len(table.switches()) == 103
+    rotations, ((xs, ys),) = table.placements([(0.0, 0.0)], 19.05, (2.0, 1.5))
+    assert not any(rotations)
+    expected = old_generator(layout)
+    assert list(xs) == pytest.approx([(x + 2.0) * 19.05 for x, _ in expected])
+    assert list(ys) == pytest.approx([(y + 1.5) * 19.05 for _, y in expected])
@@ -0,0 +1,44 @@
+from conftest import repo_file
+
+import connectivity
+import matrix_check
+import matrix_netlist
+import matrix_opt
+
+
+def smk65():
+    matrix = matrix_netlist.load_matrix(repo_file("smk65/smk65_matrix.json"))
+    refs = [ref for ref, switch in matrix.switches.items() if not switch["clone"]]
+    positions = matrix_opt.board_positions(repo_file("smk65/smk65.kicad_pcb"), refs)
+    return matrix, refs, [positions[ref] for ref in refs]
+
+
+def test_shapes_have_the_fewest_pins():
+    assert [(shape.rows, shape.columns) for shape in matrix_opt.shapes(71)] == [(8, 9), (8, 9), (9, 8), (9, 8)]
+    assert all(shape.rows + shape.columns <= 18 for shape in matrix_opt.shapes(71, slack=1))
+    duplex = [shape for shape in matrix_opt.shapes(71, duplex=True) if shape.duplex]
+    assert min(shape.rows + shape.columns for shape in duplex) == 12
+
+
+def test_anneal_shortens_the_nets():
+    _, _, points = smk65()
+    shape = matrix_opt.shapes(len(points))[0]
+    result = matrix_opt.anneal(points, shape, seed=0, iterations=3000)
+    # Every key on its own crossing, within the shape
+    assert len(set(result.slots)) == len(points)
+    assert all(row < shape.rows and column < shape.columns for row, column, _ in result.slots)
+    assert result.pins == matrix_opt.pin_count(result.slots) <= 17
+    assert result.length < matrix_opt.net_length(points, matrix_opt.initial_slots(points, shape))
+    assert result == matrix_opt.anneal(points, shape, seed=0, iterations=3000)
+
+
+def test_applied_matrix_is_valid():
+    matrix, refs, points = smk65()
+    result = matrix_opt.anneal(points, matrix_opt.shapes(len(points))[0], seed=1, iterations=2000)
+    optimized = matrix_opt.apply(matrix, refs, points, result.slots)
+    assert len(optimized.matrix_to_mcu) == result.pins
+    assert [finding for finding in matrix_check.validate(optimized.switches, matrix_netlist.connections(optimized))
+            if finding.level == matrix_check.ERROR] == []
+    pins = [(ref, pin, net) for net, nodes in matrix_netlist.matrix_nets(optimized).items() for ref, pin in nodes]
+    assert [finding for finding in connectivity.check(pins, check_leds=False)
+            if finding.level == connectivity.ERROR] == []
@@ -0,0 +1,66 @@
+import json
+
+from conftest import repo_file
+
+import kle
+import netlist
+
+
+def layout_keys():
+    with open(repo_file("103key-project/103key-layout.json")) as layout_file:
+        keys = kle.parse(json.load(layout_file))
+    _, ((xs, ys),) = keys.placements([(0.0, 0.0)], 1.0, (2.0, 1.5), keys.switches())
+    return list(xs), list(ys)
+
+
+def test_rows_and_columns_from_geometry():
+    # Two rows listed out of order, the second with a 1.5u key first
+    xs = [2.5, 0.5, 1.5, 0.75, 2.25, 3.25]
+    ys = [0.5, 0.5, 0.5, 1.5, 1.5, 1.5]
+    assert netlist.matrix(xs, ys) == [(0, 2), (0, 0), (0, 1), (1, 0), (1, 1), (1, 2)]
+
+
+def test_every_position_is_used_once():
+    xs, ys = layout_keys()
+    positions = netlist.matrix(xs, ys)
+    assert len(set(positions)) == len(positions) == 103
+    assert max(row for row, _ in positions) == 5
+    assert max(column for _, column in positions) == 21
+
+
+def test_max_columns():
+    xs, ys = layout_keys()
+    positions = netlist.matrix(xs, ys, max_columns=12)
+    assert len(set(positions)) == len(positions)
+    assert max(column for _, column in positions) == 11
+
+
+def moved(xs, ys, key, dx):
+    before = netlist.matrix(xs, ys)
+    xs = list(xs)
+    xs[key] += dx
+    after = netlist.matrix(xs, ys)
+    assert [after[n] for n in range(len(xs)) if n != key] == [before[n] for n in range(len(xs)) if n != key]
+    return before[key], after[key]
+
+
+def test_moving_the_leftmost_key_only_moves_it():
+    xs, ys = layout_keys()
+    # Esc, alone at the left when it moves, stays in the first column
+    assert (xs[0], ys[0]) == (2.0, 1.5)
+    assert moved(xs, ys, 0, -0.4) == ((0, 0), (0, 0))
+    # The bottom row's leftmost key takes the free first column
+    assert (xs[91], ys[91]) == (2.5, 7.0)
+    assert moved(xs, ys, 91, -0.5) == ((5, 1), (5, 0))
+
+
+def test_existing_net_codes_are_kept():
+    nets = netlist.Netlist({0: "", 1: "C1", 2: "R1", 4: "Net-(D1-Pad2)"})
+    assert nets.connect("R1", "D1", "1") == "2 R1"
+    assert nets.connect("R2", "D2", "1") == "5 R2"
+    assert nets.pcb_table().splitlines() == [
+        '  (net 0 "")', "  (net 1 C1)", "  (net 2 R1)", '  (net 4 "Net-(D1-Pad2)")', "  (net 5 R2)"]
+    assert len(nets) == 5
+    # Nets that nothing connects to any more stay out of the .net file
+    export = nets.export()
+    assert "(name R2)" in export and "(name R1)" in export and "(name C1)" not in export
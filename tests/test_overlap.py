@@ -0,0 +1,49 @@
+import json
+
+from conftest import repo_file
+
+import kle
+import overlap
+from overlap import Box, GridHash
+
+
+def clones(layout):
+    return overlap.clones(kle.parse(layout))
+
+
+def test_grid_hash_finds_items_in_touched_cells_once():
+    grid = GridHash(1.0)
+    grid.add("wide", Box(0.1, 0.1, 2.9, 0.9))
+    grid.add("far", Box(5.2, 5.2, 5.8, 5.8))
+    assert grid.near(Box(2.2, 0.2, 2.4, 0.4)) == ["wide"]
+    assert grid.near(Box(0.0, 0.0, 6.0, 6.0)) == ["wide", "far"]
+    assert grid.near(Box(3.1, 3.1, 3.9, 3.9)) == []
+
+
+def test_layout_without_overlaps():
+    with open(repo_file("103key-project/103key-layout.json")) as layout_file:
+        parents, reversed_keys = clones(json.load(layout_file))
+    assert len(parents) == 103
+    assert parents == [None] * 103 and not any(reversed_keys)
+
+
+def test_split_backspace():
+    # A 2u backspace with the two 1u keys of a split backspace on top of it
+    parents, reversed_keys = clones([["A", {"w": 2}, "Backspace"], [{"y": -1, "x": 1}, "B", "C"]])
+    assert parents == [None, None, 1, None]
+    assert reversed_keys == [False] * 4
+
+
+def test_spacebar_sizes():
+    # A 7u spacebar over a 6.25u one, a key next to the shorter one only
+    # overlaps the longer by a third
+    parents, _ = clones([[{"w": 6.25}, "Space", {"w": 2.25}, "Alt"], [{"y": -1, "w": 7}, "Space"]])
+    assert parents == [None, None, 0]
+    parents, _ = clones([[{"w": 6.25}, "Space"], [{"y": -1, "x": 1, "w": 2.25}, "L"]])
+    assert parents == [None, 0]
+
+
+def test_turned_alternative_is_reversed():
+    parents, reversed_keys = clones([["A"], [{"y": -1, "r": 180, "rx": 0.5, "ry": 0.5, "x": -0.5, "y": -0.5}, "B"]])
+    assert parents == [None, 0]
+    assert reversed_keys == [False, True]